@@ -0,0 +1,91 @@
+# 各ハンドラのコールドスタート相当の時間を計測する
+# 新しいPythonプロセスでハンドラのモジュールを import し（import 時間）、
+# 宣言されたAWSクライアントをすべて作る（初期化時間）までを、ハンドラごとに繰り返し測る
+# 使い方: python bench/bench_cold_start.py [--repeat 5]
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+LAMBDA_DIR = os.path.join(REPO_DIR, 'lambda')
+sys.path.insert(0, REPO_DIR)
+
+from programming_contest.lambda_bundles import handler_modules
+
+HANDLERS = ['submit', 'judge_worker', 'submissions', 'leaderboard', 'leaderboard_publisher',
+            'reset', 'game_state', 'epoch_gc', 'rejudge', 'rejudge_worker', 'websocket']
+
+# ネットワークには接続しない（クライアントの作成だけを測る）
+ENVIRONMENT = {
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'bench',
+    'AWS_SECRET_ACCESS_KEY': 'bench',
+    'LEADERBOARD_TABLE': 'LeaderboardTable',
+    'STANDINGS_TABLE': 'StandingsTable',
+    'GAME_STATE_TABLE': 'GameStateTable',
+    'JUDGE_CACHE_TABLE': 'JudgeCacheTable',
+    'JUDGE_JOBS_TABLE': 'JudgeJobsTable',
+    'JUDGE_QUEUE_URL': 'https://sqs.us-east-1.amazonaws.com/000000000000/JudgeQueue',
+    'CODE_INTERPRETER_ID': 'bench',
+    'WEBSITE_BUCKET': 'bench',
+    'EPOCH_GC_FUNCTION': 'bench',
+    'SOLUTIONS_BUCKET': 'bench',
+    'SOLUTIONS_TABLE': 'SolutionsTable',
+    'REJUDGE_QUEUE_URL': 'https://sqs.us-east-1.amazonaws.com/000000000000/RejudgeQueue',
+    'CONNECTIONS_TABLE': 'ConnectionsTable',
+    'WEBSOCKET_ENDPOINT': 'https://bench.execute-api.us-east-1.amazonaws.com/live'
+}
+
+PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+import aws_clients
+clients = aws_clients.resolve_all()
+initialized = time.perf_counter()
+print(json.dumps({{
+    'import_ms': (imported - started) * 1000,
+    'init_ms': (initialized - imported) * 1000,
+    'clients': clients
+}}))
+'''
+
+
+def measure(module):
+    env = {**os.environ, **ENVIRONMENT, 'PYTHONDONTWRITEBYTECODE': '1'}
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE.format(module=module)],
+        cwd=LAMBDA_DIR, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def bundle_kb(module):
+    return sum(os.path.getsize(os.path.join(LAMBDA_DIR, name)) for name in handler_modules(module)) / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('handlers', nargs='*', default=HANDLERS)
+    args = parser.parse_args()
+
+    full_kb = sum(os.path.getsize(os.path.join(LAMBDA_DIR, name))
+                  for name in os.listdir(LAMBDA_DIR) if name.endswith('.py')) / 1024
+    print(f"{'handler':<24}{'import ms':>10}{'init ms':>10}{'total ms':>10}{'clients':>9}{'bundle KB':>11}")
+    for module in args.handlers:
+        runs = [measure(module) for _ in range(args.repeat)]
+        import_ms = statistics.median(run['import_ms'] for run in runs)
+        init_ms = statistics.median(run['init_ms'] for run in runs)
+        print(f"{module:<24}{import_ms:>10.1f}{init_ms:>10.1f}{import_ms + init_ms:>10.1f}"
+              f"{runs[0]['clients']:>9}{bundle_kb(module):>11.1f}")
+    print(f"(the whole lambda directory is {full_kb:.1f} KB)")
+
+
+if __name__ == '__main__':
+    main()
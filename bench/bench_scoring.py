@@ -0,0 +1,85 @@
+# 採点エンジンのベンチマーク
+# 使い方: python bench/bench_scoring.py [--users 10000] [--problems 50] [--updates 1000] [--rule icpc]
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+from scoring import ScoringRules, UserState, RankedBoard, RULE_COUNT, RULE_ICPC, RULE_POINTS
+from standings import build_rows
+
+STARTED_AT_MS = 1_700_000_000_000
+
+
+def make_states(users, problems, rng):
+    states = []
+    for i in range(users):
+        state = UserState(f'user{i:05d}', solve_times=[0] * problems, wrong_attempts=[0] * problems)
+        for n in range(1, problems + 1):
+            if rng.random() < 0.3:
+                state.wrong_attempts[n - 1] = rng.randint(0, 3)
+                state.solve(n, STARTED_AT_MS + rng.randint(1, 3 * 3600 * 1000))
+        states.append(state)
+    return states
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--problems', type=int, default=50)
+    parser.add_argument('--updates', type=int, default=1000)
+    parser.add_argument('--rule', choices=[RULE_COUNT, RULE_ICPC, RULE_POINTS], default=RULE_ICPC)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    problem_numbers = range(1, args.problems + 1)
+    rules = ScoringRules(problem_numbers, args.rule, {n: 100 * (1 + n % 5) for n in problem_numbers},
+                         started_at_ms=STARTED_AT_MS)
+    states = make_states(args.users, args.problems, rng)
+
+    ordered, full_sort = timed(lambda: sorted(states, key=rules.sort_key))
+    _, rows = timed(lambda: build_rows(ordered, rules))
+
+    board = RankedBoard(rules)
+    _, seed_board = timed(lambda: [board.upsert(state) for state in states])
+
+    # 1人ずつ正解を追加し、全体ソートと差分更新の1回あたりの時間を比べる
+    updates = []
+    for _ in range(args.updates):
+        state = rng.choice(states)
+        unsolved = [n for n in problem_numbers if not state.is_solved(n)]
+        if unsolved:
+            updates.append((state, rng.choice(unsolved)))
+
+    def apply_incremental():
+        for state, n in updates:
+            state.solve(n, STARTED_AT_MS + 4 * 3600 * 1000)
+            board.upsert(state)
+    _, incremental = timed(apply_incremental)
+
+    sample = updates[:20]
+    _, resort = timed(lambda: [sorted(states, key=rules.sort_key) for _ in sample])
+
+    assert [s.username for s in board.states()] == [s.username for s in sorted(states, key=rules.sort_key)]
+
+    count = max(len(updates), 1)
+    print(f'rule={args.rule} users={args.users} problems={args.problems} updates={len(updates)}')
+    print(f'full sort:             {full_sort * 1000:9.2f} ms')
+    print(f'build rows:            {rows * 1000:9.2f} ms')
+    print(f'seed ranked board:     {seed_board * 1000:9.2f} ms')
+    print(f'full sort per update:  {resort / max(len(sample), 1) * 1000:9.3f} ms')
+    print(f'incremental per update:{incremental / count * 1000:9.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,988 @@
+# ベンチマーク・負荷試験用のAWSのローカル代替
+# boto3.client / boto3.resource を差し替え、ハンドラをAWSアカウントなしでプロセス内で動かす
+#   FakeTable                  DynamoDB のテーブル（式の評価・条件付き書き込み・ページングを含む）
+#   FakeDynamoClient           dynamodb クライアント（TransactWriteItems）
+#   FakeS3Client               S3（ETagによる条件付きGETを含む）
+#   FakeCodeInterpreterClient  bedrock-agentcore（セッションごとに状態を持つPythonプロセスで executeCode を実行）
+#   Faults                     FakeCodeInterpreterClient に注入するスロットリング・障害
+#   FakeLambdaClient           lambda（非同期呼び出しは登録した関数をバックグラウンドで実行）
+# すべての呼び出しは CallRecorder に記録され、リクエストごとのAWS呼び出し回数を数えられる
+import contextvars
+import hashlib
+import io
+import itertools
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+
+import boto3
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+
+def client_error(code, operation, message=''):
+    return ClientError({'Error': {'Code': code, 'Message': message or code}}, operation)
+
+
+class CallRecorder:
+    # 全体の呼び出し回数と、現在のリクエスト（contextvars で伝搬）ごとの呼び出し回数を数える
+    def __init__(self):
+        self.total = Counter()
+        self._lock = threading.Lock()
+        self._current = contextvars.ContextVar('aws_calls', default=None)
+
+    def record(self, service, operation):
+        name = f'{service}.{operation}'
+        with self._lock:
+            self.total[name] += 1
+            calls = self._current.get()
+            if calls is not None:
+                calls[name] += 1
+
+    def start_request(self):
+        # 戻り値の Counter に、このコンテキストから行われた呼び出しが記録される
+        calls = Counter()
+        self._current.set(calls)
+        return calls
+
+
+class Latency:
+    def __init__(self, base_ms=0.0, jitter_ms=0.0, rng=None):
+        self.base_ms = base_ms
+        self.jitter_ms = jitter_ms
+        self.rng = rng or random.Random()
+
+    def sleep(self):
+        delay_ms = self.base_ms + (self.rng.uniform(0, self.jitter_ms) if self.jitter_ms else 0.0)
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+
+
+# ---- DynamoDB の式 ----
+
+MISSING = object()
+
+TOKEN_PATTERN = re.compile(r'\s*(?:(<>|<=|>=|[=<>()\[\],.+-])|(#\w+|:\w+|\w+))')
+UPDATE_CLAUSES = ('SET', 'ADD', 'REMOVE', 'DELETE')
+
+
+def tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = TOKEN_PATTERN.match(expression, position)
+        if not match:
+            raise ValueError(f'Cannot parse expression at {expression[position:]!r}')
+        tokens.append(match.group(1) or match.group(2))
+        position = match.end()
+    return tokens
+
+
+class ExpressionParser:
+    def __init__(self, expression, names, values):
+        self.tokens = tokenize(expression)
+        self.position = 0
+        self.names = names or {}
+        self.values = values or {}
+
+    def peek(self, offset=0):
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else None
+
+    def take(self, expected=None):
+        token = self.peek()
+        if token is None or (expected is not None and token.upper() != expected):
+            raise ValueError(f'Expected {expected!r}, got {token!r}')
+        self.position += 1
+        return token
+
+    def at_end(self):
+        return self.position >= len(self.tokens)
+
+    def keyword(self, word):
+        token = self.peek()
+        return token is not None and token.upper() == word
+
+    # パス: name | #name, 続けて [n] や .name
+    def path(self):
+        token = self.take()
+        elements = [self.names[token] if token.startswith('#') else token]
+        while self.peek() in ('[', '.'):
+            if self.take() == '[':
+                elements.append(int(self.take()))
+                self.take(']')
+            else:
+                token = self.take()
+                elements.append(self.names[token] if token.startswith('#') else token)
+        return elements
+
+    def operand(self):
+        token = self.peek()
+        if token.startswith(':'):
+            self.take()
+            value = self.values[token]
+            return lambda item: value
+        if token == 'size' and self.peek(1) == '(':
+            self.take()
+            self.take('(')
+            path = self.path()
+            self.take(')')
+            return lambda item: size_of(get_path(item, path))
+        path = self.path()
+        return lambda item: get_path(item, path)
+
+    # ---- 条件式 ----
+    def condition(self):
+        left = self.conjunction()
+        while self.keyword('OR'):
+            self.take()
+            right = self.conjunction()
+            left = (lambda a, b: lambda item: a(item) or b(item))(left, right)
+        return left
+
+    def conjunction(self):
+        left = self.negation()
+        while self.keyword('AND'):
+            self.take()
+            right = self.negation()
+            left = (lambda a, b: lambda item: a(item) and b(item))(left, right)
+        return left
+
+    def negation(self):
+        if self.keyword('NOT'):
+            self.take()
+            inner = self.negation()
+            return lambda item: not inner(item)
+        return self.predicate()
+
+    def predicate(self):
+        token = self.peek()
+        if token == '(':
+            self.take()
+            inner = self.condition()
+            self.take(')')
+            return inner
+        if token in ('attribute_exists', 'attribute_not_exists'):
+            self.take()
+            self.take('(')
+            path = self.path()
+            self.take(')')
+            exists = token == 'attribute_exists'
+            return lambda item: (get_path(item, path) is not MISSING) == exists
+        if token in ('contains', 'begins_with'):
+            self.take()
+            self.take('(')
+            path = self.path()
+            self.take(',')
+            operand = self.operand()
+            self.take(')')
+            if token == 'contains':
+                return lambda item: contains(get_path(item, path), operand(item))
+            return lambda item: begins_with(get_path(item, path), operand(item))
+        left = self.operand()
+        if self.keyword('BETWEEN'):
+            self.take()
+            low = self.operand()
+            self.take('AND')
+            high = self.operand()
+            return lambda item: compare(left(item), '>=', low(item)) and compare(left(item), '<=', high(item))
+        if self.keyword('IN'):
+            self.take()
+            self.take('(')
+            options = [self.operand()]
+            while self.peek() == ',':
+                self.take()
+                options.append(self.operand())
+            self.take(')')
+            return lambda item: any(compare(left(item), '=', option(item)) for option in options)
+        operator = self.take()
+        right = self.operand()
+        return lambda item: compare(left(item), operator, right(item))
+
+    # ---- 更新式 ----
+    def update(self):
+        actions = []
+        while not self.at_end():
+            clause = self.take().upper()
+            if clause not in UPDATE_CLAUSES:
+                raise ValueError(f'Unknown update clause {clause!r}')
+            while True:
+                actions.append(self.update_action(clause))
+                if self.peek() != ',':
+                    break
+                self.take()
+        return actions
+
+    def update_action(self, clause):
+        path = self.path()
+        if clause == 'REMOVE':
+            return clause, path, None
+        if clause == 'SET':
+            self.take('=')
+            return clause, path, self.set_value()
+        return clause, path, self.operand()
+
+    def set_value(self):
+        left = self.set_term()
+        if self.peek() in ('+', '-'):
+            operator = self.take()
+            right = self.set_term()
+            if operator == '+':
+                return lambda item: left(item) + right(item)
+            return lambda item: left(item) - right(item)
+        return left
+
+    def set_term(self):
+        token = self.peek()
+        if token in ('if_not_exists', 'list_append') and self.peek(1) == '(':
+            self.take()
+            self.take('(')
+            if token == 'if_not_exists':
+                path = self.path()
+                self.take(',')
+                default = self.set_value()
+                self.take(')')
+                return lambda item: value_or(get_path(item, path), default, item)
+            first = self.set_value()
+            self.take(',')
+            second = self.set_value()
+            self.take(')')
+            return lambda item: list(first(item)) + list(second(item))
+        operand = self.operand()
+
+        def value(item):
+            result = operand(item)
+            if result is MISSING:
+                raise client_error('ValidationException', 'UpdateItem',
+                                   'The provided expression refers to an attribute that does not exist in the item')
+            return result
+        return value
+
+
+def value_or(value, default, item):
+    return default(item) if value is MISSING else value
+
+
+def get_path(item, path):
+    current = item
+    for element in path:
+        if isinstance(element, int):
+            if not isinstance(current, list) or element >= len(current):
+                return MISSING
+        elif not isinstance(current, dict) or element not in current:
+            return MISSING
+        current = current[element]
+    return current
+
+
+def set_path(item, path, value):
+    parent = item
+    for element in path[:-1]:
+        parent = parent[element]
+    last = path[-1]
+    if isinstance(last, int) and last >= len(parent):
+        # 範囲外のインデックスへの SET はリストの末尾に追加される
+        parent.append(value)
+    else:
+        parent[last] = value
+
+
+def remove_path(item, path):
+    parent = get_path(item, path[:-1]) if len(path) > 1 else item
+    if parent is MISSING:
+        return
+    last = path[-1]
+    if isinstance(last, int):
+        if last < len(parent):
+            del parent[last]
+    else:
+        parent.pop(last, None)
+
+
+def size_of(value):
+    if value is MISSING:
+        return MISSING
+    if isinstance(value, (str, bytes, list, set, dict)):
+        return Decimal(len(value))
+    return MISSING
+
+
+def contains(container, value):
+    if container is MISSING or value is MISSING:
+        return False
+    if isinstance(container, str):
+        return isinstance(value, str) and value in container
+    if isinstance(container, (set, list)):
+        return value in container
+    return False
+
+
+def begins_with(value, prefix):
+    return isinstance(value, str) and isinstance(prefix, str) and value.startswith(prefix)
+
+
+def compare(left, operator, right):
+    if left is MISSING or right is MISSING:
+        return operator == '<>' and (left is MISSING) != (right is MISSING)
+    comparable = (isinstance(left, Decimal) and isinstance(right, Decimal)) or type(left) is type(right)
+    if operator == '=':
+        return comparable and left == right
+    if operator == '<>':
+        return not comparable or left != right
+    if not comparable:
+        return False
+    if operator == '<':
+        return left < right
+    if operator == '<=':
+        return left <= right
+    if operator == '>':
+        return left > right
+    if operator == '>=':
+        return left >= right
+    raise ValueError(f'Unknown comparator {operator!r}')
+
+
+def apply_update(item, actions):
+    # 右辺はすべて更新前の値で評価してから適用する（DynamoDB と同じ）
+    before = normalize(item)
+    for clause, path, operand in actions:
+        if clause == 'REMOVE':
+            remove_path(item, path)
+            continue
+        value = operand(before)
+        current = get_path(item, path)
+        if clause == 'SET':
+            set_path(item, path, value)
+        elif clause == 'ADD':
+            if current is MISSING:
+                set_path(item, path, value)
+            elif isinstance(current, set):
+                set_path(item, path, current | value)
+            else:
+                set_path(item, path, current + value)
+        elif clause == 'DELETE' and current is not MISSING:
+            remaining = current - value
+            if remaining:
+                set_path(item, path, remaining)
+            else:
+                remove_path(item, path)
+
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+def normalize(value):
+    # 実際のDynamoDBと同じく、数値は Decimal になり、float などの未対応の型は TypeError になる
+    return _deserializer.deserialize(_serializer.serialize(value))
+
+
+def normalize_values(values):
+    return {k: normalize(v) for k, v in (values or {}).items()}
+
+
+# ---- DynamoDB ----
+
+class FakeTable:
+    def __init__(self, name, keys, recorder, indexes=None, latency=None, page_size=None, stream=False):
+        # keys: [パーティションキー] または [パーティションキー, ソートキー]
+        # indexes: {インデックス名: キーのリスト}（グローバルセカンダリインデックス）
+        self.name = name
+        self.table_name = name
+        self.keys = list(keys)
+        self.indexes = dict(indexes or {})
+        self.recorder = recorder
+        self.latency = latency or Latency()
+        self.page_size = page_size
+        self.items = {}
+        self.stream_records = [] if stream else None
+        self._lock = threading.RLock()
+
+    def _call(self, operation):
+        self.recorder.record('dynamodb', operation)
+        self.latency.sleep()
+
+    def _key_of(self, item):
+        return tuple(item[k] for k in self.keys)
+
+    def _parse_condition(self, kwargs, key='ConditionExpression'):
+        if key not in kwargs:
+            return None
+        return ExpressionParser(kwargs[key], kwargs.get('ExpressionAttributeNames'),
+                                normalize_values(kwargs.get('ExpressionAttributeValues'))).condition()
+
+    def _check(self, condition, item, operation):
+        if condition is not None and not condition(item if item is not None else {}):
+            raise client_error('ConditionalCheckFailedException', operation, 'The conditional request failed')
+
+    def _emit(self, event_name, key, old, new):
+        if self.stream_records is None:
+            return
+        record = {'eventName': event_name, 'dynamodb': {
+            'Keys': {k: _serializer.serialize(v) for k, v in zip(self.keys, key)}
+        }}
+        if new is not None:
+            record['dynamodb']['NewImage'] = {k: _serializer.serialize(v) for k, v in new.items()}
+        if old is not None:
+            record['dynamodb']['OldImage'] = {k: _serializer.serialize(v) for k, v in old.items()}
+        self.stream_records.append(record)
+
+    def drain_stream(self):
+        with self._lock:
+            records, self.stream_records = self.stream_records, []
+            return records
+
+    def get_item(self, Key, ConsistentRead=False, **kwargs):
+        self._call('GetItem')
+        with self._lock:
+            item = self.items.get(self._key_of(normalize(Key)))
+            return {'Item': normalize(item)} if item is not None else {}
+
+    def put_item(self, Item, **kwargs):
+        self._call('PutItem')
+        condition = self._parse_condition(kwargs)
+        item = normalize(Item)
+        key = self._key_of(item)
+        with self._lock:
+            old = self.items.get(key)
+            self._check(condition, old, 'PutItem')
+            self.items[key] = item
+            self._emit('MODIFY' if old is not None else 'INSERT', key, old, item)
+        return {}
+
+    def delete_item(self, Key, **kwargs):
+        self._call('DeleteItem')
+        condition = self._parse_condition(kwargs)
+        key = self._key_of(normalize(Key))
+        with self._lock:
+            old = self.items.get(key)
+            self._check(condition, old, 'DeleteItem')
+            if old is not None:
+                del self.items[key]
+                self._emit('REMOVE', key, old, None)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ReturnValues='NONE', **kwargs):
+        self._call('UpdateItem')
+        condition = self._parse_condition(kwargs)
+        actions = ExpressionParser(UpdateExpression, kwargs.get('ExpressionAttributeNames'),
+                                   normalize_values(kwargs.get('ExpressionAttributeValues'))).update()
+        key_item = normalize(Key)
+        key = self._key_of(key_item)
+        with self._lock:
+            old = self.items.get(key)
+            self._check(condition, old, 'UpdateItem')
+            item = normalize(old) if old is not None else dict(key_item)
+            apply_update(item, actions)
+            item = normalize(item)
+            self.items[key] = item
+            self._emit('MODIFY' if old is not None else 'INSERT', key, old, item)
+        if ReturnValues == 'ALL_NEW':
+            return {'Attributes': normalize(item)}
+        if ReturnValues == 'ALL_OLD':
+            return {'Attributes': normalize(old)} if old is not None else {}
+        if ReturnValues == 'UPDATED_NEW':
+            updated = {path[0] for _, path, _ in actions}
+            return {'Attributes': {k: v for k, v in normalize(item).items() if k in updated}}
+        return {}
+
+    def _page(self, items, key_names, kwargs, operation):
+        filter_condition = self._parse_condition(kwargs, 'FilterExpression')
+        start = kwargs.get('ExclusiveStartKey')
+        if start is not None:
+            start = tuple(normalize(start)[k] for k in key_names)
+            items = [item for item in items if tuple(item[k] for k in key_names) > start] \
+                if kwargs.get('ScanIndexForward', True) else \
+                [item for item in items if tuple(item[k] for k in key_names) < start]
+        limit = kwargs.get('Limit') or self.page_size
+        last_key = None
+        if limit is not None and len(items) > limit:
+            items = items[:limit]
+            last_key = {k: items[-1][k] for k in dict.fromkeys(key_names + self.keys)}
+        if filter_condition is not None:
+            items = [item for item in items if filter_condition(item)]
+        if 'ProjectionExpression' in kwargs:
+            names = kwargs.get('ExpressionAttributeNames', {})
+            projected = [names.get(n.strip(), n.strip()) for n in kwargs['ProjectionExpression'].split(',')]
+            items = [{k: item[k] for k in projected if k in item} for item in items]
+        response = {'Items': [normalize(item) for item in items], 'Count': len(items)}
+        if last_key is not None:
+            response['LastEvaluatedKey'] = normalize(last_key)
+        return response
+
+    def query(self, KeyConditionExpression, **kwargs):
+        self._call('Query')
+        if not isinstance(KeyConditionExpression, str):
+            raise NotImplementedError('Use string key condition expressions with FakeTable')
+        key_condition = ExpressionParser(KeyConditionExpression, kwargs.get('ExpressionAttributeNames'),
+                                         normalize_values(kwargs.get('ExpressionAttributeValues'))).condition()
+        key_names = self.indexes[kwargs['IndexName']] if 'IndexName' in kwargs else self.keys
+        with self._lock:
+            items = [item for item in self.items.values()
+                     if all(k in item for k in key_names) and key_condition(item)]
+        items.sort(key=lambda item: tuple(item[k] for k in key_names + self.keys),
+                   reverse=not kwargs.get('ScanIndexForward', True))
+        return self._page(items, key_names + [k for k in self.keys if k not in key_names], kwargs, 'Query')
+
+    def scan(self, **kwargs):
+        self._call('Scan')
+        with self._lock:
+            items = list(self.items.values())
+        if 'TotalSegments' in kwargs:
+            total, segment = kwargs['TotalSegments'], kwargs['Segment']
+            items = [item for item in items
+                     if int(hashlib.md5(repr(self._key_of(item)).encode()).hexdigest(), 16) % total == segment]
+        items.sort(key=self._key_of)
+        return self._page(items, self.keys, kwargs, 'Scan')
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        return FakeBatchWriter(self)
+
+
+class FakeBatchWriter:
+    BATCH_SIZE = 25
+
+    def __init__(self, table):
+        self.table = table
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def put_item(self, Item):
+        self.pending.append(('put', Item))
+        if len(self.pending) >= self.BATCH_SIZE:
+            self.flush()
+
+    def delete_item(self, Key):
+        self.pending.append(('delete', Key))
+        if len(self.pending) >= self.BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        table = self.table
+        table._call('BatchWriteItem')
+        with table._lock:
+            for action, value in self.pending:
+                value = normalize(value)
+                key = table._key_of(value)
+                old = table.items.get(key)
+                if action == 'put':
+                    table.items[key] = value
+                    table._emit('MODIFY' if old is not None else 'INSERT', key, old, value)
+                elif old is not None:
+                    del table.items[key]
+                    table._emit('REMOVE', key, old, None)
+        self.pending = []
+
+
+class FakeDynamoResource:
+    def __init__(self, tables, recorder=None, latency=None):
+        self.tables = tables
+        self.recorder = recorder or CallRecorder()
+        self.latency = latency or Latency()
+
+    def Table(self, name):
+        if name not in self.tables:
+            raise client_error('ResourceNotFoundException', 'DescribeTable', f'Table {name} not found')
+        return self.tables[name]
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        self.recorder.record('dynamodb', 'BatchGetItem')
+        self.latency.sleep()
+        responses = {}
+        for name, request in RequestItems.items():
+            table = self.Table(name)
+            with table._lock:
+                items = [table.items.get(table._key_of(normalize(key))) for key in request['Keys']]
+            responses[name] = [normalize(item) for item in items if item is not None]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+
+class FakeDynamoClient:
+    # 低レベルAPI（型付きの属性値）のうち、トランザクション書き込みだけを再現する
+    def __init__(self, tables, recorder, latency=None):
+        self.tables = tables
+        self.recorder = recorder
+        self.latency = latency or Latency()
+
+    def transact_write_items(self, TransactItems, **kwargs):
+        self.recorder.record('dynamodb', 'TransactWriteItems')
+        self.latency.sleep()
+        operations = []
+        for entry in TransactItems:
+            (action, request), = entry.items()
+            table = self.tables[request['TableName']]
+            request = {k: deserialize_typed(v) if k in ('Item', 'Key', 'ExpressionAttributeValues') else v
+                       for k, v in request.items()}
+            operations.append((action, table, request))
+        tables = sorted({id(table): table for _, table, _ in operations}.values(), key=lambda t: t.name)
+        for table in tables:
+            table._lock.acquire()
+        try:
+            # すべての条件を先に評価し、1つでも満たさなければ何も書き込まない
+            reasons = []
+            for action, table, request in operations:
+                key = table._key_of(normalize(request['Item'] if action == 'Put' else request['Key']))
+                condition = table._parse_condition(request)
+                ok = condition is None or condition(table.items.get(key) or {})
+                reasons.append({'Code': 'None' if ok else 'ConditionalCheckFailed'})
+            if any(reason['Code'] != 'None' for reason in reasons):
+                error = client_error('TransactionCanceledException', 'TransactWriteItems', 'Transaction cancelled')
+                error.response['CancellationReasons'] = reasons
+                raise error
+            for action, table, request in operations:
+                if action == 'Put':
+                    item = normalize(request['Item'])
+                    key = table._key_of(item)
+                    old = table.items.get(key)
+                    table.items[key] = item
+                    table._emit('MODIFY' if old is not None else 'INSERT', key, old, item)
+                elif action == 'Update':
+                    key_item = normalize(request['Key'])
+                    key = table._key_of(key_item)
+                    old = table.items.get(key)
+                    actions = ExpressionParser(request['UpdateExpression'], request.get('ExpressionAttributeNames'),
+                                               normalize_values(request.get('ExpressionAttributeValues'))).update()
+                    item = normalize(old) if old is not None else dict(key_item)
+                    apply_update(item, actions)
+                    item = normalize(item)
+                    table.items[key] = item
+                    table._emit('MODIFY' if old is not None else 'INSERT', key, old, item)
+                elif action == 'Delete':
+                    key = table._key_of(normalize(request['Key']))
+                    old = table.items.pop(key, None)
+                    if old is not None:
+                        table._emit('REMOVE', key, old, None)
+        finally:
+            for table in reversed(tables):
+                table._lock.release()
+        return {}
+
+
+def deserialize_typed(values):
+    return {k: _deserializer.deserialize(v) for k, v in values.items()}
+
+
+# ---- S3 ----
+
+class FakeS3Client:
+    def __init__(self, recorder, latency=None):
+        self.recorder = recorder
+        self.latency = latency or Latency()
+        self.objects = {}
+        self._lock = threading.Lock()
+
+    def _call(self, operation):
+        self.recorder.record('s3', operation)
+        self.latency.sleep()
+
+    def put_object(self, Bucket, Key, Body, Metadata=None, **kwargs):
+        self._call('PutObject')
+        body = Body.encode('utf-8') if isinstance(Body, str) else bytes(Body)
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if_none_match = kwargs.pop('IfNoneMatch', None)
+        if_match = kwargs.pop('IfMatch', None)
+        with self._lock:
+            # IfNoneMatch='*' は同じキーのオブジェクトがまだ無いときだけ、IfMatch は ETag が一致するときだけ書き込む
+            stored = self.objects.get((Bucket, Key))
+            if ((if_none_match == '*' and stored is not None)
+                    or (if_match is not None and (stored is None or stored['etag'] != if_match))):
+                raise client_error('PreconditionFailed', 'PutObject', 'At least one of the pre-conditions you specified did not hold')
+            self.objects[(Bucket, Key)] = {'body': body, 'etag': etag, 'metadata': dict(Metadata or {}), **kwargs}
+        return {'ETag': etag}
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None, **kwargs):
+        self._call('GetObject')
+        with self._lock:
+            stored = self.objects.get((Bucket, Key))
+        if stored is None:
+            raise client_error('NoSuchKey', 'GetObject', 'The specified key does not exist.')
+        if IfNoneMatch is not None and IfNoneMatch == stored['etag']:
+            raise client_error('304', 'GetObject', 'Not Modified')
+        return {'Body': io.BytesIO(stored['body']), 'ETag': stored['etag'], 'Metadata': dict(stored['metadata'])}
+
+
+# ---- bedrock-agentcore (Code Interpreter) ----
+
+# サンドボックスの代わりに動かす常駐プロセス。executeCode のたびに同じ名前空間でコードを実行する
+SANDBOX_WORKER = r'''
+import contextlib, io, json, sys, traceback
+namespace = {'__name__': '__main__', '__builtins__': __builtins__}
+channel = sys.stdout
+while True:
+    line = sys.stdin.readline()
+    if not line:
+        break
+    buffer = io.StringIO()
+    with contextlib.redirect_stdout(buffer), contextlib.redirect_stderr(buffer):
+        try:
+            exec(compile(json.loads(line), '<code>', 'exec'), namespace)
+        except BaseException:
+            traceback.print_exc()
+    channel.write(json.dumps(buffer.getvalue()) + '\n')
+    channel.flush()
+'''
+
+
+class SandboxSession:
+    def __init__(self, session_id, timeout_seconds):
+        self.session_id = session_id
+        self.timeout_seconds = timeout_seconds
+        self.directory = tempfile.mkdtemp(prefix='fake-agentcore-')
+        # 本物のサンドボックスと同じく、一時ディレクトリもセッションごとに分ける
+        temp_directory = os.path.join(self.directory, '.tmp')
+        os.mkdir(temp_directory)
+        self.process = subprocess.Popen(
+            [sys.executable, '-u', '-c', SANDBOX_WORKER],
+            cwd=self.directory, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            text=True, encoding='utf-8', env={**os.environ, 'TMPDIR': temp_directory}
+        )
+        self.lock = threading.Lock()
+
+    def write_files(self, files):
+        for file in files:
+            with open(f"{self.directory}/{file['path']}", 'w', encoding='utf-8') as f:
+                f.write(file['text'])
+
+    def execute(self, code):
+        with self.lock:
+            result = {}
+
+            def communicate():
+                self.process.stdin.write(json.dumps(code) + '\n')
+                self.process.stdin.flush()
+                result['line'] = self.process.stdout.readline()
+
+            worker = threading.Thread(target=communicate, daemon=True)
+            worker.start()
+            worker.join(self.timeout_seconds)
+            if 'line' not in result or not result['line']:
+                # 実行が終わらないか、プロセスが落ちた場合はセッションごと使えなくなる
+                self.stop()
+                raise client_error('ValidationException', 'InvokeCodeInterpreter', 'Session terminated')
+            return json.loads(result['line'])
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class Faults:
+    # 呼び出しごとに throttle_rate の確率で ThrottlingException、error_rate の確率で InternalServerException を返す
+    # stream_throttle_rate の確率で executeCode のストリームに throttlingException のイベントを返す
+    # max_sessions を超えてセッションを開始しようとすると ServiceQuotaExceededException
+    # outage(seconds) の間はすべての呼び出しが ThrottlingException になる
+    def __init__(self, throttle_rate=0.0, error_rate=0.0, stream_throttle_rate=0.0, max_sessions=None, rng=None):
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.stream_throttle_rate = stream_throttle_rate
+        self.max_sessions = max_sessions
+        self.rng = rng or random.Random(0)
+        self.down_until = 0.0
+        self.injected = Counter()
+        self._lock = threading.Lock()
+
+    def outage(self, seconds):
+        self.down_until = time.monotonic() + seconds
+
+    def _chance(self, rate):
+        if rate <= 0:
+            return False
+        with self._lock:
+            return self.rng.random() < rate
+
+    def before_call(self, operation):
+        if time.monotonic() < self.down_until or self._chance(self.throttle_rate):
+            self.injected['ThrottlingException'] += 1
+            raise client_error('ThrottlingException', operation, 'Rate exceeded')
+        if self._chance(self.error_rate):
+            self.injected['InternalServerException'] += 1
+            raise client_error('InternalServerException', operation, 'Internal server error')
+
+    def check_sessions(self, active):
+        if self.max_sessions is not None and active >= self.max_sessions:
+            self.injected['ServiceQuotaExceededException'] += 1
+            raise client_error('ServiceQuotaExceededException', 'StartCodeInterpreterSession',
+                               'Too many concurrent sessions')
+
+    def stream_error(self):
+        if self._chance(self.stream_throttle_rate):
+            self.injected['throttlingException'] += 1
+            return {'throttlingException': {'message': 'Rate exceeded'}}
+        return None
+
+
+class FakeCodeInterpreterClient:
+    def __init__(self, recorder, latency=None, start_latency=None, execute_timeout_seconds=60, faults=None):
+        self.recorder = recorder
+        self.latency = latency or Latency()
+        self.start_latency = start_latency or Latency()
+        self.execute_timeout_seconds = execute_timeout_seconds
+        self.faults = faults or Faults()
+        self.sessions = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def start_code_interpreter_session(self, codeInterpreterIdentifier, sessionTimeoutSeconds=900, **kwargs):
+        self.recorder.record('bedrock-agentcore', 'StartCodeInterpreterSession')
+        self.start_latency.sleep()
+        self.faults.before_call('StartCodeInterpreterSession')
+        session_id = f'session-{next(self._ids)}'
+        session = SandboxSession(session_id, self.execute_timeout_seconds)
+        with self._lock:
+            self.faults.check_sessions(len(self.sessions))
+            self.sessions[session_id] = session
+        return {'sessionId': session_id}
+
+    def stop_code_interpreter_session(self, codeInterpreterIdentifier, sessionId, **kwargs):
+        self.recorder.record('bedrock-agentcore', 'StopCodeInterpreterSession')
+        with self._lock:
+            session = self.sessions.pop(sessionId, None)
+        if session is not None:
+            session.stop()
+        return {}
+
+    def invoke_code_interpreter(self, codeInterpreterIdentifier, sessionId, name, arguments, **kwargs):
+        self.recorder.record('bedrock-agentcore', f'InvokeCodeInterpreter.{name}')
+        self.latency.sleep()
+        self.faults.before_call('InvokeCodeInterpreter')
+        with self._lock:
+            session = self.sessions.get(sessionId)
+        if session is None:
+            raise client_error('ResourceNotFoundException', 'InvokeCodeInterpreter', f'Session {sessionId} not found')
+        if name == 'writeFiles':
+            session.write_files(arguments['content'])
+            text = 'ok'
+        elif name == 'executeCode':
+            error = self.faults.stream_error()
+            if error is not None:
+                return {'stream': [error]}
+            text = session.execute(arguments['code'])
+        else:
+            raise client_error('ValidationException', 'InvokeCodeInterpreter', f'Unsupported tool {name}')
+        return {'stream': [{'result': {'content': [{'type': 'text', 'text': text}]}}]}
+
+    def close(self):
+        with self._lock:
+            sessions, self.sessions = list(self.sessions.values()), {}
+        for session in sessions:
+            session.stop()
+
+
+# ---- Lambda ----
+
+class FakeLambdaClient:
+    def __init__(self, recorder):
+        self.recorder = recorder
+        self.functions = {}
+        self.threads = []
+
+    def register(self, function_name, handler):
+        self.functions[function_name] = handler
+
+    def invoke(self, FunctionName, Payload=b'{}', InvocationType='RequestResponse', **kwargs):
+        self.recorder.record('lambda', 'Invoke')
+        handler = self.functions.get(FunctionName)
+        event = json.loads(Payload)
+        if handler is None:
+            return {'StatusCode': 202 if InvocationType == 'Event' else 200}
+        if InvocationType == 'Event':
+            thread = threading.Thread(target=handler, args=(event, None), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+            return {'StatusCode': 202}
+        return {'StatusCode': 200, 'Payload': io.BytesIO(json.dumps(handler(event, None)).encode('utf-8'))}
+
+
+class FakeApiGatewayManagementClient:
+    # WebSocket API の post_to_connection。connect() で登録した接続だけに届き、それ以外は GoneException
+    def __init__(self, recorder, latency=None):
+        self.recorder = recorder
+        self.latency = latency or Latency()
+        self.received = {}
+        self._lock = threading.Lock()
+
+    def connect(self, connection_id):
+        with self._lock:
+            self.received[connection_id] = []
+
+    def disconnect(self, connection_id):
+        with self._lock:
+            self.received.pop(connection_id, None)
+
+    def post_to_connection(self, ConnectionId, Data):
+        self.recorder.record('apigatewaymanagementapi', 'PostToConnection')
+        self.latency.sleep()
+        with self._lock:
+            if ConnectionId not in self.received:
+                raise client_error('GoneException', 'PostToConnection')
+            self.received[ConnectionId].append(json.loads(Data))
+        return {}
+
+
+# ---- boto3 の差し替え ----
+
+class FakeAws:
+    def __init__(self, dynamodb_latency=None, s3_latency=None, code_interpreter_latency=None,
+                 session_start_latency=None, page_size=None, code_interpreter_faults=None):
+        self.recorder = CallRecorder()
+        self.dynamodb_latency = dynamodb_latency or Latency()
+        self.page_size = page_size
+        self.tables = {}
+        self.dynamodb = FakeDynamoResource(self.tables, self.recorder, self.dynamodb_latency)
+        self.dynamodb_client = FakeDynamoClient(self.tables, self.recorder, self.dynamodb_latency)
+        self.s3 = FakeS3Client(self.recorder, s3_latency)
+        self.code_interpreter = FakeCodeInterpreterClient(self.recorder, code_interpreter_latency, session_start_latency,
+                                                          faults=code_interpreter_faults)
+        self.lambda_client = FakeLambdaClient(self.recorder)
+        self.websocket = FakeApiGatewayManagementClient(self.recorder)
+        self._original = None
+
+    def create_table(self, name, keys, indexes=None, stream=False):
+        table = FakeTable(name, keys, self.recorder, indexes, self.dynamodb_latency, self.page_size, stream)
+        self.tables[name] = table
+        return table
+
+    def client(self, service_name, *args, **kwargs):
+        clients = {'s3': self.s3, 'bedrock-agentcore': self.code_interpreter, 'lambda': self.lambda_client,
+                   'dynamodb': self.dynamodb_client, 'apigatewaymanagementapi': self.websocket}
+        if service_name not in clients:
+            raise NotImplementedError(f'No local stand-in for {service_name}')
+        return clients[service_name]
+
+    def resource(self, service_name, *args, **kwargs):
+        if service_name != 'dynamodb':
+            raise NotImplementedError(f'No local stand-in for {service_name}')
+        return self.dynamodb
+
+    def install(self):
+        # ハンドラのモジュールはimport時にクライアントを作るので、importより前に呼ぶ
+        self._original = (boto3.client, boto3.resource)
+        boto3.client = self.client
+        boto3.resource = self.resource
+        return self
+
+    def uninstall(self):
+        if self._original is not None:
+            boto3.client, boto3.resource = self._original
+            self._original = None
+        self.code_interpreter.close()
+
@@ -0,0 +1,409 @@
+# ハンドラをローカルの代替AWS(bench/fakes.py)に向けてプロセス内で動かし、提出トレースを再生する負荷試験
+# 使い方:
+#   python bench/loadtest.py --users 300 --concurrency 50                # 300人が一斉に提出するトレースを生成して再生
+#   python bench/loadtest.py --trace trace.jsonl --concurrency 20 --agentcore-latency-ms 150
+#   python bench/loadtest.py --users 300 --write-trace trace.jsonl       # 生成したトレースを保存するだけ
+#   python bench/loadtest.py --users 300 --websocket-connections 1000    # 1000のブラウザに差分を送る
+# トレースは1行1リクエストのJSON:
+#   {"handler": "submit", "body": {"username": "alice", "problem_number": 1, "code": "def solver(s): ..."}}
+#   {"handler": "leaderboard"}
+#   {"handler": "leaderboard", "query": {"limit": "50"}}                  # 上位のページだけ
+#   {"handler": "leaderboard", "resource": "/leaderboard/me", "query": {"username": "alice"}}
+#   {"handler": "game_state", "method": "POST", "body": {"is_active": true}}
+#   {"handler": "reset"}
+#   {"handler": "submissions", "path": {"id": "<job_id>"}}
+import argparse
+import concurrent.futures
+import contextvars
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'lambda'))
+sys.path.insert(0, BENCH_DIR)
+
+from fakes import FakeAws, Faults, Latency
+
+# スタックと同じテーブル構成
+TABLES = {
+    'LEADERBOARD_TABLE': ('LeaderboardTable', ['submission_id']),
+    'STANDINGS_TABLE': ('StandingsTable', ['epoch', 'username']),
+    'GAME_STATE_TABLE': ('GameStateTable', ['state_key']),
+    'JUDGE_CACHE_TABLE': ('JudgeCacheTable', ['cache_key']),
+    'JUDGE_JOBS_TABLE': ('JudgeJobsTable', ['job_id']),
+    'ADMISSION_TABLE': ('AdmissionTable', ['admission_key']),
+    'SOLUTIONS_TABLE': ('SolutionsTable', ['problem_key', 'attempt_key']),
+    'CONNECTIONS_TABLE': ('ConnectionsTable', ['connection_id'])
+}
+INDEXES = {
+    'STANDINGS_TABLE': {'RankIndex': ['epoch', 'rank_key']}
+}
+WEBSITE_BUCKET = 'website-bucket'
+SOLUTIONS_BUCKET = 'solutions-bucket'
+HANDLERS = ('submit', 'submit_batch', 'leaderboard', 'reset', 'game_state', 'submissions')
+
+# 生成するトレースで使う解答（正解と、よくある誤答）
+SOLUTIONS = {
+    1: {
+        'AC': (
+            "def solver(s):\n"
+            "    pairs = {')': '(', '}': '{', ']': '['}\n"
+            "    stack = []\n"
+            "    depth = 0\n"
+            "    for c in s:\n"
+            "        if c in '({[':\n"
+            "            stack.append(c)\n"
+            "            depth = max(depth, len(stack))\n"
+            "        elif not stack or stack.pop() != pairs[c]:\n"
+            "            return '-1'\n"
+            "    return '-1' if stack else str(depth)\n"
+        ),
+        'WA': "def solver(s):\n    return str(s.count('('))\n"
+    },
+    2: {
+        'AC': "def solver():\n    return 'イギリス'\n",
+        'WA': "def solver():\n    return 'フランス'\n"
+    },
+    3: {
+        'AC': (
+            "def solver(n):\n"
+            "    for limit, plan in ((1000000, 'Free'), (10000000, 'Pro'), (125000000, 'Business'), (500000000, 'Premium')):\n"
+            "        if n <= limit:\n"
+            "            return plan\n"
+            "    return '担当SAにご相談ください'\n"
+        ),
+        'WA': "def solver(n):\n    return 'Free'\n"
+    }
+}
+
+
+def generate_batch_trace(users, wrong_ratio, leaderboard_ratio, unique_code, rng):
+    # 各ユーザーが全問題を /submit/batch でまとめて提出し、誤答した問題だけをもう一度まとめて提出するトレース
+    requests = []
+    for i in range(users):
+        username = f'user{i:04d}'
+        wrong = [n for n in SOLUTIONS if rng.random() < wrong_ratio]
+        rounds = [[(n, 'WA' if n in wrong else 'AC') for n in SOLUTIONS]]
+        if wrong:
+            rounds.append([(n, 'AC') for n in wrong])
+        for attempts in rounds:
+            submissions = []
+            for problem_number, kind in attempts:
+                code = SOLUTIONS[problem_number][kind]
+                if unique_code:
+                    code += f"submitted_by = '{username}'\n"
+                submissions.append({'problem_number': problem_number, 'code': code})
+            requests.append({'handler': 'submit_batch', 'resource': '/submit/batch', 'body': {
+                'username': username, 'submissions': submissions
+            }})
+            if rng.random() < leaderboard_ratio:
+                requests.append({'handler': 'leaderboard'})
+    return requests
+
+
+def generate_trace(users, wrong_ratio, leaderboard_ratio, unique_code, seed, batch=False):
+    # コンテスト開始直後に全員が各問題を提出し、その合間にリーダーボードを読むトレース
+    rng = random.Random(seed)
+    if batch:
+        return generate_batch_trace(users, wrong_ratio, leaderboard_ratio, unique_code, rng)
+    requests = []
+    for problem_number, solutions in SOLUTIONS.items():
+        for i in range(users):
+            username = f'user{i:04d}'
+            attempts = ['WA', 'AC'] if rng.random() < wrong_ratio else ['AC']
+            for kind in attempts:
+                code = solutions[kind]
+                if unique_code:
+                    # 判定キャッシュに当たらないよう提出ごとにコードを変える（コメントだけの違いは同じASTになる）
+                    code += f"submitted_by = '{username}'\n"
+                requests.append({'handler': 'submit', 'body': {
+                    'username': username, 'problem_number': problem_number, 'code': code
+                }})
+                if rng.random() < leaderboard_ratio:
+                    requests.append({'handler': 'leaderboard'})
+    return requests
+
+
+def load_trace(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def to_event(request):
+    event = {'httpMethod': request.get('method', 'POST' if 'body' in request else 'GET')}
+    if 'body' in request:
+        event['body'] = json.dumps(request['body'], ensure_ascii=False)
+    if 'path' in request:
+        event['pathParameters'] = request['path']
+    if 'query' in request:
+        event['queryStringParameters'] = request['query']
+    if 'resource' in request:
+        event['resource'] = request['resource']
+    return event
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(p / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def propagate_context():
+    # 採点のシャード実行などワーカースレッドからのAWS呼び出しも、元のリクエストに数えられるようにする
+    original_submit = concurrent.futures.ThreadPoolExecutor.submit
+
+    def submit(self, fn, *args, **kwargs):
+        return original_submit(self, contextvars.copy_context().run, fn, *args, **kwargs)
+    concurrent.futures.ThreadPoolExecutor.submit = submit
+
+
+class StreamPump:
+    # StandingsTable の変更を一定間隔で leaderboard_publisher.handler に流す（DynamoDB Streams の代わり）
+    def __init__(self, table, handler, interval_seconds):
+        self.table = table
+        self.handler = handler
+        self.interval_seconds = interval_seconds
+        self.batches = 0
+        self.seconds = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            self.flush()
+
+    def flush(self):
+        records = self.table.drain_stream()
+        for i in range(0, len(records), 100):
+            started = time.perf_counter()
+            self.handler({'Records': records[i:i + 100]}, None)
+            self.seconds.append(time.perf_counter() - started)
+            self.batches += 1
+
+
+def setup(args):
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    for env_name, (table_name, _) in TABLES.items():
+        os.environ[env_name] = table_name
+    os.environ['WEBSITE_BUCKET'] = WEBSITE_BUCKET
+    os.environ['SOLUTIONS_BUCKET'] = SOLUTIONS_BUCKET
+    os.environ['CODE_INTERPRETER_ID'] = 'local-code-interpreter'
+    os.environ['EPOCH_GC_FUNCTION'] = 'EpochGcFunction'
+    os.environ['WEBSOCKET_ENDPOINT'] = 'https://local-websocket/live'
+    os.environ['SUBMIT_MODE'] = args.mode
+    os.environ.pop('JUDGE_QUEUE_URL', None)
+    os.environ['METRICS_SAMPLE_RATE'] = str(args.metrics_sample_rate)
+    if args.submit_burst is not None:
+        os.environ['SUBMIT_BURST'] = str(args.submit_burst)
+    if args.max_in_flight is not None:
+        os.environ['MAX_IN_FLIGHT_JUDGES'] = str(args.max_in_flight)
+
+    aws = FakeAws(
+        dynamodb_latency=Latency(args.dynamodb_latency_ms),
+        s3_latency=Latency(args.s3_latency_ms),
+        code_interpreter_latency=Latency(args.agentcore_latency_ms, args.agentcore_jitter_ms),
+        session_start_latency=Latency(args.session_start_ms),
+        page_size=args.page_size,
+        code_interpreter_faults=Faults(args.agentcore_throttle_rate, args.agentcore_error_rate,
+                                       max_sessions=args.agentcore_session_limit)
+    ).install()
+    for env_name, (table_name, keys) in TABLES.items():
+        aws.create_table(table_name, keys, INDEXES.get(env_name), stream=env_name == 'STANDINGS_TABLE')
+    with open(os.path.join(REPO_DIR, 'contents', 'problems.json'), 'rb') as f:
+        aws.s3.put_object(Bucket=WEBSITE_BUCKET, Key='problems.json', Body=f.read())
+    # WebSocket で接続中のブラウザ（変更が送られる先）
+    connections = aws.tables['ConnectionsTable']
+    for i in range(args.websocket_connections):
+        connection_id = f'conn-{i:05d}'
+        aws.websocket.connect(connection_id)
+        connections.put_item(Item={'connection_id': connection_id})
+    return aws
+
+
+def run(requests, handlers, aws, concurrency):
+    latencies = defaultdict(list)
+    calls = defaultdict(Counter)
+    statuses = defaultdict(Counter)
+
+    def replay(request):
+        name = request['handler']
+        request_calls = aws.recorder.start_request()
+        started = time.perf_counter()
+        response = handlers[name](to_event(request), None)
+        elapsed = time.perf_counter() - started
+        return name, elapsed, response.get('statusCode'), request_calls
+
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for name, elapsed, status, request_calls in executor.map(replay, requests):
+            latencies[name].append(elapsed)
+            statuses[name][status] += 1
+            calls[name].update(request_calls)
+    wall_seconds = time.perf_counter() - started
+    return latencies, calls, statuses, wall_seconds
+
+
+def summarize_phases(documents):
+    # ハンドラが出力したEMFレコードから、関数・フェーズごとの所要時間の分布を求める
+    phases = defaultdict(list)
+    for document in documents:
+        function_name = document['function']
+        for metric in document['_aws']['CloudWatchMetrics'][0]['Metrics']:
+            if metric['Unit'] != 'Milliseconds':
+                continue
+            values = document[metric['Name']]
+            phases[f"{function_name}.{metric['Name']}"].extend(values if isinstance(values, list) else [values])
+    summary = {}
+    for name, values in sorted(phases.items()):
+        values.sort()
+        summary[name] = {
+            'count': len(values),
+            'p50_ms': round(percentile(values, 50), 1),
+            'p95_ms': round(percentile(values, 95), 1),
+            'p99_ms': round(percentile(values, 99), 1)
+        }
+    return summary
+
+
+def report(latencies, calls, statuses, wall_seconds, pump):
+    total = sum(len(v) for v in latencies.values())
+    result = {'requests': total, 'wall_seconds': round(wall_seconds, 3),
+              'throughput_rps': round(total / wall_seconds, 2) if wall_seconds else 0.0, 'handlers': {}}
+    for name, values in sorted(latencies.items()):
+        values.sort()
+        count = len(values)
+        result['handlers'][name] = {
+            'requests': count,
+            'status_codes': {str(k): v for k, v in sorted(statuses[name].items(), key=str)},
+            'p50_ms': round(percentile(values, 50) * 1000, 1),
+            'p95_ms': round(percentile(values, 95) * 1000, 1),
+            'p99_ms': round(percentile(values, 99) * 1000, 1),
+            'max_ms': round(values[-1] * 1000, 1),
+            'aws_calls_per_request': round(sum(calls[name].values()) / count, 2),
+            'aws_calls': {k: round(v / count, 2) for k, v in sorted(calls[name].items())}
+        }
+    if pump is not None:
+        seconds = sorted(pump.seconds)
+        result['leaderboard_publisher'] = {
+            'batches': pump.batches,
+            'p50_ms': round(percentile(seconds, 50) * 1000, 1),
+            'p99_ms': round(percentile(seconds, 99) * 1000, 1)
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--trace', help='JSONL trace to replay (generated when omitted)')
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--wrong-ratio', type=float, default=0.3)
+    parser.add_argument('--leaderboard-ratio', type=float, default=0.2)
+    parser.add_argument('--leaderboard-limit', type=int,
+                        help='generated leaderboard requests fetch only this many top rows (default: the full board)')
+    parser.add_argument('--unique-code', action='store_true', help='make every submission bypass the verdict cache')
+    parser.add_argument('--batch', action='store_true', help='submit every problem of a user in one /submit/batch request')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--write-trace', help='write the generated trace to this path and exit')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--mode', choices=['sync', 'async'], default='sync')
+    parser.add_argument('--agentcore-latency-ms', type=float, default=100.0)
+    parser.add_argument('--agentcore-jitter-ms', type=float, default=50.0)
+    parser.add_argument('--session-start-ms', type=float, default=500.0)
+    parser.add_argument('--agentcore-throttle-rate', type=float, default=0.0,
+                        help='fraction of Code Interpreter calls that are throttled')
+    parser.add_argument('--agentcore-error-rate', type=float, default=0.0,
+                        help='fraction of Code Interpreter calls that fail with a server error')
+    parser.add_argument('--agentcore-session-limit', type=int,
+                        help='concurrent Code Interpreter sessions before starting one is rejected')
+    parser.add_argument('--dynamodb-latency-ms', type=float, default=5.0)
+    parser.add_argument('--s3-latency-ms', type=float, default=20.0)
+    parser.add_argument('--submit-burst', type=int, help='submissions a user can make back to back (0: unlimited)')
+    parser.add_argument('--max-in-flight', type=int, help='judge sessions allowed at once (0: unlimited)')
+    parser.add_argument('--page-size', type=int, help='items per DynamoDB query/scan page')
+    parser.add_argument('--metrics-sample-rate', type=float, default=1.0,
+                        help='fraction of handler invocations that record per-phase metrics')
+    parser.add_argument('--publish-interval', type=float, default=1.0,
+                        help='seconds between leaderboard publisher batches (0 disables)')
+    parser.add_argument('--websocket-connections', type=int, default=0,
+                        help='browsers connected to the WebSocket API that receive leaderboard and game state changes')
+    args = parser.parse_args()
+
+    if args.trace:
+        requests = load_trace(args.trace)
+    else:
+        requests = generate_trace(args.users, args.wrong_ratio, args.leaderboard_ratio, args.unique_code, args.seed,
+                                  args.batch)
+        if args.leaderboard_limit:
+            for request in requests:
+                if request['handler'] == 'leaderboard':
+                    request['query'] = {'limit': str(args.leaderboard_limit)}
+    if args.write_trace:
+        with open(args.write_trace, 'w', encoding='utf-8') as f:
+            for request in requests:
+                f.write(json.dumps(request, ensure_ascii=False) + '\n')
+        return
+
+    aws = setup(args)
+    propagate_context()
+    try:
+        import metrics
+        sink = metrics.MemorySink()
+        metrics.set_sink(sink)
+        import submit, leaderboard, reset, game_state, submissions, leaderboard_publisher, epoch_gc
+        handlers = {'submit': submit.handler, 'submit_batch': submit.handler,
+                    'leaderboard': leaderboard.handler, 'reset': reset.handler,
+                    'game_state': game_state.handler, 'submissions': submissions.handler}
+        unknown = {r['handler'] for r in requests} - set(handlers)
+        if unknown:
+            parser.error(f'Unknown handlers in trace: {sorted(unknown)} (expected one of {HANDLERS})')
+        aws.lambda_client.register(os.environ['EPOCH_GC_FUNCTION'], epoch_gc.handler)
+
+        # 受付を開始してから再生する（準備の呼び出しは計測に含めない）
+        game_state.handler(to_event({'handler': 'game_state', 'method': 'POST', 'body': {'is_active': True}}), None)
+        aws.tables['StandingsTable'].drain_stream()
+        for received in aws.websocket.received.values():
+            received.clear()
+        sink.documents.clear()
+
+        pump = None
+        if args.publish_interval > 0:
+            pump = StreamPump(aws.tables['StandingsTable'], leaderboard_publisher.handler, args.publish_interval)
+            pump.start()
+        latencies, calls, statuses, wall_seconds = run(requests, handlers, aws, args.concurrency)
+        if pump is not None:
+            pump.stop()
+        result = report(latencies, calls, statuses, wall_seconds, pump)
+        result['agentcore'] = {**submit.bedrock_agentcore.stats,
+                               'session_limit': round(submit.bedrock_agentcore.limit.limit, 2),
+                               'injected_faults': dict(aws.code_interpreter.faults.injected)}
+        if args.websocket_connections:
+            # 接続1つあたりに届いたメッセージ（ポーリングなら 5秒ごとに2リクエスト × 閲覧者数）
+            received = [len(messages) for messages in aws.websocket.received.values()]
+            result['websocket'] = {
+                'connections': len(received),
+                'messages_per_connection': round(sum(received) / len(received), 2)
+            }
+        result['phases'] = summarize_phases(sink.documents)
+        result['aws_calls_total'] = dict(sorted(aws.recorder.total.items()))
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+    finally:
+        aws.uninstall()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+# /submit の受付制御
+# ユーザーごとのトークンバケットで連続提出を抑え、採点中のサンドボックスセッション数に全体の上限を設ける
+# 状態はDynamoDBに置き、条件付き書き込みで複数コンテナから同時に更新しても壊れないようにする
+# table が None の場合はメモリ上で管理する（ローカル実行用）
+import math
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from botocore.exceptions import ClientError
+
+# 古いバケットやリースはTTLで消える
+ITEM_TTL_SECONDS = 24 * 60 * 60
+# 他のリクエストと競合して書き込めなかった場合の再試行回数
+UPDATE_RETRIES = 3
+# 全体の上限に達しているときに返す Retry-After（秒）
+BUSY_RETRY_AFTER_SECONDS = 2
+SLOT_POLL_INTERVAL_SECONDS = 0.5
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason, retry_after_seconds):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after_seconds = max(1, int(math.ceil(retry_after_seconds)))
+
+
+def refill(tokens, elapsed_ms, burst, refill_per_minute):
+    return min(burst, tokens + elapsed_ms * refill_per_minute / 60000)
+
+
+def seconds_until_token(tokens, refill_per_minute, cost=1):
+    if refill_per_minute <= 0:
+        return ITEM_TTL_SECONDS
+    return (cost - tokens) * 60 / refill_per_minute
+
+
+class AdmissionControl:
+    def __init__(self, table=None, lease_seconds=60):
+        self.table = table
+        # 採点中のLambdaが落ちてもリースはこの秒数で失効する（Lambdaのタイムアウトより長くする）
+        self.lease_seconds = lease_seconds
+        self._buckets = {}
+        self._leases = {}
+        self._lock = threading.Lock()
+
+    def take_token(self, username, limits, cost=1):
+        # 提出 cost 回分のトークンを取る。足りなければ AdmissionRejected
+        burst = limits['burst']
+        if burst <= 0:
+            return
+        if self.table is None:
+            with self._lock:
+                now_ms = int(time.time() * 1000)
+                tokens, updated_at_ms = self._buckets.get(username, (burst, now_ms))
+                tokens = refill(tokens, now_ms - updated_at_ms, burst, limits['refill_per_minute'])
+                if tokens < cost:
+                    raise AdmissionRejected('rate_limited', seconds_until_token(tokens, limits['refill_per_minute'], cost))
+                self._buckets[username] = (tokens - cost, now_ms)
+            return
+
+        key = f'user#{username}'
+        for _ in range(UPDATE_RETRIES):
+            item = self.table.get_item(Key={'admission_key': key}, ConsistentRead=True).get('Item')
+            now_ms = int(time.time() * 1000)
+            if item is None:
+                tokens = burst
+                condition = 'attribute_not_exists(admission_key)'
+                values = {}
+                revision = 0
+            else:
+                # 残量はミリトークン単位の整数で持つ（Decimalの丸めを避ける）
+                tokens = refill(int(item['tokens_milli']) / 1000, now_ms - int(item['updated_at_ms']),
+                                burst, limits['refill_per_minute'])
+                revision = int(item['bucket_revision'])
+                condition = 'bucket_revision = :revision'
+                values = {':revision': revision}
+            if tokens < cost:
+                raise AdmissionRejected('rate_limited', seconds_until_token(tokens, limits['refill_per_minute'], cost))
+            # 読んでから書くまでに別の提出が入っていたら、読み直してやり直す
+            try:
+                self.table.put_item(
+                    Item={
+                        'admission_key': key,
+                        'tokens_milli': int((tokens - cost) * 1000),
+                        'updated_at_ms': now_ms,
+                        'bucket_revision': revision + 1,
+                        'expires_at': now_ms // 1000 + ITEM_TTL_SECONDS
+                    },
+                    ConditionExpression=condition,
+                    **({'ExpressionAttributeValues': values} if values else {})
+                )
+                return
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+        # 同じユーザーの提出が同時に殺到している
+        raise AdmissionRejected('rate_limited', 1)
+
+    @contextmanager
+    def judge_slot(self, limits, wait_seconds=0):
+        # 採点中のセッション数を max_in_flight 以下に保つ。空きがなければ待つか AdmissionRejected
+        max_in_flight = limits['max_in_flight']
+        if max_in_flight <= 0:
+            yield
+            return
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            lease = self._acquire_slot(max_in_flight)
+            if lease is not None:
+                break
+            if time.monotonic() >= deadline:
+                raise AdmissionRejected('busy', BUSY_RETRY_AFTER_SECONDS)
+            time.sleep(SLOT_POLL_INTERVAL_SECONDS)
+        try:
+            yield
+        finally:
+            self._release_slot(*lease)
+
+    def _acquire_slot(self, max_in_flight):
+        holder = uuid.uuid4().hex
+        now = int(time.time())
+        # 番号付きのスロットをランダムな順に試し、空いているか期限切れのものを条件付きで確保する
+        for slot in random.sample(range(max_in_flight), max_in_flight):
+            key = f'slot#{slot}'
+            if self.table is None:
+                with self._lock:
+                    lease = self._leases.get(key)
+                    if lease is None or lease[1] < now:
+                        self._leases[key] = (holder, now + self.lease_seconds)
+                        return key, holder
+                continue
+            try:
+                self.table.put_item(
+                    Item={
+                        'admission_key': key,
+                        'holder': holder,
+                        'lease_expires_at': now + self.lease_seconds,
+                        'expires_at': now + ITEM_TTL_SECONDS
+                    },
+                    ConditionExpression='attribute_not_exists(admission_key) OR lease_expires_at < :now',
+                    ExpressionAttributeValues={':now': now}
+                )
+                return key, holder
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+        return None
+
+    def _release_slot(self, key, holder):
+        if self.table is None:
+            with self._lock:
+                if self._leases.get(key, (None,))[0] == holder:
+                    del self._leases[key]
+            return
+        # 期限切れの後に別のリクエストが確保したスロットは消さない
+        try:
+            self.table.delete_item(
+                Key={'admission_key': key},
+                ConditionExpression='holder = :holder',
+                ExpressionAttributeValues={':holder': holder}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
@@ -0,0 +1,287 @@
+# Code Interpreter (bedrock-agentcore) の呼び出しを、サービス側のスロットリングに合わせて抑えるラッパー
+# - エラーを「スロットリング」「一時的な障害」「それ以外」に分け、前の2つだけをジッター付きの指数バックオフで再試行する
+# - コンテナ内で同時に使うセッション数の上限を、スロットリングされたら半分に、成功したら少しずつ増やす（AIMD）
+# - スロットリングが続いたら回路を開き、しばらくはサービスを呼ばずに JudgeUnavailable（再試行を促す503）を返す
+# 提出コードの誤り（WA/RE/TLE など）はハーネスの出力で判定されるので、ここでは成功として扱う
+import random
+import threading
+import time
+from contextlib import contextmanager
+from botocore import exceptions as botocore_exceptions
+from botocore.exceptions import ClientError
+from admission import AdmissionRejected
+import metrics
+
+THROTTLED = 'throttled'
+TRANSIENT = 'transient'
+FAILED = 'failed'
+
+THROTTLE_CODES = {'ThrottlingException', 'TooManyRequestsException', 'ServiceQuotaExceededException',
+                  'LimitExceededException'}
+TRANSIENT_CODES = {'InternalServerException', 'ServiceUnavailableException', 'InternalFailure', 'RequestTimeout'}
+# invoke_code_interpreter のストリームで返るエラーのイベント
+STREAM_ERRORS = {
+    'throttlingException': 'ThrottlingException',
+    'serviceQuotaExceededException': 'ServiceQuotaExceededException',
+    'internalServerException': 'InternalServerException',
+    'accessDeniedException': 'AccessDeniedException',
+    'conflictException': 'ConflictException',
+    'resourceNotFoundException': 'ResourceNotFoundException',
+    'validationException': 'ValidationException'
+}
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class JudgeUnavailable(AdmissionRejected):
+    # 採点基盤が混み合っているか障害中。提出コードの誤りではないので、判定を返さずに再試行を促す
+    def __init__(self, retry_after_seconds):
+        super().__init__('unavailable', retry_after_seconds)
+
+
+def classify(error):
+    if isinstance(error, ClientError):
+        code = error.response.get('Error', {}).get('Code')
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        if code in THROTTLE_CODES or status == 429:
+            return THROTTLED
+        if code in TRANSIENT_CODES or status >= 500:
+            return TRANSIENT
+        return FAILED
+    if isinstance(error, (botocore_exceptions.ConnectionError, botocore_exceptions.HTTPClientError)):
+        # 接続エラーや読み取りのタイムアウト
+        return TRANSIENT
+    return FAILED
+
+
+def backoff_seconds(attempt, base_seconds, cap_seconds, rng=random):
+    # フルジッター: 0 から base * 2^attempt（上限 cap）の一様乱数
+    return rng.uniform(0, min(cap_seconds, base_seconds * 2 ** attempt))
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, cooldown_seconds=10, max_cooldown_seconds=60, clock=time.monotonic):
+        # failure_threshold 回続けてスロットリング・障害になったら cooldown 秒だけ回路を開く
+        # 開いた後の試しの呼び出しも失敗したら、開いておく時間を倍にする（max_cooldown まで）
+        self.failure_threshold = failure_threshold
+        self.base_cooldown_seconds = cooldown_seconds
+        self.max_cooldown_seconds = max_cooldown_seconds
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.cooldown_seconds = cooldown_seconds
+        self.opened_until = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def reject_if_open(self):
+        # 回路が開いている間は、試しの呼び出しの枠を使わずに JudgeUnavailable
+        with self._lock:
+            if self.state == OPEN and self.clock() < self.opened_until:
+                raise JudgeUnavailable(self.opened_until - self.clock())
+
+    def before_call(self):
+        # 呼び出してよければ何もしない。回路が開いていれば JudgeUnavailable
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            now = self.clock()
+            if self.state == OPEN:
+                if now < self.opened_until:
+                    raise JudgeUnavailable(self.opened_until - now)
+                self.state = HALF_OPEN
+                self._probing = False
+            # 半開状態では1つの呼び出しだけを通して回復したかを確かめる
+            if self._probing:
+                raise JudgeUnavailable(1)
+            self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.cooldown_seconds = self.base_cooldown_seconds
+            self._probing = False
+
+    def record_failure(self):
+        # 回路を開いたら True
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN:
+                self.cooldown_seconds = min(self.cooldown_seconds * 2, self.max_cooldown_seconds)
+            elif self.state == OPEN or self.failures < self.failure_threshold:
+                return False
+            self.state = OPEN
+            self.opened_until = self.clock() + self.cooldown_seconds
+            self._probing = False
+            return True
+
+    def record_other(self):
+        # 回復したかどうか判断できない結果（提出とは無関係なエラーなど）
+        with self._lock:
+            self._probing = False
+
+    def retry_after_seconds(self):
+        with self._lock:
+            if self.state == OPEN:
+                return max(1, self.opened_until - self.clock())
+            return self.cooldown_seconds
+
+
+class AdaptiveLimit:
+    def __init__(self, max_limit, min_limit=1, decrease_factor=0.5, decrease_interval_seconds=1.0,
+                 clock=time.monotonic):
+        # 同時に使うセッション数の上限。スロットリングで decrease_factor 倍（同時に起きた分はまとめて1回）、
+        # 採点が1回終わるごとに 1/上限 ずつ増やす（上限の数だけ終わると1増える）
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.decrease_factor = decrease_factor
+        self.decrease_interval_seconds = decrease_interval_seconds
+        self.clock = clock
+        self.limit = float(max_limit)
+        self.in_use = 0
+        self._decreased_at = None
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout_seconds):
+        deadline = time.monotonic() + timeout_seconds
+        with self._condition:
+            while self.in_use >= int(self.limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            self.in_use += 1
+            return True
+
+    def release(self):
+        with self._condition:
+            self.in_use -= 1
+            self._condition.notify()
+
+    def on_success(self):
+        with self._condition:
+            if self.limit < self.max_limit:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self._condition.notify_all()
+
+    def on_throttle(self):
+        with self._condition:
+            now = self.clock()
+            if self._decreased_at is not None and now - self._decreased_at < self.decrease_interval_seconds:
+                return
+            self._decreased_at = now
+            self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+
+
+class AgentCoreClient:
+    # boto3 の bedrock-agentcore クライアントと同じメソッド名で呼べる（SessionPool にもそのまま渡せる）
+    def __init__(self, client, max_sessions=8, max_retries=3, backoff_base_seconds=0.2, backoff_cap_seconds=2.0,
+                 slot_wait_seconds=5.0, breaker=None, rng=None, sleep=time.sleep):
+        self.client = client
+        self.max_retries = max_retries
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_cap_seconds = backoff_cap_seconds
+        self.slot_wait_seconds = slot_wait_seconds
+        self.limit = AdaptiveLimit(max_sessions)
+        self.breaker = breaker or CircuitBreaker()
+        self.rng = rng or random.Random()
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self.stats = {'retries': 0, 'throttled': 0, 'transient': 0, 'circuit_opened': 0, 'rejected': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _record(self, kind):
+        if kind == FAILED:
+            self.breaker.record_other()
+            return
+        self._count(kind)
+        metrics.put('agentcore_' + kind, 1, 'Count')
+        if kind == THROTTLED:
+            self.limit.on_throttle()
+        if self.breaker.record_failure():
+            self._count('circuit_opened')
+            print(f'Code Interpreter circuit opened for {self.breaker.cooldown_seconds} seconds')
+
+    def _unavailable(self, retry_after_seconds):
+        self._count('rejected')
+        return JudgeUnavailable(retry_after_seconds)
+
+    def _call(self, method, kwargs, guarded=True, retries=None):
+        retries = self.max_retries if retries is None else retries
+        for attempt in range(retries + 1):
+            if guarded:
+                try:
+                    self.breaker.before_call()
+                except JudgeUnavailable:
+                    self._count('rejected')
+                    raise
+            try:
+                response = getattr(self.client, method)(**kwargs)
+            except Exception as e:
+                kind = classify(e)
+                self._record(kind)
+                if kind == FAILED:
+                    raise
+                if attempt == retries:
+                    raise self._unavailable(self.breaker.retry_after_seconds()) from e
+            else:
+                # 回路を閉じるのは、回路を通した呼び出しが成功したときだけ
+                if guarded:
+                    self.breaker.record_success()
+                return response
+            self._count('retries')
+            self.sleep(backoff_seconds(attempt, self.backoff_base_seconds, self.backoff_cap_seconds, self.rng))
+
+    def _stream(self, stream):
+        # ストリームの途中で返るエラーもスロットリングと障害を区別する
+        # 実行が始まった後なので再試行はせず、採点全体をやり直してもらう
+        try:
+            for event in stream:
+                for name, code in STREAM_ERRORS.items():
+                    if name in event:
+                        error = ClientError({'Error': {'Code': code, 'Message': event[name].get('message', code)}},
+                                            'InvokeCodeInterpreter')
+                        kind = classify(error)
+                        self._record(kind)
+                        if kind == FAILED:
+                            raise error
+                        raise self._unavailable(self.breaker.retry_after_seconds()) from error
+                yield event
+        finally:
+            # 途中で読むのをやめたら、元のストリームも閉じる
+            if hasattr(stream, 'close'):
+                stream.close()
+
+    @contextmanager
+    def session_slot(self):
+        # 採点1回分（セッションの取得から返却まで）を、適応的な同時実行数の上限の内側で行う
+        try:
+            self.breaker.reject_if_open()
+        except JudgeUnavailable:
+            self._count('rejected')
+            raise
+        if not self.limit.acquire(self.slot_wait_seconds):
+            raise self._unavailable(1)
+        try:
+            yield
+            # 上限を増やすのは、セッションを使った採点が最後まで終わったときだけ
+            self.limit.on_success()
+        finally:
+            self.limit.release()
+
+    def start_code_interpreter_session(self, **kwargs):
+        return self._call('start_code_interpreter_session', kwargs)
+
+    def invoke_code_interpreter(self, **kwargs):
+        response = self._call('invoke_code_interpreter', kwargs)
+        return {**response, 'stream': self._stream(response['stream'])}
+
+    def stop_code_interpreter_session(self, **kwargs):
+        # 後片付けは回路が開いていても行う（失敗してもセッションはタイムアウトで消えるので再試行しない）
+        return self._call('stop_code_interpreter_session', kwargs, guarded=False, retries=0)
@@ -0,0 +1,85 @@
+# boto3 のクライアント・リソースを初回利用時に作り、同じコンテナ内のモジュール間で共有する
+# import 時には何も作らないので、コールドスタートでは使うクライアントの分だけ初期化コストを払う
+# ハンドラのモジュールでは import 時に client() / table() で宣言しておき、そのまま属性アクセスで使う
+import threading
+
+_instances = {}
+_declared = []
+_lock = threading.RLock()
+
+
+def _get(key, factory):
+    instance = _instances.get(key)
+    if instance is None:
+        # boto3 のクライアント作成はスレッドセーフではないので、作成だけはロックの内側で行う
+        with _lock:
+            instance = _instances.get(key)
+            if instance is None:
+                instance = factory()
+                _instances[key] = instance
+    return instance
+
+
+class Lazy:
+    # 最初の属性アクセスで実体を作るプロキシ
+    __slots__ = ('_key', '_factory')
+
+    def __init__(self, key, factory):
+        self._key = key
+        self._factory = factory
+
+    def resolve(self):
+        return _get(self._key, self._factory)
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __repr__(self):
+        return f'Lazy{self._key!r}'
+
+
+def _declare(key, factory):
+    lazy = Lazy(key, factory)
+    with _lock:
+        _declared.append(lazy)
+    return lazy
+
+
+def _client(service_name, max_attempts=None, endpoint_url=None):
+    import boto3
+    kwargs = {'endpoint_url': endpoint_url} if endpoint_url else {}
+    if max_attempts is None:
+        return boto3.client(service_name, **kwargs)
+    from botocore.config import Config
+    return boto3.client(service_name, config=Config(retries={'max_attempts': max_attempts, 'mode': 'standard'}),
+                        **kwargs)
+
+
+def _resource(service_name):
+    import boto3
+    return boto3.resource(service_name)
+
+
+def client(service_name, max_attempts=None, endpoint_url=None):
+    # 呼び出し側で再試行を制御するクライアントは max_attempts=1 にして botocore の再試行と重ねない
+    # endpoint_url は API ごとにエンドポイントが決まるサービス用（apigatewaymanagementapi など）
+    return _declare(('client', service_name, max_attempts, endpoint_url),
+                    lambda: _client(service_name, max_attempts, endpoint_url))
+
+
+def resource(service_name):
+    return _declare(('resource', service_name), lambda: _resource(service_name))
+
+
+def table(table_name):
+    dynamodb = resource('dynamodb')
+    return _declare(('table', table_name), lambda: dynamodb.Table(table_name))
+
+
+def resolve_all():
+    # 宣言済みのクライアントをすべて作る（コールドスタートの計測やウォームアップ用）
+    with _lock:
+        declared = list(_declared)
+    for lazy in declared:
+        lazy.resolve()
+    return len(_instances)
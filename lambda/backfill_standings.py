@@ -0,0 +1,105 @@
+# 既存の提出レコードからユーザー単位の集計レコード(StandingsTable)を作り直す一回限りのバックフィル
+# 使い方: LEADERBOARD_TABLE=<テーブル名> STANDINGS_TABLE=<テーブル名> GAME_STATE_TABLE=<テーブル名> python lambda/backfill_standings.py
+# --rank-keys を付けると、集計レコードはそのままで RankIndex のソートキー(rank_key)だけを今の採点ルールで付け直す
+import sys
+import json
+import aws_clients
+import os
+from datetime import datetime
+from botocore.exceptions import ClientError
+from contest_config import get_contest_config
+from scoring import UserState
+from standings import JST, query_epoch
+
+table = aws_clients.table(os.environ['LEADERBOARD_TABLE'])
+standings_table = aws_clients.table(os.environ['STANDINGS_TABLE'])
+contest_config = get_contest_config()
+
+def solved_at_ms(item):
+    # 正解時刻（エポックミリ秒）を持たない古いレコードは "YYYY-MM-DD HH:MM:SS JST" の文字列から求める
+    if 'solved_at_ms' in item:
+        return int(item['solved_at_ms'])
+    solved_at = datetime.strptime(item['timestamp'], '%Y-%m-%d %H:%M:%S JST').replace(tzinfo=JST)
+    return int(solved_at.timestamp() * 1000)
+
+def build_standings(items, epoch):
+    # 現在のエポックの提出だけを対象に、ユーザー・問題ごとに最初の正解時刻を採用する
+    # エポック導入前のレコードはエポック0として扱う
+    first_solves = {}
+    for item in items:
+        if int(item.get('epoch', 0)) != epoch:
+            continue
+        username = item['username']
+        problem_number = int(item['problem_number'])
+        solves = first_solves.setdefault(username, {})
+        at = solved_at_ms(item)
+        if problem_number not in solves or at < solves[problem_number]:
+            solves[problem_number] = at
+
+    length = max(contest_config.problems(), default=0)
+    rules = contest_config.scoring_rules()
+    standings = []
+    for username, solves in first_solves.items():
+        state = UserState(username, solve_times=[0] * length, wrong_attempts=[0] * length)
+        for problem_number, at in solves.items():
+            state.solve(problem_number, at)
+        # 誤答数は提出レコードに残っていないため、バックフィルでは0から数え直す
+        state.wrong_attempts.extend([0] * (len(state.solve_times) - len(state.wrong_attempts)))
+        standings.append({
+            'epoch': epoch,
+            'username': username,
+            'solved_mask': state.solved_mask,
+            'solve_times': state.solve_times,
+            'wrong_attempts': state.wrong_attempts,
+            'solved_problems': set(solves),
+            'solved_count': len(solves),
+            'last_solve_ms': max(solves.values()),
+            'rank_key': rules.rank_key(state)
+        })
+    return standings
+
+def refresh_rank_keys(epoch):
+    # 採点ルールや配点を途中で変えたときに使う（submit は更新のあったユーザーの rank_key しか書き直さない）
+    rules = contest_config.scoring_rules()
+    updated = 0
+    for item in query_epoch(standings_table, epoch):
+        rank_key = rules.rank_key(UserState.from_item(item))
+        if item.get('rank_key') == rank_key:
+            continue
+        # 読んだ後に提出で更新されたレコードは、その提出の側で書き直される
+        condition = 'standing_revision = :r' if 'standing_revision' in item else 'attribute_not_exists(standing_revision)'
+        values = {':k': rank_key, **({':r': item['standing_revision']} if 'standing_revision' in item else {})}
+        try:
+            standings_table.update_item(
+                Key={'epoch': epoch, 'username': item['username']},
+                UpdateExpression='SET rank_key = :k',
+                ConditionExpression=condition,
+                ExpressionAttributeValues=values
+            )
+            updated += 1
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+    return {'users': updated}
+
+def handler(event, context):
+    if event.get('rank_keys'):
+        return refresh_rank_keys(contest_config.current_epoch())
+    items = []
+    scan_kwargs = {}
+    while True:
+        response = table.scan(**scan_kwargs)
+        items.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    standings = build_standings(items, contest_config.current_epoch())
+    with standings_table.batch_writer(overwrite_by_pkeys=['epoch', 'username']) as batch:
+        for standing in standings:
+            batch.put_item(Item=standing)
+
+    return {'submissions': len(items), 'users': len(standings)}
+
+if __name__ == '__main__':
+    print(json.dumps(handler({'rank_keys': '--rank-keys' in sys.argv[1:]}, None)))
@@ -0,0 +1,241 @@
+# lambda/ の各ハンドラで共有するコンテスト設定のスナップショット
+# ゲーム状態と問題カタログをTTL付きでキャッシュし、リクエストごとの制御系の読み取りをなくす
+import hashlib
+import json
+import os
+import threading
+import time
+from decimal import Decimal
+import aws_clients
+from botocore.exceptions import ClientError
+from scoring import ScoringRules
+
+GAME_STATE_KEY = 'game_active'
+PROBLEMS_KEY = 'problems.json'
+
+# 管理画面での切り替えは最大でこの秒数だけ遅れて反映される
+GAME_STATE_TTL_SECONDS = float(os.environ.get('GAME_STATE_TTL_SECONDS', '2'))
+PROBLEMS_TTL_SECONDS = float(os.environ.get('PROBLEMS_TTL_SECONDS', '30'))
+# 1ケースあたりの実行時間制限（秒）。問題ごとに time_limit_seconds で上書きできる
+CASE_TIME_LIMIT_SECONDS = float(os.environ.get('CASE_TIME_LIMIT_SECONDS', '2'))
+# 1ケースあたりの出力の上限（バイト）。問題ごとに output_limit_bytes で上書きできる
+OUTPUT_LIMIT_BYTES = int(os.environ.get('OUTPUT_LIMIT_BYTES', str(64 * 1024)))
+# /submit の受付制御の既定値。ゲーム状態の admission 属性でコンテストごとに上書きできる
+# burst: 連続で提出できる回数、refill_per_minute: 1分あたりに回復する回数、
+# max_in_flight: 全体で同時に採点するセッション数（いずれも0で無制限）
+DEFAULT_ADMISSION_LIMITS = {
+    'burst': int(os.environ.get('SUBMIT_BURST', '5')),
+    'refill_per_minute': float(os.environ.get('SUBMIT_REFILL_PER_MINUTE', '6')),
+    'max_in_flight': int(os.environ.get('MAX_IN_FLIGHT_JUDGES', '20'))
+}
+
+
+def parse_admission_limits(raw):
+    raw = raw or {}
+    return {
+        'burst': int(raw.get('burst', DEFAULT_ADMISSION_LIMITS['burst'])),
+        'refill_per_minute': float(raw.get('refill_per_minute', DEFAULT_ADMISSION_LIMITS['refill_per_minute'])),
+        'max_in_flight': int(raw.get('max_in_flight', DEFAULT_ADMISSION_LIMITS['max_in_flight']))
+    }
+
+
+def compute_test_set_version(test_cases, time_limit_seconds=CASE_TIME_LIMIT_SECONDS,
+                             output_limit_bytes=OUTPUT_LIMIT_BYTES, performance_ranking=False):
+    # 採点結果を変えうる設定が変わったら別のバージョンにする（採点結果のキャッシュを使わず、再採点の対象になる）
+    # performance_ranking を有効にすると、採点結果に性能の計測値が入る
+    payload = json.dumps({'test_cases': test_cases, 'time_limit_seconds': time_limit_seconds,
+                          'output_limit_bytes': output_limit_bytes, 'performance_ranking': performance_ranking},
+                         ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def parse_problem(raw_problem):
+    problem = {
+        'test_cases': [tuple(tc) for tc in raw_problem['test_cases']],
+        # テストケースを何セッションに分けて並行実行するか
+        'shards': int(raw_problem.get('shards', 1)),
+        'time_limit_seconds': float(raw_problem.get('time_limit_seconds', CASE_TIME_LIMIT_SECONDS)),
+        'output_limit_bytes': int(raw_problem.get('output_limit_bytes', OUTPUT_LIMIT_BYTES)),
+        'points': int(raw_problem.get('points', 1)),
+        # 正解した提出の性能（CPU時間・ピークメモリ）を測り、問題ごとの性能順位を付けるか
+        'performance_ranking': bool(raw_problem.get('performance_ranking', False))
+    }
+    problem['test_set_version'] = compute_test_set_version(raw_problem['test_cases'], problem['time_limit_seconds'],
+                                                           problem['output_limit_bytes'], problem['performance_ranking'])
+    return problem
+
+
+def parse_problems(raw):
+    return {int(k): parse_problem(v) for k, v in json.loads(raw).items()}
+
+
+class ContestConfig:
+    def __init__(self, game_state_table=None, s3_client=None, bucket_name=None,
+                 game_state_ttl_seconds=GAME_STATE_TTL_SECONDS,
+                 problems_ttl_seconds=PROBLEMS_TTL_SECONDS):
+        self.game_state_table = game_state_table
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.game_state_ttl_seconds = game_state_ttl_seconds
+        self.problems_ttl_seconds = problems_ttl_seconds
+        self._lock = threading.Lock()
+        self._game_state = None
+        self._game_state_loaded_at = 0.0
+        self._version = None
+        self._problems = None
+        self._problems_etag = None
+        self._problems_checked_at = 0.0
+        self._rules = None
+        self._rules_source = None
+
+    def _refresh_game_state(self, now):
+        item = self.game_state_table.get_item(Key={'state_key': GAME_STATE_KEY}).get('Item', {})
+        version = int(item.get('config_version', 0))
+        if self._version is not None and version != self._version:
+            # 管理操作でバージョンが上がったら、問題カタログもすぐに再確認する
+            self._problems_checked_at = 0.0
+        self._game_state = {
+            'is_active': item.get('value', False),
+            'version': version,
+            # コンテストの回(エポック)。リセットのたびに1つ進み、提出と集計のキーはこの値で区切られる
+            'epoch': int(item.get('epoch', 0)),
+            # 現在のエポックで最初に受付を開始した時刻（ICPC形式のペナルティの起点）
+            'started_at_ms': int(item.get('started_at_ms', 0)),
+            'admission': parse_admission_limits(item.get('admission'))
+        }
+        self._version = version
+        self._game_state_loaded_at = now
+
+    def _refresh_problems(self, now):
+        kwargs = {'Bucket': self.bucket_name, 'Key': PROBLEMS_KEY}
+        if self._problems_etag:
+            kwargs['IfNoneMatch'] = self._problems_etag
+        try:
+            response = self.s3_client.get_object(**kwargs)
+        except ClientError as e:
+            # ETagが一致(304)なら、解析済みのカタログをそのまま使う
+            if e.response['Error']['Code'] not in ('304', 'NotModified') or self._problems is None:
+                raise
+        else:
+            self._problems = parse_problems(response['Body'].read())
+            self._problems_etag = response.get('ETag')
+        self._problems_checked_at = now
+
+    def game_state(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._game_state is None or now - self._game_state_loaded_at >= self.game_state_ttl_seconds:
+                self._refresh_game_state(now)
+            return self._game_state
+
+    def is_game_active(self):
+        return self.game_state()['is_active']
+
+    def current_epoch(self):
+        return self.game_state()['epoch']
+
+    def admission_limits(self):
+        if self.game_state_table is None:
+            return DEFAULT_ADMISSION_LIMITS
+        return self.game_state()['admission']
+
+    def problems(self):
+        if self.game_state_table is not None:
+            self.game_state()
+        with self._lock:
+            now = time.monotonic()
+            if self._problems is None or now - self._problems_checked_at >= self.problems_ttl_seconds:
+                self._refresh_problems(now)
+            return self._problems
+
+    def scoring_rules(self):
+        problems = self.problems()
+        started_at_ms = self.game_state()['started_at_ms'] if self.game_state_table is not None else 0
+        with self._lock:
+            # カタログか開始時刻が変わったときだけ作り直す
+            if self._rules is None or self._rules_source != (id(problems), started_at_ms):
+                self._rules = ScoringRules.from_catalog(problems, started_at_ms=started_at_ms)
+                self._rules_source = (id(problems), started_at_ms)
+            return self._rules
+
+    def invalidate(self):
+        with self._lock:
+            self._game_state = None
+            self._problems_checked_at = 0.0
+
+
+def bump_version(game_state_table, is_active):
+    # ゲーム状態を更新し、各コンテナのスナップショットが追従できるようバージョンを上げる
+    update_expression = 'SET #v = :v ADD config_version :one'
+    values = {':v': is_active, ':one': 1}
+    if is_active:
+        update_expression = 'SET #v = :v, started_at_ms = if_not_exists(started_at_ms, :now) ADD config_version :one'
+        values[':now'] = int(time.time() * 1000)
+    response = game_state_table.update_item(
+        Key={'state_key': GAME_STATE_KEY},
+        UpdateExpression=update_expression,
+        ExpressionAttributeNames={'#v': 'value'},
+        ExpressionAttributeValues=values,
+        ReturnValues='ALL_NEW'
+    )
+    return int(response['Attributes']['config_version'])
+
+
+def set_admission_limits(game_state_table, limits):
+    # 受付制御の上限を更新する。指定しなかった項目は既定値に戻る
+    admission = parse_admission_limits(limits)
+    game_state_table.update_item(
+        Key={'state_key': GAME_STATE_KEY},
+        UpdateExpression='SET admission = :admission ADD config_version :one',
+        ExpressionAttributeValues={
+            ':admission': {**admission, 'refill_per_minute': Decimal(str(admission['refill_per_minute']))},
+            ':one': 1
+        }
+    )
+    return admission
+
+
+def bump_epoch(game_state_table):
+    # エポックを原子的に進める。古いエポックのデータはバックグラウンドで削除する
+    # 受付中のリセットでは新しいエポックの開始時刻を今にする（ICPCのペナルティは新しい開始時刻から数える）
+    # 停止中なら開始時刻を消し、次に受付を始めたときに bump_version が記録する
+    updates = (
+        ('SET started_at_ms = :now ADD epoch :one, config_version :one', '#v = :active'),
+        ('REMOVE started_at_ms ADD epoch :one, config_version :one', 'attribute_not_exists(#v) OR #v <> :active')
+    )
+    while True:
+        # 2つの更新の間に受付状態が切り替わったら、やり直す
+        for update_expression, condition in updates:
+            values = {':one': 1, ':active': True}
+            if ':now' in update_expression:
+                values[':now'] = int(time.time() * 1000)
+            try:
+                response = game_state_table.update_item(
+                    Key={'state_key': GAME_STATE_KEY},
+                    UpdateExpression=update_expression,
+                    ConditionExpression=condition,
+                    ExpressionAttributeNames={'#v': 'value'},
+                    ExpressionAttributeValues=values,
+                    ReturnValues='ALL_NEW'
+                )
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                continue
+            return int(response['Attributes']['epoch'])
+
+
+_default_config = None
+_default_lock = threading.Lock()
+
+
+def get_contest_config():
+    global _default_config
+    with _default_lock:
+        if _default_config is None:
+            game_state_table = None
+            if os.environ.get('GAME_STATE_TABLE'):
+                game_state_table = aws_clients.table(os.environ['GAME_STATE_TABLE'])
+            s3_client = aws_clients.client('s3') if os.environ.get('WEBSITE_BUCKET') else None
+            _default_config = ContestConfig(game_state_table, s3_client, os.environ.get('WEBSITE_BUCKET'))
+        return _default_config
@@ -0,0 +1,63 @@
+# リセットで不要になった古いエポックの提出・集計レコードをバックグラウンドで削除する
+# reset.handler から非同期で呼び出される。途中で終わっても再実行すれば続きから消える（冪等）
+import json
+import aws_clients
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+table = aws_clients.table(os.environ['LEADERBOARD_TABLE'])
+standings_table = aws_clients.table(os.environ['STANDINGS_TABLE'])
+
+TOTAL_SEGMENTS = int(os.environ.get('GC_TOTAL_SEGMENTS', '4'))
+# テーブル全体での1秒あたりの削除件数の上限（次の回の書き込み容量を食いつぶさないため）
+MAX_DELETES_PER_SECOND = float(os.environ.get('GC_MAX_DELETES_PER_SECOND', '200'))
+
+def collect_segment(target_table, key_names, epoch, segment, total_segments, deletes_per_second):
+    # エポック属性のない導入前のレコードも古いものとして削除する
+    scan_kwargs = {
+        'Segment': segment,
+        'TotalSegments': total_segments,
+        'FilterExpression': 'attribute_not_exists(#e) OR #e < :e',
+        'ProjectionExpression': ', '.join(f'#k{i}' for i in range(len(key_names))),
+        'ExpressionAttributeNames': {'#e': 'epoch', **{f'#k{i}': name for i, name in enumerate(key_names)}},
+        'ExpressionAttributeValues': {':e': epoch}
+    }
+    deleted = 0
+    with target_table.batch_writer() as batch:
+        while True:
+            response = target_table.scan(**scan_kwargs)
+            started = time.monotonic()
+            for item in response.get('Items', []):
+                batch.delete_item(Key={name: item[name] for name in key_names})
+            deleted += len(response.get('Items', []))
+            # ページごとに削除レートを一定以下に抑える
+            min_seconds = len(response.get('Items', [])) / deletes_per_second
+            elapsed = time.monotonic() - started
+            if elapsed < min_seconds:
+                time.sleep(min_seconds - elapsed)
+            if 'LastEvaluatedKey' not in response:
+                return deleted
+            scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def collect(target_table, key_names, epoch, total_segments=TOTAL_SEGMENTS, max_deletes_per_second=MAX_DELETES_PER_SECOND):
+    deletes_per_second = max_deletes_per_second / total_segments
+    with ThreadPoolExecutor(max_workers=total_segments) as executor:
+        counts = executor.map(
+            lambda segment: collect_segment(target_table, key_names, epoch, segment, total_segments, deletes_per_second),
+            range(total_segments)
+        )
+        return sum(counts)
+
+@metrics.instrument('epoch_gc')
+def handler(event, context):
+    # event['epoch'] より前のエポックのレコードをすべて削除する
+    epoch = int(event['epoch'])
+    result = {
+        'epoch': epoch,
+        'submissions_deleted': collect(table, ['submission_id'], epoch),
+        'standings_deleted': collect(standings_table, ['epoch', 'username'], epoch)
+    }
+    print(json.dumps(result))
+    return result
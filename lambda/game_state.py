@@ -1,18 +1,21 @@
 import json
-import boto3
+import aws_clients
 import os
+from contest_config import get_contest_config, bump_version, set_admission_limits
+from live_updates import game_state_message, notify
+import metrics
 
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table(os.environ['GAME_STATE_TABLE'])
+table = aws_clients.table(os.environ['GAME_STATE_TABLE'])
+contest_config = get_contest_config()
 
+@metrics.instrument('game_state')
 def handler(event, context):
     try:
         http_method = event['httpMethod']
         
         if http_method == 'GET':
-            # ゲーム状態を取得
-            response = table.get_item(Key={'state_key': 'game_active'})
-            is_active = response.get('Item', {}).get('value', False)
+            # ゲーム状態を取得（TTL付きスナップショット）
+            is_active = contest_config.is_game_active()
             
             return {
                 'statusCode': 200,
@@ -26,12 +29,21 @@ def handler(event, context):
         elif http_method == 'POST':
             # ゲーム状態を更新
             body = json.loads(event['body'])
-            is_active = body.get('is_active', True)
+            result = {'message': 'Game state updated'}
             
-            table.put_item(Item={
-                'state_key': 'game_active',
-                'value': is_active
-            })
+            if 'admission' in body:
+                # 提出の受付制御の上限（burst / refill_per_minute / max_in_flight）を更新する
+                result['admission'] = set_admission_limits(table, body['admission'])
+            
+            if 'is_active' in body or 'admission' not in body:
+                is_active = body.get('is_active', True)
+                # 他のハンドラのスナップショットに伝わるようバージョンも上げる
+                bump_version(table, is_active)
+                result['is_active'] = is_active
+            contest_config.invalidate()
+            if 'is_active' in result:
+                # 接続中のブラウザにはポーリングを待たずに知らせる
+                notify(game_state_message(result['is_active']))
             
             return {
                 'statusCode': 200,
@@ -39,7 +51,7 @@ def handler(event, context):
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
                 },
-                'body': json.dumps({'message': 'Game state updated', 'is_active': is_active})
+                'body': json.dumps(result)
             }
         
         else:
@@ -0,0 +1,190 @@
+# 同一コードの採点結果を使い回すためのキャッシュ
+# コンテナ内のLRUと、コンテナ間で共有するDynamoDB(TTL付き)の2段構成
+import json
+import threading
+import time
+from collections import OrderedDict
+from botocore.exceptions import ClientError
+
+STATUS_PENDING = 'pending'
+STATUS_DONE = 'done'
+
+
+# 採点結果の形式が変わったら上げる（古い形式のキャッシュを読まないため）
+VERDICT_SCHEMA_VERSION = 3
+
+
+def make_cache_key(problem_number, test_set_version, fingerprint):
+    # fingerprint は提出コードのASTの指紋（static_check）
+    return f'v{VERDICT_SCHEMA_VERSION}#{problem_number}#{test_set_version}#{fingerprint}'
+
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.verdict = None
+
+
+class JudgeCache:
+    def __init__(self, table=None, max_entries=1024, ttl_seconds=86400,
+                 lease_seconds=30, poll_interval_seconds=0.5):
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.lease_seconds = lease_seconds
+        self.poll_interval_seconds = poll_interval_seconds
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.stats = {'memory_hits': 0, 'shared_hits': 0, 'coalesced': 0, 'misses': 0}
+
+    def _memory_get(self, key):
+        with self._lock:
+            verdict = self._entries.get(key)
+            if verdict is not None:
+                self._entries.move_to_end(key)
+                self.stats['memory_hits'] += 1
+            return verdict
+
+    def _memory_put(self, key, verdict):
+        with self._lock:
+            self._entries[key] = verdict
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def lookup(self, key):
+        # 採点済みの結果だけを返す（採点中のリースは待たない）。まとめて採点する前の確認用
+        verdict = self._memory_get(key)
+        if verdict is not None or self.table is None:
+            return verdict
+        item = self.table.get_item(Key={'cache_key': key}, ConsistentRead=True).get('Item')
+        if item and item.get('status') == STATUS_DONE:
+            return self._shared_hit(key, item)
+        return None
+
+    def store(self, key, verdict):
+        self._memory_put(key, verdict)
+        if self.table is not None:
+            self.table.put_item(Item={
+                'cache_key': key,
+                'status': STATUS_DONE,
+                'verdict': json.dumps(verdict),
+                'expires_at': int(time.time()) + self.ttl_seconds
+            })
+
+    def get_or_judge(self, key, judge):
+        # judge() は (verdict, cacheable) を返す。実行基盤のエラーなどはキャッシュしない
+        verdict = self._memory_get(key)
+        if verdict is not None:
+            return verdict
+
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._inflight[key] = flight
+            else:
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            # 同じコンテナ内で採点中の同一コードは、その結果を待つ
+            flight.event.wait()
+            if flight.verdict is not None:
+                return flight.verdict
+            verdict, _ = judge()
+            return verdict
+
+        try:
+            flight.verdict = self._judge_shared(key, judge)
+            return flight.verdict
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.event.set()
+
+    def _judge_shared(self, key, judge):
+        if self.table is None:
+            return self._judge_and_store(key, judge, leased=False)
+
+        item = self.table.get_item(Key={'cache_key': key}, ConsistentRead=True).get('Item')
+        if item and item.get('status') == STATUS_DONE:
+            return self._shared_hit(key, item)
+
+        if not self._acquire_lease(key):
+            # 別コンテナが採点中なら、リース期限まで完了を待つ
+            item = self._wait_for_result(key)
+            if item is not None:
+                return self._shared_hit(key, item)
+            return self._judge_and_store(key, judge, leased=False)
+
+        return self._judge_and_store(key, judge, leased=True)
+
+    def _shared_hit(self, key, item):
+        verdict = json.loads(item['verdict'])
+        with self._lock:
+            self.stats['shared_hits'] += 1
+        self._memory_put(key, verdict)
+        return verdict
+
+    def _acquire_lease(self, key):
+        now = int(time.time())
+        try:
+            self.table.put_item(
+                Item={
+                    'cache_key': key,
+                    'status': STATUS_PENDING,
+                    'lease_expires_at': now + self.lease_seconds,
+                    'expires_at': now + self.lease_seconds
+                },
+                ConditionExpression='attribute_not_exists(cache_key) OR (#s = :pending AND lease_expires_at < :now)',
+                ExpressionAttributeNames={'#s': 'status'},
+                ExpressionAttributeValues={':pending': STATUS_PENDING, ':now': now}
+            )
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def _wait_for_result(self, key):
+        deadline = time.time() + self.lease_seconds
+        while time.time() < deadline:
+            time.sleep(self.poll_interval_seconds)
+            item = self.table.get_item(Key={'cache_key': key}, ConsistentRead=True).get('Item')
+            if item is None:
+                return None
+            if item.get('status') == STATUS_DONE:
+                return item
+            if int(item.get('lease_expires_at', 0)) < time.time():
+                return None
+        return None
+
+    def _judge_and_store(self, key, judge, leased):
+        with self._lock:
+            self.stats['misses'] += 1
+        try:
+            verdict, cacheable = judge()
+        except Exception:
+            if leased:
+                self._release_lease(key)
+            raise
+
+        if cacheable:
+            self.store(key, verdict)
+        elif leased:
+            self._release_lease(key)
+        return verdict
+
+    def _release_lease(self, key):
+        try:
+            self.table.delete_item(
+                Key={'cache_key': key},
+                ConditionExpression='#s = :pending',
+                ExpressionAttributeNames={'#s': 'status'},
+                ExpressionAttributeValues={':pending': STATUS_PENDING}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
@@ -0,0 +1,477 @@
+# Code Interpreterのサンドボックス内で実行される採点ハーネス
+# Lambdaからは writeFiles でテキストとして送信され、executeCode で1回だけ実行される
+# 提出コードはハーネスとは別の子プロセスで import・実行する。子プロセスの標準出力は捨て、結果は専用のパイプで受け取る
+# 子プロセスは新しいプロセスグループで起動し、終わったらグループごと止める。組み込み関数の書き換えやスレッドはここで消えるが、
+# setsid でグループを抜けたプロセスは残るので、セッションを使い回す前に session_pool のリセットで止める
+# 制限時間は子プロセスの中(SIGALRM)と外の両方で守る。SIGALRM の例外を握りつぶす提出コードは、
+# ハーネスが待ちきれなくなった時点で子プロセスごと止めて TLE にする
+# 正誤はハーネス（親）が判定し、Lambdaから渡された実行ごとの nonce を付けた行だけを書く（Lambdaは nonce のない行を無視する）
+# 子プロセスからパイプで届くレコードは提出コードが書いたものかもしれないので、親は形を検証し、正誤と性能の値は自分で決める
+import hashlib
+import importlib
+import io
+import json
+import os
+import select
+import signal
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import redirect_stdout
+
+RESULT_MARKER = '__JUDGE_RESULT__'
+INPUT_PATH = 'judge_input.json'
+SOLVER_MODULE = 'solver'
+OUTPUT_LIMIT_BYTES = 64 * 1024
+# 子プロセスとして起動されたことを示す引数
+CHILD_FLAG = '--solver-process'
+CASE_STATUSES = ('ok', 'timeout', 'output_limit', 'mismatch', 'error')
+# 子プロセスの外で待つときは、結果を書き出す時間の分だけ制限時間に上乗せする
+TIME_LIMIT_GRACE_SECONDS = 0.5
+# import（モジュール直下のコードの実行）を待つ上限
+IMPORT_TIME_LIMIT_SECONDS = 10
+# clock_gettime で別プロセス全体のCPU時間を読むためのクロック（Linux の CPUCLOCK_SCHED）
+PROCESS_CPU_CLOCK = 2
+
+
+class TimeLimitExceeded(BaseException):
+    # 提出コードの except Exception で握りつぶされないよう BaseException を継承する
+    pass
+
+
+class OutputLimitExceeded(BaseException):
+    pass
+
+
+class OutputMismatch(BaseException):
+    # 出力がこれ以上どう続いても期待値と一致しなくなった
+    pass
+
+
+class BoundedOutput(io.TextIOBase):
+    # 1ケース分の標準出力を上限付きで受け取る。上限を超えるか、前後の空白を除いた長さが
+    # 期待値を超えた時点で例外を投げて提出コードを止める（大量の出力を溜め込まない）
+    def __init__(self, limit_bytes, expected_length=None):
+        self.limit_bytes = limit_bytes
+        self.expected_length = expected_length
+        self.parts = []
+        self.size = 0
+        self.position = 0
+        self.content_start = None
+        self.content_end = None
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self.size += len(text.encode('utf-8'))
+        if self.size > self.limit_bytes:
+            raise OutputLimitExceeded()
+        self.parts.append(text)
+        stripped = text.strip()
+        if stripped:
+            # 空白以外の文字が最初・最後に現れた位置だけを追えば、strip後の長さがわかる
+            if self.content_start is None:
+                self.content_start = self.position + len(text) - len(text.lstrip())
+            self.content_end = self.position + len(text.rstrip())
+        self.position += len(text)
+        if self.expected_length is not None and self.content_start is not None \
+                and self.content_end - self.content_start > self.expected_length:
+            raise OutputMismatch()
+        return len(text)
+
+    def getvalue(self):
+        return ''.join(self.parts)
+
+
+def digest(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def on_time_limit(signum, frame):
+    raise TimeLimitExceeded()
+
+
+def set_time_limit(seconds):
+    # シグナルはメインスレッドでしか使えないため、使えない環境では制限なしで実行する
+    try:
+        signal.signal(signal.SIGALRM, on_time_limit)
+        signal.setitimer(signal.ITIMER_REAL, seconds)
+        return True
+    except (ValueError, AttributeError, OSError):
+        return False
+
+
+def clear_time_limit():
+    try:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+    except (ValueError, AttributeError, OSError):
+        pass
+
+
+def run_case(solver, index, test_input, time_limit_seconds, output_limit_bytes=OUTPUT_LIMIT_BYTES, expected_length=None):
+    buffer = BoundedOutput(output_limit_bytes, expected_length)
+    set_time_limit(time_limit_seconds)
+    started = time.perf_counter()
+    try:
+        with redirect_stdout(buffer):
+            if test_input is None:
+                print(solver())
+            else:
+                print(solver(test_input))
+        record = {'index': index, 'status': 'ok', 'output': buffer.getvalue()}
+    except TimeLimitExceeded:
+        record = {'index': index, 'status': 'timeout', 'output': buffer.getvalue()}
+    except OutputLimitExceeded:
+        record = {'index': index, 'status': 'output_limit', 'output': ''}
+    except OutputMismatch:
+        record = {'index': index, 'status': 'mismatch', 'output': buffer.getvalue()}
+    except (Exception, SystemExit) as e:
+        # 1ケースの例外で残りのケースが実行されなくならないよう、ケース単位で捕捉する
+        record = {'index': index, 'status': 'error', 'output': buffer.getvalue(), 'error': f'{type(e).__name__}: {e}'}
+    finally:
+        clear_time_limit()
+    elapsed = time.perf_counter() - started
+    if elapsed > time_limit_seconds:
+        # TimeLimitExceeded を握りつぶして、制限時間を過ぎてから返した
+        record = {'index': index, 'status': 'timeout', 'output': record['output']}
+    # サンドボックス内で測ったケースごとの実行時間（Lambda側でメトリクスとして出力する）
+    record['elapsed_ms'] = round(elapsed * 1000, 3)
+    return record
+
+
+def call_quietly(solver, test_input, time_limit_seconds, output_limit_bytes):
+    # 計測用に solver を1回呼ぶ。制限時間内に正常に終わったら出力を、そうでなければ None を返す
+    buffer = BoundedOutput(output_limit_bytes)
+    set_time_limit(time_limit_seconds)
+    started = time.perf_counter()
+    try:
+        with redirect_stdout(buffer):
+            if test_input is None:
+                print(solver())
+            else:
+                print(solver(test_input))
+        if time.perf_counter() - started > time_limit_seconds:
+            return None
+        return buffer.getvalue()
+    except (Exception, SystemExit, TimeLimitExceeded, OutputLimitExceeded):
+        return None
+    finally:
+        clear_time_limit()
+
+
+# ---- 子プロセス（提出コードを動かす側） ----
+
+def child_main(solver_module, channel_fd):
+    # 設定は標準入力の1行目で受け取り、結果は channel_fd に1行1レコードで書く
+    # 標準出力は親が捨てるので、import 時に何を出力しても結果にはならない
+    config = json.loads(sys.stdin.readline())
+    commands = sys.stdin
+    sys.stdin = io.StringIO()
+    channel = os.fdopen(channel_fd, 'w', encoding='utf-8')
+
+    def send(record):
+        channel.write(json.dumps(record, ensure_ascii=False) + '\n')
+        channel.flush()
+
+    test_inputs = config['inputs']
+    time_limit_seconds = config['time_limit_seconds']
+    output_limit_bytes = config['output_limit_bytes']
+    if config['mode'] == 'measure':
+        # 提出コードを import する直前で止まる。親はここでCPU時間とメモリの起点を記録する
+        send({'index': None, 'status': 'starting'})
+        commands.readline()
+    commands.close()
+    try:
+        solver = importlib.import_module(solver_module).solver
+    except (Exception, SystemExit) as e:
+        send({'index': None, 'status': 'import_error', 'error': f'{type(e).__name__}: {e}', 'error_type': type(e).__name__})
+        return
+    send({'index': None, 'status': 'ready'})
+
+    if config['mode'] == 'measure':
+        # 1回だけ呼び、出力のハッシュだけを返す。CPU時間とメモリは親が子プロセスの外から測る
+        output = call_quietly(solver, test_inputs[0], time_limit_seconds, output_limit_bytes)
+        send({'index': None, 'status': 'done', 'digest': None if output is None else digest(output.strip())})
+        return
+
+    # 途中のケースで止められたときは、次のケースから新しい子プロセスで続ける
+    expected_lengths = config['expected_lengths']
+    for index in range(config['start'], len(test_inputs)):
+        send(run_case(solver, index, test_inputs[index], time_limit_seconds, output_limit_bytes, expected_lengths[index]))
+
+
+# ---- 親（ハーネス） ----
+
+class InvalidRecord(Exception):
+    pass
+
+
+class SolverTimeout(Exception):
+    pass
+
+
+class SolverProcess:
+    # 提出コードを動かす子プロセスと、その結果を受け取るパイプ
+    def __init__(self, solver_module, config, max_line_bytes):
+        read_fd, write_fd = os.pipe()
+        try:
+            self.process = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), CHILD_FLAG, solver_module, str(write_fd)],
+                stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                pass_fds=(write_fd,), start_new_session=True
+            )
+        finally:
+            os.close(write_fd)
+        self.fd = read_fd
+        self.max_line_bytes = max_line_bytes
+        self.buffer = bytearray()
+        self.eof = False
+        try:
+            self.process.stdin.write(json.dumps(config, ensure_ascii=False).encode('utf-8') + b'\n')
+            if config['mode'] == 'measure':
+                # import の直前で resume() を待たせる
+                self.process.stdin.flush()
+            else:
+                self.process.stdin.close()
+        except OSError:
+            # 起動直後に落ちた場合は、read() が None を返す
+            pass
+
+    def resume(self):
+        try:
+            self.process.stdin.write(b'\n')
+            self.process.stdin.close()
+        except OSError:
+            pass
+
+    def cpu_time_ns(self):
+        # 子プロセス全体（終了したスレッドも含む）のCPU時間を外から読む
+        return time.clock_gettime_ns(((~self.process.pid) << 3) | PROCESS_CPU_CLOCK)
+
+    def memory_kb(self, field):
+        with open(f'/proc/{self.process.pid}/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+        raise ValueError(f'{field} is not available')
+
+    def reset_peak_memory(self):
+        # ピーク（VmHWM）を現在の常駐メモリまで下げ、その値を返す
+        with open(f'/proc/{self.process.pid}/clear_refs', 'w') as f:
+            f.write('5')
+        return self.memory_kb('VmRSS')
+
+    def read(self, timeout_seconds):
+        # 次のレコードを返す。子プロセスが終了していたら None、timeout_seconds 以内に届かなければ SolverTimeout
+        deadline = time.monotonic() + timeout_seconds
+        while b'\n' not in self.buffer:
+            if self.eof:
+                return None
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([self.fd], [], [], remaining)[0]:
+                raise SolverTimeout()
+            chunk = os.read(self.fd, 65536)
+            if not chunk:
+                self.eof = True
+                continue
+            self.buffer += chunk
+            if len(self.buffer) > self.max_line_bytes and b'\n' not in self.buffer:
+                raise InvalidRecord('Result record is too long')
+        line, _, rest = bytes(self.buffer).partition(b'\n')
+        self.buffer = bytearray(rest)
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise InvalidRecord('Malformed result record')
+        if not isinstance(record, dict):
+            raise InvalidRecord('Malformed result record')
+        return record
+
+    def close(self):
+        # 子プロセスが正常に終わっていても、残したスレッドや孫プロセスごと止める
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self.process.wait()
+        os.close(self.fd)
+
+
+def case_record(record, index):
+    # 子プロセスのレコードからハーネスが使う項目だけを取り出す（提出コードがパイプに書き込んだ場合もある）
+    if record is None:
+        return {'index': index, 'status': 'error', 'output': '', 'error': 'Solver process exited'}
+    output = record.get('output', '')
+    elapsed_ms = record.get('elapsed_ms', 0)
+    if record.get('index') != index or record.get('status') not in CASE_STATUSES or not isinstance(output, str) \
+            or not isinstance(elapsed_ms, (int, float)):
+        raise InvalidRecord('Unexpected result record')
+    checked = {'index': index, 'status': record['status'], 'output': output, 'elapsed_ms': elapsed_ms}
+    if 'error' in record:
+        checked['error'] = str(record['error'])[:1000]
+    return checked
+
+
+def import_error_record(record):
+    error = str(record.get('error', ''))[:1000]
+    error_type = str(record.get('error_type', ''))[:100]
+    return {'index': None, 'status': 'import_error', 'error': error, 'error_type': error_type}
+
+
+def has_status(record, status):
+    return record is not None and record.get('status') == status
+
+
+def measure_once(solver_module, config, expected_digest):
+    # 新しい子プロセスで import と1回の呼び出しを行い、その間のCPU時間とピークメモリの増分を子プロセスの外から測る
+    # 子プロセスからは出力のハッシュしか受け取らないので、提出コードが計測値を書き換えることはできない
+    # 1プロセス1回なので、前の呼び出しの結果を覚えておいて速く見せることもできない。測れなかったら None
+    process = SolverProcess(solver_module, config, 4096)
+    try:
+        if not has_status(process.read(IMPORT_TIME_LIMIT_SECONDS), 'starting'):
+            return None
+        cpu_started = process.cpu_time_ns()
+        memory_started = process.reset_peak_memory()
+        process.resume()
+        if not has_status(process.read(IMPORT_TIME_LIMIT_SECONDS), 'ready'):
+            return None
+        record = process.read(config['time_limit_seconds'] + TIME_LIMIT_GRACE_SECONDS)
+        if not has_status(record, 'done') or record.get('digest') != expected_digest:
+            return None
+        cpu_ns = process.cpu_time_ns() - cpu_started
+        peak_kb = process.memory_kb('VmHWM') - memory_started
+    except (InvalidRecord, SolverTimeout, OSError, ValueError):
+        return None
+    finally:
+        process.close()
+    return cpu_ns // 1000, max(peak_kb, 0) * 1024
+
+
+def measure_case(solver_module, config, expected_digest, repeats, deadline):
+    # 最大 repeats 回測ったCPU時間の中央値とピークメモリの最大値。予算を超えたら回数を減らす
+    samples = []
+    for _ in range(repeats):
+        if samples and time.monotonic() > deadline:
+            break
+        sample = measure_once(solver_module, config, expected_digest)
+        if sample is None:
+            return None
+        samples.append(sample)
+    return {'cpu_us': int(statistics.median(cpu_us for cpu_us, _ in samples)),
+            'peak_memory_bytes': max(peak for _, peak in samples), 'repeats': len(samples)}
+
+
+def start_solver(solver_module, config, output_limit_bytes):
+    # 子プロセスを起動して import を待つ。import できなければ (None, import_error のレコード)
+    process = SolverProcess(solver_module, config, output_limit_bytes * 6 + 4096)
+    try:
+        record = process.read(IMPORT_TIME_LIMIT_SECONDS)
+    except InvalidRecord:
+        record = None
+    except SolverTimeout:
+        process.close()
+        return None, {'index': None, 'status': 'import_error', 'error': 'Import timed out',
+                      'error_type': 'TimeLimitExceeded'}
+    if record is not None and record.get('status') == 'ready':
+        return process, None
+    process.close()
+    if record is not None and record.get('status') == 'import_error':
+        return None, import_error_record(record)
+    return None, {'index': None, 'status': 'import_error', 'error': 'Solver process exited', 'error_type': 'SystemExit'}
+
+
+def main(input_path=INPUT_PATH, solver_module=SOLVER_MODULE, nonce=None):
+    # まとめて提出された複数の問題は、問題ごとに別の入力ファイルとソルバーのモジュールで呼ばれる
+    # そのときは先に実行される提出コードが後の問題の入力ファイルを読めるので、nonce はファイルではなく引数で渡される
+    with open(input_path, encoding='utf-8') as f:
+        config = json.load(f)
+    # 期待出力のハッシュと nonce は親だけが持つ。提出コードの実行前に入力ファイルを消しておく
+    os.remove(input_path)
+    marker = RESULT_MARKER + (config.get('nonce', '') if nonce is None else nonce)
+
+    def emit(record):
+        print(marker + json.dumps(record, ensure_ascii=False), flush=True)
+
+    test_inputs = config['inputs']
+    expected_digests = config.get('expected_digests')
+    fail_fast = config.get('fail_fast', False)
+    time_limit_seconds = config.get('time_limit_seconds', 2)
+    output_limit_bytes = config.get('output_limit_bytes', OUTPUT_LIMIT_BYTES)
+    # 期待出力の長さ（strip後の文字数）。これを超えた出力は一致しないので途中で打ち切る
+    expected_lengths = config.get('expected_lengths') or [None] * len(test_inputs)
+    # 全ケースに正解したときだけ、ケースごとの性能を測る（{'repeats', 'budget_seconds'}）
+    measure = config.get('measure')
+    child_config = {
+        'mode': 'run',
+        'start': 0,
+        'inputs': test_inputs,
+        'time_limit_seconds': time_limit_seconds,
+        'output_limit_bytes': output_limit_bytes,
+        'expected_lengths': expected_lengths
+    }
+
+    process, error = start_solver(solver_module, child_config, output_limit_bytes)
+    if error is not None:
+        emit(error)
+        return
+
+    all_passed = True
+    try:
+        for index in range(len(test_inputs)):
+            broken = None
+            if process is None:
+                # 前のケースで制限時間を超えて止めた
+                process, error = start_solver(solver_module, {**child_config, 'start': index}, output_limit_bytes)
+                if error is not None:
+                    broken = error['error']
+            if broken is None:
+                waited = time.monotonic()
+                try:
+                    record = case_record(process.read(time_limit_seconds + TIME_LIMIT_GRACE_SECONDS), index)
+                except SolverTimeout:
+                    record = {'index': index, 'status': 'timeout', 'output': '',
+                              'elapsed_ms': round((time.monotonic() - waited) * 1000, 3)}
+                    process.close()
+                    process = None
+                except InvalidRecord as e:
+                    broken = str(e)
+                else:
+                    if 'elapsed_ms' not in record:
+                        broken = record['error']
+            if broken is not None:
+                # 子プロセスが落ちたか、パイプに不正な行が書かれた。残りのケースは実行されない
+                for rest in range(index, len(test_inputs)):
+                    emit({'index': rest, 'status': 'error', 'output': '', 'error': broken,
+                          **({'passed': False} if expected_digests is not None else {})})
+                all_passed = False
+                break
+            if expected_digests is not None:
+                record['passed'] = record['status'] == 'ok' and digest(record['output'].strip()) == expected_digests[index]
+            all_passed = all_passed and record.get('passed', record['status'] == 'ok')
+            emit(record)
+            # 最初の不正解ケースで打ち切り、サンドボックスをすぐに解放する
+            if fail_fast and not record.get('passed', True):
+                break
+    finally:
+        if process is not None:
+            process.close()
+
+    if measure and all_passed and expected_digests is not None:
+        deadline = time.monotonic() + measure.get('budget_seconds', 2)
+        cases = [measure_case(solver_module, {**child_config, 'mode': 'measure', 'inputs': [test_input],
+                                              'expected_lengths': [None]},
+                              expected_digests[index], measure.get('repeats', 5), deadline)
+                 for index, test_input in enumerate(test_inputs)]
+        emit({'index': None, 'status': 'perf', 'cases': cases})
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == CHILD_FLAG:
+        solver_module, channel_fd = sys.argv[2], int(sys.argv[3])
+        # 提出コードから引数として見えないようにしておく
+        del sys.argv[1:]
+        child_main(solver_module, channel_fd)
+    else:
+        main()
@@ -0,0 +1,177 @@
+# 非同期採点のジョブ管理
+# AWS上ではSQS + ワーカーLambda、ローカル実行時はプロセス内のスレッドプールで代替する
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+import aws_clients
+
+JOB_TTL_SECONDS = 24 * 60 * 60
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+class JobStore:
+    def __init__(self, table=None):
+        # table が None の場合はメモリ上で管理する（ローカル実行用）
+        self.table = table
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def create(self, username, problem_number):
+        now = int(time.time())
+        job = {
+            'job_id': str(uuid.uuid4()),
+            'status': STATUS_QUEUED,
+            'username': username,
+            'problem_number': problem_number,
+            'created_at': now,
+            'expires_at': now + JOB_TTL_SECONDS
+        }
+        if self.table is not None:
+            self.table.put_item(Item=job)
+        else:
+            with self._lock:
+                self._items[job['job_id']] = dict(job)
+        return job
+
+    def _update(self, job_id, **attributes):
+        attributes['updated_at'] = int(time.time())
+        if self.table is None:
+            with self._lock:
+                self._items[job_id].update(attributes)
+            return
+        names = {f'#{k}': k for k in attributes}
+        values = {f':{k}': v for k, v in attributes.items()}
+        self.table.update_item(
+            Key={'job_id': job_id},
+            UpdateExpression='SET ' + ', '.join(f'#{k} = :{k}' for k in attributes),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values
+        )
+
+    def mark_running(self, job_id):
+        self._update(job_id, status=STATUS_RUNNING)
+
+    def mark_queued(self, job_id):
+        self._update(job_id, status=STATUS_QUEUED)
+
+    def complete(self, job_id, status_code, result):
+        self._update(job_id, status=STATUS_DONE, status_code=status_code, result=result)
+
+    def fail(self, job_id, error):
+        self._update(job_id, status=STATUS_FAILED, error=error)
+
+    def get(self, job_id):
+        if self.table is None:
+            with self._lock:
+                job = self._items.get(job_id)
+                return dict(job) if job else None
+        return self.table.get_item(Key={'job_id': job_id}).get('Item')
+
+
+class RejudgeJobStore(JobStore):
+    # 再採点ジョブ。判定済みのコード（ハッシュ→判定）を途中経過として持ち、中断しても続きから再開できる
+    # テストセットが変わると別のジョブになる
+    @staticmethod
+    def job_id(epoch, problem_number, test_set_version):
+        return f'rejudge#{epoch}#{problem_number}#{test_set_version}'
+
+    def start(self, epoch, problem_number, test_set_version):
+        # 新しいジョブを作るか、同じテストセットで失敗したジョブを再開する。(ジョブ, キューに積むべきか) を返す
+        now = int(time.time())
+        job = {
+            'job_id': self.job_id(epoch, problem_number, test_set_version),
+            'kind': 'rejudge',
+            'status': STATUS_QUEUED,
+            'epoch': epoch,
+            'problem_number': problem_number,
+            'test_set_version': test_set_version,
+            'verdicts': {},
+            'judged': 0,
+            'total': 0,
+            'created_at': now,
+            'expires_at': now + JOB_TTL_SECONDS
+        }
+        if self.table is None:
+            with self._lock:
+                if job['job_id'] not in self._items:
+                    self._items[job['job_id']] = {**job, 'verdicts': {}}
+                    return job, True
+        else:
+            try:
+                self.table.put_item(Item=job, ConditionExpression='attribute_not_exists(job_id)')
+                return job, True
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+        existing = self.get(job['job_id'])
+        if existing['status'] != STATUS_FAILED:
+            # 待ち・実行中のジョブはキューのメッセージで続きが走るので、二重に積まない
+            return existing, False
+        self.mark_queued(job['job_id'])
+        existing['status'] = STATUS_QUEUED
+        return existing, True
+
+    def checkpoint(self, job_id, verdicts, **attributes):
+        # 新しく判定できたコードの結果だけを verdicts マップに書き足す
+        attributes['updated_at'] = int(time.time())
+        if self.table is None:
+            with self._lock:
+                self._items[job_id]['verdicts'].update(verdicts)
+                self._items[job_id].update(attributes)
+            return
+        names = {'#verdicts': 'verdicts', **{f'#{k}': k for k in attributes}}
+        values = {f':{k}': v for k, v in attributes.items()}
+        actions = [f'#{k} = :{k}' for k in attributes]
+        for i, (digest, verdict) in enumerate(verdicts.items()):
+            names[f'#h{i}'] = digest
+            values[f':h{i}'] = verdict
+            actions.append(f'#verdicts.#h{i} = :h{i}')
+        self.table.update_item(
+            Key={'job_id': job_id},
+            UpdateExpression='SET ' + ', '.join(actions),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values
+        )
+
+
+class SqsJobQueue:
+    def __init__(self, sqs_client, queue_url):
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+
+    def enqueue(self, job):
+        self.sqs_client.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps(job))
+
+
+class LocalJobQueue:
+    # SQSの代わりに、同時実行数を制限したスレッドプールでワーカーを動かす
+    def __init__(self, worker, max_workers=4):
+        self.worker = worker
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def enqueue(self, job):
+        return self.executor.submit(self._run, job)
+
+    def _run(self, job):
+        try:
+            return self.worker(job)
+        except Exception as e:
+            print(f"Job {job['job_id']} failed: {str(e)}")
+            raise
+
+
+def get_job_queue(worker, queue_url_variable='JUDGE_QUEUE_URL', max_workers=None):
+    queue_url = os.environ.get(queue_url_variable)
+    if queue_url:
+        return SqsJobQueue(aws_clients.client('sqs'), queue_url)
+    if max_workers is None:
+        max_workers = int(os.environ.get('JUDGE_WORKER_CONCURRENCY', '4'))
+    return LocalJobQueue(worker, max_workers=max_workers)
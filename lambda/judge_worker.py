@@ -0,0 +1,15 @@
+import json
+from submit import process_job
+import metrics
+
+@metrics.instrument('judge_worker')
+def handler(event, context):
+    # SQSから受け取った採点ジョブを処理する。失敗したメッセージだけを再配信させる
+    failures = []
+    for record in event['Records']:
+        try:
+            process_job(json.loads(record['body']))
+        except Exception as e:
+            print(f"Error: {str(e)}")
+            failures.append({'itemIdentifier': record['messageId']})
+    return {'batchItemFailures': failures}
@@ -1,90 +1,178 @@
+import base64
+import binascii
 import json
-import boto3
+import aws_clients
 import os
-from decimal import Decimal
 import traceback
-from collections import defaultdict
+from standings import decimal_default, query_epoch, build_rows, performance_rows, to_entry
+from scoring import UserState
+from contest_config import get_contest_config
+import metrics
 
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table(os.environ['LEADERBOARD_TABLE'])
+standings_table = aws_clients.table(os.environ['STANDINGS_TABLE'])
+contest_config = get_contest_config()
 
-def decimal_default(obj):
-    if isinstance(obj, Decimal):
-        return int(obj)
-    raise TypeError
+# StandingsTable の GSI（epoch ごとに rank_key 順。rank_key は scoring.ScoringRules.rank_key）
+RANK_INDEX = 'RankIndex'
+ME_RESOURCE = '/leaderboard/me'
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
 
+
+class BadRequest(Exception):
+    pass
+
+
+def respond(status_code, body):
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps(body, default=decimal_default)
+    }
+
+
+def encode_cursor(last_key, offset):
+    # 次のページの開始位置と、そのページの先頭の順位
+    payload = json.dumps({'key': last_key, 'offset': offset}, default=decimal_default, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, epoch):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        key, offset = payload['key'], int(payload['offset'])
+        if set(key) != {'epoch', 'rank_key', 'username'} or offset < 0:
+            raise ValueError(cursor)
+    except (binascii.Error, ValueError, TypeError, KeyError, AttributeError):
+        raise BadRequest('Invalid cursor.')
+    # リセットをまたいだカーソルは使えない
+    if key['epoch'] != epoch:
+        raise BadRequest('The cursor is from a previous contest. Please start over.')
+    return key, offset
+
+
+def page_size(value):
+    if value is None:
+        return DEFAULT_PAGE_SIZE
+    if not value.isdigit() or int(value) == 0:
+        raise BadRequest('limit must be a positive integer.')
+    return min(int(value), MAX_PAGE_SIZE)
+
+
+def ranked_page(epoch, limit, cursor=None):
+    # 上位から limit 人分だけを索引から読む（全ユーザーを読んで並べ替えない）
+    query_kwargs = {
+        'IndexName': RANK_INDEX,
+        'KeyConditionExpression': '#e = :e',
+        'ExpressionAttributeNames': {'#e': 'epoch'},
+        'ExpressionAttributeValues': {':e': epoch},
+        'Limit': limit
+    }
+    offset = 0
+    if cursor is not None:
+        query_kwargs['ExclusiveStartKey'], offset = decode_cursor(cursor, epoch)
+    response = standings_table.query(**query_kwargs)
+    items = response.get('Items', [])
+    rules = contest_config.scoring_rules()
+    rows = [to_entry(UserState.from_item(item), rules, rank)
+            for rank, item in enumerate(items, start=offset + 1)]
+    next_cursor = None
+    if 'LastEvaluatedKey' in response:
+        next_cursor = encode_cursor(response['LastEvaluatedKey'], offset + len(items))
+    return {'rows': rows, 'next_cursor': next_cursor}
+
+
+def count_ahead(epoch, rank_key):
+    # 自分より前に並ぶユーザー数を索引の範囲クエリで数える（項目は返さない）
+    # Select='COUNT' でも前に並ぶ索引の項目はすべて読まれて読み込み容量を消費し、1MB ごとにページが分かれるので、
+    # 時間と費用は順位に比例する（下位のユーザーほど重い）
+    query_kwargs = {
+        'IndexName': RANK_INDEX,
+        'KeyConditionExpression': '#e = :e AND rank_key < :k',
+        'ExpressionAttributeNames': {'#e': 'epoch'},
+        'ExpressionAttributeValues': {':e': epoch, ':k': rank_key},
+        'Select': 'COUNT'
+    }
+    ahead = 0
+    while True:
+        response = standings_table.query(**query_kwargs)
+        ahead += response['Count']
+        if 'LastEvaluatedKey' not in response:
+            return ahead
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def my_rank(epoch, username):
+    item = standings_table.get_item(Key={'epoch': epoch, 'username': username}).get('Item')
+    if item is None:
+        return None
+    rules = contest_config.scoring_rules()
+    state = UserState.from_item(item)
+    # 書き込み直後で rank_key がまだ無くても、今の状態から求めて数える
+    rank_key = item.get('rank_key') or rules.rank_key(state)
+    rank = count_ahead(epoch, rank_key) + 1
+    return {'rank': rank, 'row': to_entry(state, rules, rank)}
+
+
+@metrics.instrument('leaderboard')
 def handler(event, context):
     try:
-        response = table.scan()
-        items = response.get('Items', [])
-        
-        # ユーザーごとに集計
-        user_data = defaultdict(lambda: {'problem1_time': None, 'problem2_time': None, 'problem3_time': None, 'problem4_time': None})
-        
-        for item in items:
-            username = item.get('username', '')
-            problem_number = int(item.get('problem_number', 0))
-            timestamp = item.get('timestamp', '')
-            
-            if problem_number == 1:
-                user_data[username]['problem1_time'] = timestamp
-            elif problem_number == 2:
-                user_data[username]['problem2_time'] = timestamp
-            elif problem_number == 3:
-                user_data[username]['problem3_time'] = timestamp
-            elif problem_number == 4:
-                user_data[username]['problem4_time'] = timestamp
-        
-        # 結果を構築
-        result = []
-        for username, data in user_data.items():
-            # 各ユーザーの解いた問題数と最新のクリア時間を取得
-            times = [data['problem1_time'], data['problem2_time'], data['problem3_time'], data['problem4_time']]
-            valid_times = [t for t in times if t is not None]
-            solved_count = len(valid_times)
-            latest_time = max(valid_times) if valid_times else None
-            
-            # タイムスタンプをHH:mm:ss形式に変換
-            def format_time(timestamp):
-                if timestamp is None:
-                    return None
-                # "YYYY-MM-DD HH:MM:SS JST" から "HH:MM:SS" を抽出
-                parts = timestamp.split(' ')
-                if len(parts) >= 2:
-                    return parts[1]
-                return timestamp
-            
-            entry = {
-                'username': username,
-                'problem1_time': format_time(data['problem1_time']),
-                'problem2_time': format_time(data['problem2_time']),
-                'problem3_time': format_time(data['problem3_time']),
-                'problem4_time': format_time(data['problem4_time']),
-                'solved_count': solved_count,
-                'latest_time': latest_time
-            }
-            result.append(entry)
-        
-        # 解いた問題数で降順、同じ場合は最新クリア時間で昇順ソート
-        result.sort(key=lambda x: (-x['solved_count'], x['latest_time'] if x['latest_time'] else 'z'))
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps(result, default=decimal_default)
-        }
-        
+        params = event.get('queryStringParameters') or {}
+        epoch = contest_config.current_epoch()
+
+        # /leaderboard/me?username= なら、そのユーザーの順位と行だけを返す
+        if event.get('resource') == ME_RESOURCE:
+            username = params.get('username')
+            if not username:
+                return respond(400, {'error': 'username is required.'})
+            with metrics.timer('my_rank'):
+                result = my_rank(epoch, username)
+            if result is None:
+                return respond(404, {'error': f'{username} has no standing yet.'})
+            return respond(200, result)
+
+        # ?limit=&cursor= なら、順位順に1ページ分だけを返す
+        if 'limit' in params or 'cursor' in params:
+            try:
+                limit = page_size(params.get('limit'))
+                with metrics.timer('ranked_page'):
+                    result = ranked_page(epoch, limit, params.get('cursor'))
+            except BadRequest as e:
+                return respond(400, {'error': str(e)})
+            metrics.put('users', len(result['rows']), 'Count')
+            return respond(200, result)
+
+        # ?performance=<問題番号> なら、その問題の性能順位を返す（問題番号は集計テーブルを読む前に確かめる）
+        performance_problem = params.get('performance')
+        if performance_problem is not None:
+            problem = None
+            if performance_problem.isascii() and performance_problem.isdigit():
+                problem = contest_config.problems().get(int(performance_problem))
+            if problem is None or not problem['performance_ranking']:
+                return respond(400, {'error': f'Problem {performance_problem} has no performance ranking.'})
+
+        # 提出ごとの記録ではなく、submit で集計済みの現在のエポックのユーザー単位のレコードを読む
+        with metrics.timer('query_standings'):
+            items = query_epoch(standings_table, epoch)
+
+        if performance_problem is not None:
+            with metrics.timer('rank'):
+                result = performance_rows(items, int(performance_problem))
+            return respond(200, result)
+
+        # 問題カタログと採点ルールに従って順位付けする
+        with metrics.timer('rank'):
+            rules = contest_config.scoring_rules()
+            states = sorted((UserState.from_item(item) for item in items), key=rules.sort_key)
+            result = build_rows(states, rules)
+        metrics.put('users', len(result), 'Count')
+
+        return respond(200, result)
+
     except Exception as e:
         print(f"Error: {str(e)}")
         print(traceback.format_exc())
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': str(e), 'trace': traceback.format_exc()})
-        }
+        return respond(500, {'error': str(e), 'trace': traceback.format_exc()})
@@ -0,0 +1,165 @@
+# StandingsTable の DynamoDB Streams を受け取り、集計済みのリーダーボードを
+# Webサイト用バケットの静的JSONとして公開する（ブラウザはCloudFront経由でこれをポーリングする）
+# 変わったユーザーの行は WebSocket で接続中のブラウザにも差分として送る
+import json
+import aws_clients
+import os
+from botocore.exceptions import ClientError
+from standings import decimal_default, query_epoch, build_rows, to_entry
+from scoring import UserState, RankedBoard
+from contest_config import get_contest_config
+from live_updates import leaderboard_refresh, notify
+import metrics
+
+LEADERBOARD_KEY = 'data/leaderboard.json'
+CACHE_CONTROL = 'public, max-age=2'
+# IfMatch で書けなかった（間に別のコンテナが公開したか、オブジェクトが消えた）ときのエラー
+STALE_PUT_ERRORS = ('PreconditionFailed', 'ConditionalRequestConflict', 'NoSuchKey')
+
+deserializer = None
+
+
+def deserialize(image):
+    # boto3 の import は重いので、ストリームのレコードを初めて処理するときまで遅らせる
+    global deserializer
+    if deserializer is None:
+        from boto3.dynamodb.types import TypeDeserializer
+        deserializer = TypeDeserializer()
+    return {k: deserializer.deserialize(v) for k, v in image.items()}
+
+
+def same_standing(a, b):
+    # 順位表の行が変わらない更新（rank_key だけの書き込みなど）は差分に含めない
+    return (a is not None and a.solved_mask == b.solved_mask and a.solve_times == b.solve_times
+            and a.wrong_attempts == b.wrong_attempts)
+
+
+class LeaderboardPublisher:
+    def __init__(self, s3_client, bucket_name, standings_table=None, key=LEADERBOARD_KEY):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.standings_table = standings_table
+        self.key = key
+        # ウォームなコンテナでは順位表を保持し、変更のあったユーザーだけを差し込み直す
+        self.board = None
+        self.epoch = None
+        # 最後に公開したオブジェクトの ETag。別のコンテナが後から公開していたら手元の表は古い
+        self.etag = None
+
+    def load(self, epoch, rules):
+        # 集計テーブルから現在のエポックの順位表を作り直す
+        board = RankedBoard(rules)
+        for item in query_epoch(self.standings_table, epoch):
+            board.upsert(UserState.from_item(item))
+        self.board = board
+        self.epoch = epoch
+        self.etag = None
+
+    def apply_records(self, records, current_epoch, rules):
+        # 行が変わったかもしれないユーザー名の集合を返す。全員の順位が変わりうる場合は None
+        # リセット後や、問題カタログ・採点ルールが変わった後は作り直す
+        if self.board is not None and (self.epoch != current_epoch or self.board.rules is not rules):
+            self.load(current_epoch, rules)
+            return None
+        reloaded = self.board is None
+        if reloaded:
+            # コンテナが入れ替わっただけなら、ブラウザの表はこのバッチの手前まで追いついている
+            self.load(current_epoch, rules)
+        changed = set()
+        for record in records:
+            change = record['dynamodb']
+            keys = deserialize(change['Keys'])
+            # 古いエポックのレコード（バックグラウンド削除のREMOVEなど）は無視する
+            if int(keys['epoch']) != current_epoch:
+                continue
+            username = keys['username']
+            if record['eventName'] == 'REMOVE':
+                changed.add(username)
+                if not reloaded:
+                    self.board.remove(username)
+                continue
+            state = UserState.from_item(deserialize(change['NewImage']))
+            if reloaded:
+                changed.add(username)
+            elif not same_standing(self.board.get(username), state):
+                changed.add(username)
+                self.board.upsert(state)
+        return changed
+
+    def delta(self, changed):
+        # 変わったユーザーの新しい行（順位つき）と、いなくなったユーザー
+        # ブラウザは残りのユーザーの並びを保ったまま差し込み、total 人にならなければ全体を取り直す
+        if changed is None:
+            return leaderboard_refresh(self.epoch)
+        rows = []
+        removed = []
+        for username in changed:
+            state = self.board.get(username)
+            if state is None:
+                removed.append(username)
+            else:
+                rows.append(to_entry(state, self.board.rules, self.board.rank_of(username)))
+        rows.sort(key=lambda row: row['rank'])
+        return {'type': 'leaderboard', 'epoch': self.epoch, 'rows': rows, 'removed': sorted(removed),
+                'total': len(self.board)}
+
+    def reset(self, epoch):
+        self.board = None
+        self.epoch = epoch
+        return self.put([])
+
+    def publish(self):
+        # 手元の表を前回公開したものに上書きできた場合は True
+        # 間に別のコンテナが公開していたら、集計テーブルから作り直して公開し False を返す
+        try:
+            self.put(build_rows(self.board.states(), self.board.rules), if_match=self.etag)
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] not in STALE_PUT_ERRORS:
+                raise
+        metrics.put('stale_board_reloads', 1, 'Count')
+        self.load(self.epoch, self.board.rules)
+        self.put(build_rows(self.board.states(), self.board.rules))
+        return False
+
+    def put(self, rows, if_match=None):
+        body = json.dumps(rows, default=decimal_default, ensure_ascii=False)
+        response = self.s3_client.put_object(
+            Bucket=self.bucket_name,
+            Key=self.key,
+            Body=body.encode('utf-8'),
+            ContentType='application/json',
+            CacheControl=CACHE_CONTROL,
+            Metadata={'epoch': str(self.epoch)},
+            **({'IfMatch': if_match} if if_match else {})
+        )
+        self.etag = response.get('ETag')
+        return body
+
+
+publisher = None
+
+
+@metrics.instrument('leaderboard_publisher')
+def handler(event, context):
+    global publisher
+    if publisher is None:
+        standings_table = aws_clients.table(os.environ['STANDINGS_TABLE'])
+        publisher = LeaderboardPublisher(aws_clients.client('s3'), os.environ['WEBSITE_BUCKET'], standings_table)
+    contest_config = get_contest_config()
+    try:
+        with metrics.timer('apply_records'):
+            changed = publisher.apply_records(event['Records'], contest_config.current_epoch(),
+                                              contest_config.scoring_rules())
+        with metrics.timer('publish'):
+            if not publisher.publish():
+                changed = None
+        metrics.put('records', len(event['Records']), 'Count')
+    except Exception:
+        # 途中で失敗した場合は、次回集計テーブルから作り直す
+        publisher.board = None
+        raise
+    # 静的JSONを書いた後に送る（差分を受けて取り直したブラウザが古い表を読まないように）
+    if changed is None or changed:
+        notify(publisher.delta(changed))
+    return {'published': len(publisher.board)}
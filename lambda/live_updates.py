@@ -0,0 +1,165 @@
+# WebSocket で接続中のブラウザに、リーダーボードとゲーム状態の変更を小さな差分として送る
+# 接続は ConnectionsTable に置き（$connect で追加、$disconnect と送信時の GoneException で削除）、
+# 1つの変更をスキャンした1ページ分の接続へまとめて並列に post_to_connection する
+# ブラウザのポーリングは接続が切れているときのフォールバックとして残る
+# table / client が None の場合はメモリ上で管理する（ローカル実行用。送ったメッセージは sent に残る）
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+import aws_clients
+import metrics
+
+# API Gateway の WebSocket 接続は最大2時間で切れるので、$disconnect が届かなかった接続もTTLで消える
+CONNECTION_TTL_SECONDS = 2 * 60 * 60 + 10 * 60
+# post_to_connection のメッセージの上限（128KB）より小さく抑え、超える差分は取り直しの指示に置き換える
+MAX_MESSAGE_BYTES = 96 * 1024
+FANOUT_CONCURRENCY = int(os.environ.get('FANOUT_CONCURRENCY', '16'))
+SCAN_PAGE_SIZE = 500
+
+
+def encode(message):
+    return json.dumps(message, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def leaderboard_refresh(epoch):
+    # 差分では表せない変更（リセット、採点ルールの変更など）。受け取ったブラウザは全体を取り直す
+    return {'type': 'leaderboard', 'epoch': epoch, 'refresh': True}
+
+
+def game_state_message(is_active):
+    return {'type': 'game_state', 'is_active': is_active}
+
+
+class ConnectionStore:
+    def __init__(self, table=None):
+        self.table = table
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def add(self, connection_id):
+        now = int(time.time())
+        if self.table is None:
+            with self._lock:
+                self._connections[connection_id] = now
+            return
+        self.table.put_item(Item={
+            'connection_id': connection_id,
+            'connected_at': now,
+            'expires_at': now + CONNECTION_TTL_SECONDS
+        })
+
+    def remove(self, connection_id):
+        if self.table is None:
+            with self._lock:
+                self._connections.pop(connection_id, None)
+            return
+        self.table.delete_item(Key={'connection_id': connection_id})
+
+    def pages(self):
+        # 接続IDを SCAN_PAGE_SIZE 件ずつ返す
+        if self.table is None:
+            with self._lock:
+                ids = sorted(self._connections)
+            for start in range(0, len(ids), SCAN_PAGE_SIZE):
+                yield ids[start:start + SCAN_PAGE_SIZE]
+            return
+        scan_kwargs = {'ProjectionExpression': 'connection_id', 'Limit': SCAN_PAGE_SIZE}
+        while True:
+            response = self.table.scan(**scan_kwargs)
+            ids = [item['connection_id'] for item in response.get('Items', [])]
+            if ids:
+                yield ids
+            if 'LastEvaluatedKey' not in response:
+                return
+            scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+class ConnectionManager:
+    # apigatewaymanagementapi の post_to_connection を包む。client が None ならメモリ上のスタブ
+    def __init__(self, client=None):
+        self.client = client
+        self.sent = {}
+        self.gone = set()
+        self._lock = threading.Lock()
+
+    def post(self, connection_id, data):
+        # 届けられたら True、接続が既に無ければ False
+        if self.client is None:
+            with self._lock:
+                if connection_id in self.gone:
+                    return False
+                self.sent.setdefault(connection_id, []).append(json.loads(data))
+            return True
+        try:
+            self.client.post_to_connection(ConnectionId=connection_id, Data=data)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'GoneException':
+                return False
+            raise
+        return True
+
+
+class Broadcaster:
+    def __init__(self, store, manager, concurrency=FANOUT_CONCURRENCY):
+        self.store = store
+        self.manager = manager
+        self.concurrency = concurrency
+        self._executor = None
+
+    def _post(self, connection_id, data):
+        try:
+            return 'sent' if self.manager.post(connection_id, data) else 'gone'
+        except Exception as e:
+            # 1つの接続への送信の失敗で他の接続への送信を止めない（ブラウザはポーリングで追いつく）
+            print(f'Failed to post to {connection_id}: {e}')
+            return 'failed'
+
+    def broadcast(self, message):
+        data = encode(message)
+        if len(data) > MAX_MESSAGE_BYTES and message.get('type') == 'leaderboard':
+            data = encode(leaderboard_refresh(message.get('epoch')))
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        counts = {'sent': 0, 'gone': 0, 'failed': 0}
+        for ids in self.store.pages():
+            results = list(self._executor.map(lambda connection_id: self._post(connection_id, data), ids))
+            for connection_id, result in zip(ids, results):
+                counts[result] += 1
+                # 切断済みの接続は次の変更から送らない
+                if result == 'gone':
+                    self.store.remove(connection_id)
+        metrics.put('fanout_sent', counts['sent'], 'Count')
+        metrics.put('fanout_gone', counts['gone'], 'Count')
+        if counts['failed']:
+            metrics.put('fanout_failed', counts['failed'], 'Count')
+        return counts
+
+
+broadcaster = None
+
+
+def get_broadcaster():
+    # WebSocket API が無い環境（ローカル実行など）ではメモリ上の接続とスタブに送る
+    global broadcaster
+    if broadcaster is None:
+        table_name = os.environ.get('CONNECTIONS_TABLE')
+        endpoint = os.environ.get('WEBSOCKET_ENDPOINT')
+        broadcaster = Broadcaster(
+            ConnectionStore(aws_clients.table(table_name) if table_name else None),
+            ConnectionManager(aws_clients.client('apigatewaymanagementapi', endpoint_url=endpoint)
+                              if endpoint else None)
+        )
+    return broadcaster
+
+
+def notify(message):
+    # 変更の通知はベストエフォート（失敗しても呼び出し元の処理は成功させる）
+    try:
+        with metrics.timer('fanout'):
+            return get_broadcaster().broadcast(message)
+    except Exception as e:
+        print(f'Failed to broadcast {message.get("type")}: {e}')
+        return None
@@ -0,0 +1,182 @@
+# 採点のホットパスのフェーズ別所要時間を CloudWatch Embedded Metric Format (EMF) のログとして出力する
+# Lambda では標準出力に1行のJSONを書くだけで CloudWatch Logs がメトリクスとして取り込む
+# ローカル実行やベンチマークでは set_sink で出力先を差し替える
+import contextvars
+import functools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'ProgrammingContest')
+# 計測する呼び出しの割合 (0〜1)。コールドスタートの呼び出しは常に計測する
+SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', '1'))
+# EMF では1つのメトリクスに100個までの値を配列で持たせられる
+MAX_VALUES_PER_METRIC = 100
+
+
+class StdoutSink:
+    def emit(self, document):
+        print(json.dumps(document, ensure_ascii=False), flush=True)
+
+
+class MemorySink:
+    def __init__(self):
+        self.documents = []
+        self._lock = threading.Lock()
+
+    def emit(self, document):
+        with self._lock:
+            self.documents.append(document)
+
+
+class NullSink:
+    def emit(self, document):
+        pass
+
+
+_sink = StdoutSink()
+
+
+def set_sink(sink):
+    global _sink
+    _sink = sink
+
+
+class Metrics:
+    def __init__(self, function_name, cold_start):
+        self.function_name = function_name
+        self.cold_start = cold_start
+        self._values = {}
+        self._units = {}
+        self._properties = {}
+        self._lock = threading.Lock()
+        self.put('cold_start', 1 if cold_start else 0, 'Count')
+
+    def put(self, name, value, unit='Milliseconds'):
+        with self._lock:
+            values = self._values.setdefault(name, [])
+            if len(values) < MAX_VALUES_PER_METRIC:
+                values.append(value)
+            self._units[name] = unit
+
+    def set_property(self, key, value):
+        # ディメンションにしない付帯情報（Logs Insights で検索できる）
+        with self._lock:
+            self._properties[key] = value
+
+    @contextmanager
+    def timer(self, phase):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.put(phase, round((time.perf_counter() - started) * 1000, 3))
+
+    def document(self):
+        with self._lock:
+            return {
+                '_aws': {
+                    'Timestamp': int(time.time() * 1000),
+                    'CloudWatchMetrics': [{
+                        'Namespace': NAMESPACE,
+                        'Dimensions': [['function']],
+                        'Metrics': [{'Name': name, 'Unit': unit} for name, unit in self._units.items()]
+                    }]
+                },
+                'function': self.function_name,
+                **self._properties,
+                **{name: values[0] if len(values) == 1 else list(values) for name, values in self._values.items()}
+            }
+
+    def flush(self):
+        _sink.emit(self.document())
+
+
+class NullMetrics:
+    # サンプリングで計測しない呼び出し用。何も記録しない
+    cold_start = False
+
+    def put(self, name, value, unit='Milliseconds'):
+        pass
+
+    def set_property(self, key, value):
+        pass
+
+    def timer(self, phase):
+        return nullcontext()
+
+    def flush(self):
+        pass
+
+
+NULL_METRICS = NullMetrics()
+_current = contextvars.ContextVar('metrics', default=NULL_METRICS)
+_cold_start = True
+_cold_start_lock = threading.Lock()
+
+
+def _take_cold_start():
+    # コンテナで最初の呼び出しだけ True を返す
+    global _cold_start
+    with _cold_start_lock:
+        cold_start, _cold_start = _cold_start, False
+        return cold_start
+
+
+def current():
+    return _current.get()
+
+
+def timer(phase):
+    return _current.get().timer(phase)
+
+
+def put(name, value, unit='Milliseconds'):
+    _current.get().put(name, value, unit)
+
+
+def set_property(key, value):
+    _current.get().set_property(key, value)
+
+
+def bind(fn):
+    # スレッドプールのワーカーでも呼び出し元と同じ計測に記録されるようにする
+    metrics = _current.get()
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        token = _current.set(metrics)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return run
+
+
+@contextmanager
+def invocation(function_name, sample_rate=None):
+    cold_start = _take_cold_start()
+    rate = SAMPLE_RATE if sample_rate is None else sample_rate
+    sampled = cold_start or (rate > 0 and random.random() < rate)
+    metrics = Metrics(function_name, cold_start) if sampled else NULL_METRICS
+    token = _current.set(metrics)
+    try:
+        with metrics.timer('total'):
+            yield metrics
+    finally:
+        _current.reset(token)
+        metrics.flush()
+
+
+def instrument(function_name):
+    # Lambda ハンドラ1回の呼び出しを1つの EMF レコードにまとめるデコレータ
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            with invocation(function_name):
+                return handler(event, context)
+        return wrapper
+    return decorator
@@ -0,0 +1,335 @@
+# コンテスト中にテストケースを直した問題を、保存済みの提出コードで採点し直して集計をまとめて更新する
+# POST /rejudge でジョブを登録し（同じテストセットで失敗したジョブがあれば続きから再開）、採点は rejudge_worker が行う
+# GET /rejudge?problem_number=N で現在のテストセットに対するジョブの進捗を返す
+# 同じ内容のコードは1回だけ採点する。判定はジョブレコードに随時書き出し、Lambdaの残り時間が少なくなったら続きを積み直す
+import json
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from botocore.exceptions import ClientError
+from judge_jobs import RejudgeJobStore, get_job_queue, STATUS_DONE
+from admission import AdmissionRejected
+from scoring import problem_index, RULE_ICPC
+from standings import format_datetime
+from submit import (
+    LEADERBOARD_TABLE, STANDINGS_TABLE, PENALIZED_VERDICTS, STORE_REJECTED_SOLUTIONS,
+    contest_config, dynamodb, dynamodb_client, solution_store,
+    judge_problem, ensure_standing, refresh_rank_key, solved_key, submission_item, typed, json_response
+)
+import metrics
+import aws_clients
+
+rejudge_jobs = RejudgeJobStore(aws_clients.table(os.environ['JUDGE_JOBS_TABLE']) if os.environ.get('JUDGE_JOBS_TABLE') else None)
+rejudge_queue = get_job_queue(lambda message: process_job(message), 'REJUDGE_QUEUE_URL', max_workers=1)
+
+# 同時に採点するコードの数。コンテスト中の提出と同じ全体の採点枠（MAX_IN_FLIGHT_JUDGES）も使う
+REJUDGE_CONCURRENCY = int(os.environ.get('REJUDGE_CONCURRENCY', '4'))
+REJUDGE_SLOT_WAIT_SECONDS = float(os.environ.get('REJUDGE_SLOT_WAIT_SECONDS', '30'))
+# この件数か秒数ごとに判定をジョブレコードに書き出す
+CHECKPOINT_EVERY = int(os.environ.get('REJUDGE_CHECKPOINT_EVERY', '20'))
+CHECKPOINT_INTERVAL_SECONDS = 10
+# 残り時間がこれを切ったら新しい採点を始めずに続きを積み直す（1件の採点にかかる最大時間より長くする）
+TIME_MARGIN_MS = int(os.environ.get('REJUDGE_TIME_MARGIN_MS', '90000'))
+# 採点基盤のエラーなどで判定できないコードが残ったまま、何回までやり直すか
+MAX_RETRIES = 3
+# ジョブレコードの判定はコードのハッシュの先頭をキーにする（400KBの項目サイズ上限に収めるため）
+VERDICT_KEY_CHARS = 16
+STANDINGS_BATCH_SIZE = 100
+
+
+def verdict_key(digest):
+    return digest[:VERDICT_KEY_CHARS]
+
+
+def judge_code(problem_number, digest):
+    # 判定できなかったら None（次の回でやり直す）
+    try:
+        verdict = judge_problem(problem_number, solution_store.get_code(digest), REJUDGE_SLOT_WAIT_SECONDS)
+    except AdmissionRejected:
+        return None
+    if verdict['verdict'] == 'IE':
+        return None
+    return verdict['verdict']
+
+
+def report(job_id, verdicts, unsaved, total):
+    rejudge_jobs.checkpoint(job_id, unsaved, judged=len(verdicts))
+    print(json.dumps({'job_id': job_id, 'judged': len(verdicts), 'total': total}))
+    unsaved.clear()
+
+
+def judge_pending(job_id, problem_number, pending, verdicts, total, out_of_time):
+    # 未判定のコードを同時に REJUDGE_CONCURRENCY 件まで採点する。(判定できなかった数, 時間切れか) を返す
+    remaining = list(reversed(pending))
+    in_flight = {}
+    unsaved = {}
+    failed = 0
+    saved_at = time.monotonic()
+    task = metrics.bind(judge_code)
+    with ThreadPoolExecutor(max_workers=REJUDGE_CONCURRENCY) as executor:
+        while True:
+            while remaining and len(in_flight) < REJUDGE_CONCURRENCY and not out_of_time():
+                digest = remaining.pop()
+                in_flight[executor.submit(task, problem_number, digest)] = digest
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                digest = in_flight.pop(future)
+                verdict = future.result()
+                if verdict is None:
+                    failed += 1
+                    continue
+                verdicts[verdict_key(digest)] = verdict
+                unsaved[verdict_key(digest)] = verdict
+            if len(unsaved) >= CHECKPOINT_EVERY or time.monotonic() - saved_at >= CHECKPOINT_INTERVAL_SECONDS:
+                report(job_id, verdicts, unsaved, total)
+                saved_at = time.monotonic()
+    report(job_id, verdicts, unsaved, total)
+    return failed + len(remaining), bool(remaining)
+
+
+def outcomes(attempts, verdicts, recount_wrong):
+    # ユーザーごとに、新しい判定での最初の正解の提出時刻（なければ None）と、それより前の誤答数を求める
+    by_user = defaultdict(list)
+    for attempt in attempts:
+        by_user[attempt['username']].append(attempt)
+    results = {}
+    for username, user_attempts in by_user.items():
+        solved_at = None
+        wrong = 0
+        for attempt in sorted(user_attempts, key=lambda a: int(a['submitted_at_ms'])):
+            verdict = verdicts[verdict_key(attempt['code_hash'])]
+            if verdict == 'AC':
+                solved_at = int(attempt['submitted_at_ms'])
+                break
+            if verdict in PENALIZED_VERDICTS:
+                wrong += 1
+        results[username] = (solved_at, wrong if recount_wrong else None)
+    return results
+
+
+def fetch_standings(epoch, usernames):
+    standings = {}
+    for start in range(0, len(usernames), STANDINGS_BATCH_SIZE):
+        request = {STANDINGS_TABLE: {
+            'Keys': [{'epoch': epoch, 'username': u} for u in usernames[start:start + STANDINGS_BATCH_SIZE]],
+            'ConsistentRead': True
+        }}
+        while request:
+            response = dynamodb.batch_get_item(RequestItems=request)
+            for item in response['Responses'].get(STANDINGS_TABLE, []):
+                standings[item['username']] = item
+            request = response.get('UnprocessedKeys') or {}
+    return standings
+
+
+def change_items(epoch, username, problem_number, standing, solved_at, wrong):
+    # 集計レコードと提出レコードを新しい判定に合わせる書き込みを返す。変わらなければ None
+    # 条件式で読んだ時点の正解状態を確認し、その間に通常の提出で記録が変わっていたら書き込まない
+    index = problem_index(problem_number)
+    standing = standing or {}
+    was_solved = problem_number in standing.get('solved_problems', set())
+    old_at = int(standing['solve_times'][index]) if was_solved else None
+    old_wrong = standing.get('wrong_attempts', [])
+    old_wrong = int(old_wrong[index]) if index < len(old_wrong) else 0
+    if wrong is None:
+        wrong = old_wrong
+    if solved_at == old_at and wrong == old_wrong:
+        return None
+
+    submission_id = solved_key(epoch, username, problem_number)
+    # standing_revision は RankIndex のソートキーを書き直すときの競合検出用
+    values = {':p': problem_number, ':w': wrong, ':revision': 1}
+    set_actions = [f'wrong_attempts[{index}] = :w']
+    leaderboard = None
+    if solved_at is not None and not was_solved:
+        kind = 'gained'
+        leaderboard = {'Put': {
+            'TableName': LEADERBOARD_TABLE,
+            'Item': typed(submission_item(epoch, username, problem_number, format_datetime(solved_at), solved_at)),
+            'ConditionExpression': 'attribute_not_exists(submission_id)'
+        }}
+        set_actions.append(f'solve_times[{index}] = :t')
+        update_expression = 'SET ' + ', '.join(set_actions) + ' ADD solved_mask :bit, solved_problems :problems, solved_count :one, standing_revision :revision'
+        condition = 'attribute_not_exists(solved_problems) OR NOT contains(solved_problems, :p)'
+        values.update({':t': solved_at, ':bit': 1 << index, ':problems': {problem_number}, ':one': 1})
+    elif solved_at is None and was_solved:
+        kind = 'lost'
+        leaderboard = {'Delete': {
+            'TableName': LEADERBOARD_TABLE,
+            'Key': typed({'submission_id': submission_id}),
+            'ConditionExpression': 'attribute_exists(submission_id)'
+        }}
+        set_actions.append(f'solve_times[{index}] = :zero')
+        update_expression = 'SET ' + ', '.join(set_actions) + ' ADD solved_mask :bit, solved_count :one, standing_revision :revision DELETE solved_problems :problems'
+        condition = 'contains(solved_problems, :p)'
+        values.update({':zero': 0, ':bit': -(1 << index), ':problems': {problem_number}, ':one': -1})
+    elif solved_at is not None:
+        kind = 'retimed' if solved_at != old_at else 'wrong_attempts'
+        if solved_at != old_at:
+            leaderboard = {'Put': {
+                'TableName': LEADERBOARD_TABLE,
+                'Item': typed(submission_item(epoch, username, problem_number, format_datetime(solved_at), solved_at)),
+                'ConditionExpression': 'attribute_exists(submission_id)'
+            }}
+            set_actions.append(f'solve_times[{index}] = :t')
+            values[':t'] = solved_at
+        update_expression = 'SET ' + ', '.join(set_actions) + ' ADD standing_revision :revision'
+        condition = 'contains(solved_problems, :p)'
+    else:
+        kind = 'wrong_attempts'
+        update_expression = 'SET ' + ', '.join(set_actions) + ' ADD standing_revision :revision'
+        condition = 'attribute_not_exists(solved_problems) OR NOT contains(solved_problems, :p)'
+
+    transact_items = [leaderboard] if leaderboard else []
+    transact_items.append({'Update': {
+        'TableName': STANDINGS_TABLE,
+        'Key': typed({'epoch': epoch, 'username': username}),
+        'UpdateExpression': update_expression,
+        'ConditionExpression': condition,
+        'ExpressionAttributeValues': typed(values)
+    }})
+    return kind, transact_items
+
+
+def apply_change(epoch, username, problem_number, standing, solved_at, wrong):
+    change = change_items(epoch, username, problem_number, standing, solved_at, wrong)
+    if change is None:
+        return None
+    kind, transact_items = change
+    ensure_standing(epoch, username, problem_number)
+    try:
+        dynamodb_client.transact_write_items(TransactItems=transact_items)
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'TransactionCanceledException':
+            raise
+        return 'conflicts'
+    refresh_rank_key(epoch, username)
+    return kind
+
+
+def apply_standings(epoch, problem_number, attempts, verdicts):
+    # ユーザーごとの変更を1回のトランザクションずつ、並行して書き込む
+    # 集計レコードの更新はストリーム経由でまとめて leaderboard.json に反映される
+    recount_wrong = STORE_REJECTED_SOLUTIONS and contest_config.scoring_rules().rule == RULE_ICPC
+    results = outcomes(attempts, verdicts, recount_wrong)
+    standings = fetch_standings(epoch, sorted(results))
+    summary = {'users': len(results), 'gained': 0, 'lost': 0, 'retimed': 0, 'wrong_attempts': 0, 'conflicts': 0}
+    task = metrics.bind(apply_change)
+    with ThreadPoolExecutor(max_workers=REJUDGE_CONCURRENCY) as executor:
+        futures = [executor.submit(task, epoch, username, problem_number, standings.get(username), solved_at, wrong)
+                   for username, (solved_at, wrong) in results.items()]
+        for future in futures:
+            kind = future.result()
+            if kind is not None:
+                summary[kind] += 1
+    return summary
+
+
+def run_job(job_id, out_of_time=lambda: False):
+    # ジョブを1回分進める。続きが残っていれば False を返す
+    job = rejudge_jobs.get(job_id)
+    if job is None or job['status'] == STATUS_DONE:
+        return True
+    epoch = int(job['epoch'])
+    problem_number = int(job['problem_number'])
+    contest_config.invalidate()
+    problem = contest_config.problems().get(problem_number)
+    if epoch != contest_config.current_epoch() or problem is None \
+            or problem['test_set_version'] != job['test_set_version']:
+        rejudge_jobs.fail(job_id, 'The contest was reset or the test set changed again. Start a new rejudge.')
+        return True
+    rejudge_jobs.mark_running(job_id)
+    metrics.set_property('problem_number', problem_number)
+
+    with metrics.timer('rejudge_list'):
+        attempts = solution_store.attempts(epoch, problem_number)
+    verdicts = dict(job['verdicts'])
+    digests = list(dict.fromkeys(attempt['code_hash'] for attempt in attempts))
+    pending = [digest for digest in digests if verdict_key(digest) not in verdicts]
+    rejudge_jobs.checkpoint(job_id, {}, attempts=len(attempts), total=len(digests), judged=len(digests) - len(pending))
+
+    with metrics.timer('rejudge_judge'):
+        unjudged, timed_out = judge_pending(job_id, problem_number, pending, verdicts, len(digests), out_of_time)
+    if unjudged:
+        retries = int(job.get('retries', 0)) + (0 if timed_out else 1)
+        if retries > MAX_RETRIES:
+            rejudge_jobs.fail(job_id, f'{unjudged} solutions could not be judged.')
+            return True
+        rejudge_jobs.checkpoint(job_id, {}, retries=retries)
+        rejudge_jobs.mark_queued(job_id)
+        return False
+
+    with metrics.timer('rejudge_apply'):
+        summary = apply_standings(epoch, problem_number, attempts, verdicts)
+    summary.update({'attempts': len(attempts), 'judged': len(digests)})
+    rejudge_jobs.complete(job_id, 200, summary)
+    print(json.dumps({'job_id': job_id, **summary}))
+    return True
+
+
+def process_job(message, context=None):
+    # キューから取り出したジョブを進め、終わらなければ続きを積み直す
+    if context is not None:
+        out_of_time = lambda: context.get_remaining_time_in_millis() < TIME_MARGIN_MS
+    else:
+        out_of_time = lambda: False
+    try:
+        finished = run_job(message['job_id'], out_of_time)
+    except Exception as e:
+        rejudge_jobs.fail(message['job_id'], str(e))
+        raise
+    if not finished:
+        rejudge_queue.enqueue(message)
+    return finished
+
+
+def progress(job):
+    body = {
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'problem_number': int(job['problem_number']),
+        'test_set_version': job['test_set_version'],
+        'judged': int(job.get('judged', 0)),
+        'total': int(job.get('total', 0))
+    }
+    if 'result' in job:
+        body['result'] = {k: int(v) for k, v in job['result'].items()}
+    if 'error' in job:
+        body['error'] = job['error']
+    return body
+
+
+@metrics.instrument('rejudge')
+def handler(event, context):
+    try:
+        if event.get('httpMethod') == 'GET':
+            problem_number = int((event.get('queryStringParameters') or {}).get('problem_number', 0))
+        else:
+            problem_number = int(json.loads(event['body'])['problem_number'])
+        # 直したばかりの problems.json を読むため、スナップショットを読み直す
+        contest_config.invalidate()
+        problems = contest_config.problems()
+        if problem_number not in problems:
+            return json_response(400, {'error': f'Problem {problem_number} does not exist.'})
+        epoch = contest_config.current_epoch()
+        test_set_version = problems[problem_number]['test_set_version']
+
+        if event.get('httpMethod') == 'GET':
+            job = rejudge_jobs.get(RejudgeJobStore.job_id(epoch, problem_number, test_set_version))
+            if job is None:
+                return json_response(404, {'error': f'No rejudge for the current test set of problem {problem_number}.'})
+            return json_response(200, progress(job))
+
+        job, enqueue = rejudge_jobs.start(epoch, problem_number, test_set_version)
+        if enqueue:
+            rejudge_queue.enqueue({'job_id': job['job_id']})
+        return json_response(200 if job['status'] == STATUS_DONE else 202, progress(job))
+
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'error': str(e)})
+        }
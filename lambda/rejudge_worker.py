@@ -0,0 +1,15 @@
+import json
+from rejudge import process_job
+import metrics
+
+@metrics.instrument('rejudge_worker')
+def handler(event, context):
+    # SQSから受け取った再採点ジョブを進める。残り時間が少なくなったら続きはキューに積み直される
+    failures = []
+    for record in event['Records']:
+        try:
+            process_job(json.loads(record['body']), context)
+        except Exception as e:
+            print(f"Error: {str(e)}")
+            failures.append({'itemIdentifier': record['messageId']})
+    return {'batchItemFailures': failures}
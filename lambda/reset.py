@@ -1,18 +1,43 @@
 import json
-import boto3
+import aws_clients
 import os
+from contest_config import get_contest_config, bump_epoch
+from leaderboard_publisher import LeaderboardPublisher
+from live_updates import leaderboard_refresh, notify
+import metrics
 
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table(os.environ['LEADERBOARD_TABLE'])
+lambda_client = aws_clients.client('lambda')
+game_state_table = aws_clients.table(os.environ['GAME_STATE_TABLE'])
+contest_config = get_contest_config()
+publisher = LeaderboardPublisher(aws_clients.client('s3'), os.environ['WEBSITE_BUCKET'])
 
+@metrics.instrument('reset')
 def handler(event, context):
     try:
-        # テーブルの全アイテムを削除
-        response = table.scan()
+        # テーブルを走査して削除する代わりにエポックを進める（テーブルの大きさによらず一定時間で終わる）
+        with metrics.timer('bump_epoch'):
+            epoch = bump_epoch(game_state_table)
+        contest_config.invalidate()
         
-        with table.batch_writer() as batch:
-            for item in response['Items']:
-                batch.delete_item(Key={'submission_id': item['submission_id']})
+        # 公開中のリーダーボードを空にする
+        with metrics.timer('publish_reset'):
+            publisher.reset(epoch)
+        # 接続中のブラウザには空になった表を取り直させる
+        notify(leaderboard_refresh(epoch))
+        
+        # 古いエポックのデータはバックグラウンドで削除する
+        # リセット自体は済んでいるので、起動に失敗しても成功として返す（残ったデータは次のリセットの削除で消える）
+        try:
+            lambda_client.invoke(
+                FunctionName=os.environ['EPOCH_GC_FUNCTION'],
+                InvocationType='Event',
+                Payload=json.dumps({'epoch': epoch})
+            )
+            gc_scheduled = True
+        except Exception as e:
+            print(f"Failed to schedule epoch GC: {str(e)}")
+            metrics.set_property('epoch_gc_error', str(e))
+            gc_scheduled = False
         
         return {
             'statusCode': 200,
@@ -20,7 +45,8 @@ def handler(event, context):
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             },
-            'body': json.dumps({'message': 'Leaderboard reset successfully'})
+            'body': json.dumps({'message': 'Leaderboard reset successfully', 'epoch': epoch,
+                                'gc_scheduled': gc_scheduled})
         }
         
     except Exception as e:
@@ -0,0 +1,176 @@
+# 問題カタログに基づく採点・順位付けエンジン
+# ユーザーごとの状態は「解いた問題のビットマスク」と「問題ごとの正解時刻(エポックミリ秒, 0は未正解)の配列」で持つ
+# 問題 n は配列の n-1 番目、ビットマスクの n-1 ビット目に対応する
+import bisect
+import os
+
+RULE_COUNT = 'count'
+RULE_ICPC = 'icpc'
+RULE_POINTS = 'points'
+
+SCORING_RULE = os.environ.get('SCORING_RULE', RULE_COUNT)
+ICPC_PENALTY_MINUTES = int(os.environ.get('ICPC_PENALTY_MINUTES', '20'))
+
+
+def problem_index(problem_number):
+    return int(problem_number) - 1
+
+
+def popcount(mask):
+    return bin(mask).count('1')
+
+
+class UserState:
+    __slots__ = ('username', 'solved_mask', 'solve_times', 'wrong_attempts')
+
+    def __init__(self, username, solved_mask=0, solve_times=None, wrong_attempts=None):
+        self.username = username
+        self.solved_mask = int(solved_mask)
+        self.solve_times = [int(t) for t in (solve_times or [])]
+        self.wrong_attempts = [int(w) for w in (wrong_attempts or [])]
+
+    @classmethod
+    def from_item(cls, item):
+        return cls(item['username'], item.get('solved_mask', 0), item.get('solve_times'), item.get('wrong_attempts'))
+
+    def is_solved(self, problem_number):
+        return bool(self.solved_mask >> problem_index(problem_number) & 1)
+
+    def solve_time(self, problem_number):
+        index = problem_index(problem_number)
+        if not self.is_solved(problem_number) or index >= len(self.solve_times):
+            return None
+        return self.solve_times[index]
+
+    def solve(self, problem_number, solved_at_ms):
+        index = problem_index(problem_number)
+        if self.is_solved(problem_number):
+            return False
+        if index >= len(self.solve_times):
+            self.solve_times.extend([0] * (index + 1 - len(self.solve_times)))
+        self.solved_mask |= 1 << index
+        self.solve_times[index] = int(solved_at_ms)
+        return True
+
+    def add_wrong_attempt(self, problem_number):
+        index = problem_index(problem_number)
+        if self.is_solved(problem_number):
+            return False
+        if index >= len(self.wrong_attempts):
+            self.wrong_attempts.extend([0] * (index + 1 - len(self.wrong_attempts)))
+        self.wrong_attempts[index] += 1
+        return True
+
+
+# 順位キーの数値は、負の数も文字列の比較で正しく並ぶようオフセットを足した固定長の10進数にする
+RANK_KEY_OFFSET = 10 ** 15
+RANK_KEY_DIGITS = 16
+
+
+def encode_rank_component(value):
+    if value == float('inf'):
+        return '9' * RANK_KEY_DIGITS
+    return f'{int(value) + RANK_KEY_OFFSET:0{RANK_KEY_DIGITS}d}'
+
+
+class ScoringRules:
+    def __init__(self, problem_numbers, rule=RULE_COUNT, points=None,
+                 penalty_minutes=ICPC_PENALTY_MINUTES, started_at_ms=0):
+        if rule not in (RULE_COUNT, RULE_ICPC, RULE_POINTS):
+            raise ValueError(f'Unknown scoring rule: {rule}')
+        self.problem_numbers = sorted(int(n) for n in problem_numbers)
+        self.rule = rule
+        self.points = {int(n): int((points or {}).get(n, 1)) for n in self.problem_numbers}
+        self.penalty_ms = penalty_minutes * 60 * 1000
+        self.started_at_ms = int(started_at_ms)
+        # (問題番号, 配列の位置) の組。全ユーザー分の計算で繰り返し使うので先に求めておく
+        self.indexes = [(n, problem_index(n)) for n in self.problem_numbers]
+        self.catalog_mask = 0
+        for _, index in self.indexes:
+            self.catalog_mask |= 1 << index
+
+    @classmethod
+    def from_catalog(cls, problems, rule=SCORING_RULE, penalty_minutes=ICPC_PENALTY_MINUTES, started_at_ms=0):
+        points = {n: problem.get('points', 1) for n, problem in problems.items()}
+        return cls(problems.keys(), rule, points, penalty_minutes, started_at_ms)
+
+    def score(self, state):
+        # カタログにない問題のビットは無視する
+        mask = state.solved_mask & self.catalog_mask
+        solved_count = 0
+        points = 0
+        penalty_ms = 0
+        last_solve_ms = 0
+        wrong_attempts = state.wrong_attempts
+        for n, index in self.indexes:
+            if not mask >> index & 1:
+                continue
+            solved_at = state.solve_times[index]
+            solved_count += 1
+            points += self.points[n]
+            if solved_at > last_solve_ms:
+                last_solve_ms = solved_at
+            wrong = wrong_attempts[index] if index < len(wrong_attempts) else 0
+            penalty_ms += max(solved_at - self.started_at_ms, 0) + wrong * self.penalty_ms
+        return {
+            'solved_count': solved_count,
+            'points': points,
+            'penalty_ms': penalty_ms,
+            'last_solve_ms': last_solve_ms
+        }
+
+    def sort_key(self, state):
+        score = self.score(state)
+        # 未正解のユーザーは最終正解時刻を無限大として扱う
+        last = score['last_solve_ms'] or float('inf')
+        if self.rule == RULE_ICPC:
+            return (-score['solved_count'], score['penalty_ms'], last, state.username)
+        if self.rule == RULE_POINTS:
+            return (-score['points'], last, state.username)
+        return (-score['solved_count'], last, state.username)
+
+    def rank_key(self, state):
+        # sort_key と同じ順に並ぶ文字列（StandingsTable の RankIndex のソートキー）
+        key = self.sort_key(state)
+        return '#'.join([encode_rank_component(value) for value in key[:-1]] + [key[-1]])
+
+
+class RankedBoard:
+    # ソート済みのキー列を保持し、1人の更新は二分探索で削除・挿入する（全体を並べ替えない）
+    def __init__(self, rules):
+        self.rules = rules
+        self._keys = []
+        self._states = {}
+        self._key_of = {}
+
+    def __len__(self):
+        return len(self._states)
+
+    def upsert(self, state):
+        self.remove(state.username)
+        key = self.rules.sort_key(state)
+        bisect.insort(self._keys, key)
+        self._states[state.username] = state
+        self._key_of[state.username] = key
+        return self.rank_of(state.username)
+
+    def remove(self, username):
+        key = self._key_of.pop(username, None)
+        if key is None:
+            return
+        del self._keys[bisect.bisect_left(self._keys, key)]
+        del self._states[username]
+
+    def get(self, username):
+        return self._states.get(username)
+
+    def rank_of(self, username):
+        # 1始まりの順位
+        key = self._key_of.get(username)
+        if key is None:
+            return None
+        return bisect.bisect_left(self._keys, key) + 1
+
+    def states(self):
+        for key in self._keys:
+            yield self._states[key[-1]]
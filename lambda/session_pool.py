@@ -0,0 +1,242 @@
+# ウォームなLambdaコンテナ内で Code Interpreter セッションを使い回すためのプール
+import threading
+import time
+import metrics
+
+SESSION_TIMEOUT_SECONDS = 60
+# 採点1回分(Lambdaのタイムアウト)の余裕を残してセッションを引退させる
+RETIRE_MARGIN_SECONDS = 30
+# 一定時間アイドルだったセッションは貸し出し前にヘルスチェックする
+HEALTH_CHECK_IDLE_SECONDS = 5
+
+HEALTH_MARKER = '__POOL_OK__'
+
+# 初回にサンドボックスの初期状態(ファイル・モジュール・プロセス・カレントディレクトリ)を記録する
+# カーネルを子プロセスの引き取り手(subreaper)にしておき、二重 fork や setsid で抜けたプロセスも子孫として見つけられるようにする
+# 2回目以降は、初期状態にない子孫プロセスが残っていないことを確かめる
+HEALTH_CHECK_CODE = f"""
+import os, sys, tempfile
+def _descendants():
+    _parents = {{}}
+    for _pid in os.listdir('/proc'):
+        if _pid.isdigit():
+            try:
+                with open(f'/proc/{{_pid}}/stat') as _f:
+                    _parents[int(_pid)] = int(_f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                pass
+    _found, _frontier = set(), {{os.getpid()}}
+    while _frontier:
+        _frontier = {{_p for _p, _pp in _parents.items() if _pp in _frontier}} - _found
+        _found |= _frontier
+    return _found
+sys._judge_descendants = _descendants
+if not hasattr(sys, '_judge_baseline'):
+    try:
+        import ctypes
+        _reaper = ctypes.CDLL(None, use_errno=True).prctl(36, 1, 0, 0, 0) == 0  # PR_SET_CHILD_SUBREAPER
+    except (OSError, AttributeError):
+        _reaper = False
+    _scratch = {{os.getcwd(), tempfile.gettempdir()}}
+    sys._judge_baseline = {{
+        'cwd': os.getcwd(),
+        'scratch': {{_d: set(os.listdir(_d)) for _d in _scratch if os.access(_d, os.W_OK)}},
+        'modules': set(sys.modules),
+        'pids': _descendants() if _reaper else None,
+    }}
+if sys._judge_baseline['pids'] is None or not _descendants() - sys._judge_baseline['pids']:
+    print('{HEALTH_MARKER}')
+"""
+
+# 前の提出者が残したプロセス・ファイル・import したモジュール・グローバル変数を初期状態に戻す
+# 提出コードは judge_harness が子プロセスのグループごと止めるが、setsid で抜けたプロセスはここで止める
+# 子孫を追えない環境(subreaper になれない)では初期状態に戻せないので、セッションを使い回さない
+RESET_CODE = f"""
+import os, sys, shutil, time
+_baseline = sys._judge_baseline
+if _baseline['pids'] is None:
+    raise RuntimeError('stray processes cannot be tracked in this sandbox')
+for _ in range(50):
+    _stray = sys._judge_descendants() - _baseline['pids']
+    if not _stray:
+        break
+    for _pid in _stray:
+        try:
+            os.kill(_pid, 9)
+            os.waitpid(_pid, os.WNOHANG)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+    time.sleep(0.01)
+else:
+    raise RuntimeError(f'processes still running: {{sorted(_stray)}}')
+os.chdir(_baseline['cwd'])
+for _directory, _files in _baseline['scratch'].items():
+    for _name in set(os.listdir(_directory)) - _files:
+        _path = os.path.join(_directory, _name)
+        if os.path.isdir(_path) and not os.path.islink(_path):
+            shutil.rmtree(_path, ignore_errors=True)
+        else:
+            os.remove(_path)
+for _name in set(sys.modules) - _baseline['modules']:
+    sys.modules.pop(_name, None)
+for _name in [n for n in globals() if not n.startswith('__')]:
+    globals().pop(_name, None)
+print('{HEALTH_MARKER}')
+"""
+
+
+class PooledSession:
+    def __init__(self, session_id, started_at):
+        self.session_id = session_id
+        self.started_at = started_at
+        self.last_used_at = started_at
+
+
+class SessionPool:
+    def __init__(self, client, code_interpreter_id, max_idle=2,
+                 session_timeout_seconds=SESSION_TIMEOUT_SECONDS,
+                 retire_margin_seconds=RETIRE_MARGIN_SECONDS):
+        self.client = client
+        self.code_interpreter_id = code_interpreter_id
+        self.max_idle = max_idle
+        self.session_timeout_seconds = session_timeout_seconds
+        self.max_age_seconds = session_timeout_seconds - retire_margin_seconds
+        self._idle = []
+        self._lock = threading.Lock()
+        self._setup_seconds_total = 0.0
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'retired': 0,
+            'health_check_failures': 0,
+            'setup_seconds_saved': 0.0
+        }
+
+    def _is_expired(self, session, now):
+        return now - session.started_at >= self.max_age_seconds
+
+    def _start(self):
+        started = time.monotonic()
+        with metrics.timer('start_session'):
+            response = self.client.start_code_interpreter_session(
+                codeInterpreterIdentifier=self.code_interpreter_id,
+                name='solver-session',
+                sessionTimeoutSeconds=self.session_timeout_seconds
+            )
+        session = PooledSession(response['sessionId'], started)
+        try:
+            with metrics.timer('health_check'):
+                self._run_checked(session, HEALTH_CHECK_CODE)
+        except Exception:
+            # 使えないセッションを残したまま(タイムアウトまで課金されたまま)にしない
+            self._stop(session)
+            raise
+        with self._lock:
+            self._setup_seconds_total += time.monotonic() - started
+        return session
+
+    def _stop(self, session):
+        try:
+            with metrics.timer('stop_session'):
+                self.client.stop_code_interpreter_session(
+                    codeInterpreterIdentifier=self.code_interpreter_id,
+                    sessionId=session.session_id
+                )
+        except Exception as e:
+            print(f"Failed to stop session {session.session_id}: {str(e)}")
+
+    def _run_checked(self, session, code):
+        response = self.client.invoke_code_interpreter(
+            codeInterpreterIdentifier=self.code_interpreter_id,
+            sessionId=session.session_id,
+            name='executeCode',
+            arguments={'language': 'python', 'code': code}
+        )
+        output = ''
+        for event in response['stream']:
+            if 'result' in event and 'content' in event['result']:
+                for content in event['result']['content']:
+                    if content['type'] == 'text':
+                        output += content['text']
+        if HEALTH_MARKER not in output:
+            raise RuntimeError(f'Session {session.session_id} failed health check')
+
+    def _take_idle(self):
+        now = time.monotonic()
+        expired = []
+        session = None
+        with self._lock:
+            while self._idle:
+                candidate = self._idle.pop()
+                if not self._is_expired(candidate, now):
+                    session = candidate
+                    break
+                self.stats['retired'] += 1
+                expired.append(candidate)
+        for candidate in expired:
+            self._stop(candidate)
+        return session
+
+    def acquire(self):
+        while True:
+            session = self._take_idle()
+            if session is None:
+                break
+            if time.monotonic() - session.last_used_at < HEALTH_CHECK_IDLE_SECONDS:
+                break
+            try:
+                with metrics.timer('health_check'):
+                    self._run_checked(session, HEALTH_CHECK_CODE)
+                break
+            except Exception as e:
+                print(f"Discarding pooled session: {str(e)}")
+                with self._lock:
+                    self.stats['health_check_failures'] += 1
+                self._stop(session)
+
+        if session is not None:
+            metrics.put('session_pool_hit', 1, 'Count')
+            with self._lock:
+                self.stats['hits'] += 1
+                misses = max(self.stats['misses'], 1)
+                self.stats['setup_seconds_saved'] = round(self._setup_seconds_total / misses * self.stats['hits'], 3)
+            self._emit_stats()
+            return session
+
+        metrics.put('session_pool_hit', 0, 'Count')
+        with self._lock:
+            self.stats['misses'] += 1
+        session = self._start()
+        self._emit_stats()
+        return session
+
+    def release(self, session, reusable=True):
+        # 採点後に状態をリセットし、次の提出者のためにプールへ戻す
+        now = time.monotonic()
+        with self._lock:
+            has_room = len(self._idle) < self.max_idle
+        if not reusable or not has_room or self._is_expired(session, now):
+            if reusable and has_room:
+                with self._lock:
+                    self.stats['retired'] += 1
+            self._stop(session)
+            return
+        try:
+            with metrics.timer('reset_session'):
+                self._run_checked(session, RESET_CODE)
+                self._run_checked(session, HEALTH_CHECK_CODE)
+        except Exception as e:
+            print(f"Discarding session after failed reset: {str(e)}")
+            with self._lock:
+                self.stats['health_check_failures'] += 1
+            self._stop(session)
+            return
+        session.last_used_at = time.monotonic()
+        with self._lock:
+            self._idle.append(session)
+
+    def _emit_stats(self):
+        # 貸し出しごとにログ行を増やさず、呼び出しの計測レコードに載せる
+        with self._lock:
+            stats = dict(self.stats)
+        metrics.set_property('session_pool', stats)
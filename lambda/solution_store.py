@@ -0,0 +1,111 @@
+# 提出コードを保存して、テストケースを直したときに再採点できるようにする
+# コード本体は内容のハッシュをキーに gzip 圧縮して S3 に1回だけ置き（同じコードの再提出では書かない）、
+# 誰がいつどの問題に提出してどう判定されたかを SolutionsTable に索引として残す
+# s3_client / table が None の場合はメモリ上で管理する（ローカル実行用）
+import gzip
+import hashlib
+import threading
+from botocore.exceptions import ClientError
+
+KEY_PREFIX = 'solutions/'
+# コンテナ内で保存済みと分かっているハッシュの数の上限
+KNOWN_HASHES_LIMIT = 4096
+
+
+def code_hash(code):
+    return hashlib.sha256(code.encode('utf-8')).hexdigest()
+
+
+def object_key(digest):
+    return f'{KEY_PREFIX}{digest}.py.gz'
+
+
+def problem_key(epoch, problem_number):
+    return f'{epoch}#{problem_number}'
+
+
+class SolutionStore:
+    def __init__(self, s3_client=None, bucket_name=None, table=None):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.table = table
+        self._objects = {}
+        self._attempts = {}
+        self._known = set()
+        self._lock = threading.Lock()
+
+    def put_code(self, code):
+        digest = code_hash(code)
+        with self._lock:
+            if digest in self._known:
+                return digest
+        body = gzip.compress(code.encode('utf-8'))
+        if self.s3_client is None:
+            with self._lock:
+                self._objects[digest] = body
+        else:
+            # 既に同じ内容のオブジェクトがあれば書き込まない（条件付き書き込み）
+            try:
+                self.s3_client.put_object(
+                    Bucket=self.bucket_name,
+                    Key=object_key(digest),
+                    Body=body,
+                    ContentType='text/x-python',
+                    ContentEncoding='gzip',
+                    IfNoneMatch='*'
+                )
+            except ClientError as e:
+                if e.response['Error']['Code'] not in ('PreconditionFailed', '412', 'ConditionalRequestConflict'):
+                    raise
+        with self._lock:
+            if len(self._known) >= KNOWN_HASHES_LIMIT:
+                self._known.clear()
+            self._known.add(digest)
+        return digest
+
+    def get_code(self, digest):
+        if self.s3_client is None:
+            with self._lock:
+                body = self._objects[digest]
+        else:
+            body = self.s3_client.get_object(Bucket=self.bucket_name, Key=object_key(digest))['Body'].read()
+        return gzip.decompress(body).decode('utf-8')
+
+    def record(self, epoch, username, problem_number, code, verdict, submitted_at_ms):
+        # 1回の提出を索引に追加する。同じユーザーの提出は提出時刻順に並ぶ
+        digest = self.put_code(code)
+        item = {
+            'problem_key': problem_key(epoch, problem_number),
+            'attempt_key': f'{username}#{submitted_at_ms:013d}#{digest[:12]}',
+            'epoch': epoch,
+            'problem_number': problem_number,
+            'username': username,
+            'code_hash': digest,
+            'verdict': verdict,
+            'submitted_at_ms': submitted_at_ms
+        }
+        if self.table is None:
+            with self._lock:
+                self._attempts.setdefault(item['problem_key'], {})[item['attempt_key']] = item
+        else:
+            self.table.put_item(Item=item)
+        return digest
+
+    def attempts(self, epoch, problem_number):
+        # 問題ごとの保存済みの提出をすべて返す（ユーザー名、提出時刻の順）
+        key = problem_key(epoch, problem_number)
+        if self.table is None:
+            with self._lock:
+                stored = self._attempts.get(key, {})
+                return [dict(stored[k]) for k in sorted(stored)]
+        items = []
+        query_kwargs = {
+            'KeyConditionExpression': 'problem_key = :k',
+            'ExpressionAttributeValues': {':k': key}
+        }
+        while True:
+            response = self.table.query(**query_kwargs)
+            items.extend(response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                return items
+            query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
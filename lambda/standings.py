@@ -0,0 +1,82 @@
+# ユーザー単位の集計レコード(StandingsTable)をリーダーボードの行に変換する共通処理
+# leaderboard.handler と leaderboard_publisher の両方で使う
+from datetime import datetime, timezone, timedelta
+from decimal import Decimal
+from scoring import UserState
+
+JST = timezone(timedelta(hours=9))
+
+def decimal_default(obj):
+    if isinstance(obj, Decimal):
+        return int(obj)
+    raise TypeError
+
+def query_epoch(target_table, epoch):
+    items = []
+    query_kwargs = {
+        'KeyConditionExpression': '#e = :e',
+        'ExpressionAttributeNames': {'#e': 'epoch'},
+        'ExpressionAttributeValues': {':e': epoch}
+    }
+    while True:
+        response = target_table.query(**query_kwargs)
+        items.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return items
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+JST_OFFSET_SECONDS = 9 * 3600
+
+def format_time(epoch_ms):
+    # エポックミリ秒を "HH:MM:SS" (JST) に変換（全ユーザー×全問題分呼ばれるため datetime を介さず整数演算で求める）
+    if epoch_ms is None:
+        return None
+    seconds = (epoch_ms // 1000 + JST_OFFSET_SECONDS) % 86400
+    return f'{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}'
+
+def format_datetime(epoch_ms):
+    if not epoch_ms:
+        return None
+    return datetime.fromtimestamp(epoch_ms / 1000, JST).strftime('%Y-%m-%d %H:%M:%S JST')
+
+def time_columns(rules):
+    return [(f'problem{problem_number}_time', index) for problem_number, index in rules.indexes]
+
+def to_entry(state, rules, rank, columns=None):
+    score = rules.score(state)
+    entry = {'rank': rank, 'username': state.username}
+    mask = state.solved_mask
+    times = state.solve_times
+    for column, index in columns or time_columns(rules):
+        entry[column] = format_time(times[index]) if mask >> index & 1 else None
+    entry.update({
+        'solved_count': score['solved_count'],
+        'points': score['points'],
+        'penalty_seconds': score['penalty_ms'] // 1000,
+        'latest_time': format_datetime(score['last_solve_ms'])
+    })
+    return entry
+
+def build_rows(ordered_states, rules):
+    columns = time_columns(rules)
+    return [to_entry(state, rules, rank, columns) for rank, state in enumerate(ordered_states, start=1)]
+
+def performance_rows(items, problem_number):
+    # 問題ごとの性能順位。正解したユーザーを、CPU時間・ピークメモリ・正解時刻の順に並べる
+    # 性能を測る前に正解したユーザーは含めない
+    entries = []
+    for item in items:
+        state = UserState.from_item(item)
+        performance = (item.get('performance') or {}).get(str(problem_number))
+        if performance is None or not state.is_solved(problem_number):
+            continue
+        entries.append((int(performance['cpu_us']), int(performance['peak_memory_bytes']),
+                        state.solve_time(problem_number), state.username))
+    entries.sort()
+    return [{
+        'rank': rank,
+        'username': username,
+        'cpu_ms': cpu_us / 1000,
+        'peak_memory_kb': round(peak_memory_bytes / 1024, 1),
+        'solved_time': format_time(solved_at)
+    } for rank, (cpu_us, peak_memory_bytes, solved_at, username) in enumerate(entries, start=1)]
@@ -0,0 +1,171 @@
+# サンドボックスを起動する前に、提出コードを Lambda 内で ast により静的に検査する
+# 構文エラー・solver の未定義・引数の数の不一致は実行するまでもなく CE なので、その場で判定を返す
+# 解析結果（AST の指紋と solver の引数情報）はコードごとにキャッシュし、採点結果キャッシュのキーにも使う
+import ast
+import hashlib
+import threading
+from collections import OrderedDict
+
+SOLVER_NAME = 'solver'
+ANALYSIS_CACHE_SIZE = 256
+# これらを使うコードは solver を動的に定義できるので、未定義とは判断しない
+DYNAMIC_NAMES = {'exec', 'eval', 'globals', 'locals', 'vars', 'setattr', '__import__', 'modules'}
+
+
+class Analysis:
+    def __init__(self, fingerprint=None, error=None, defined=True, arity=None):
+        # 空白やコメントだけが違うコードは同じ指紋になる
+        self.fingerprint = fingerprint
+        # 構文エラーなどで解析できなかった理由
+        self.error = error
+        self.defined = defined
+        # solver が受け付ける位置引数の数 (最小, 最大)。最大が None なら上限なし。判断できなければ None
+        self.arity = arity
+
+
+def signature_arity(args):
+    positional = len(args.posonlyargs) + len(args.args)
+    if any(default is None for default in args.kw_defaults):
+        # 既定値のないキーワード専用引数があると、位置引数だけでは呼べない
+        return 0, -1
+    return positional - len(args.defaults), None if args.vararg else positional
+
+
+def top_level_statements(body):
+    # モジュール直下で実行される文（if / try / with の中も含み、関数やクラスの中は含まない）
+    for node in body:
+        yield node
+        if isinstance(node, (ast.If, ast.For, ast.While, ast.With)):
+            yield from top_level_statements(node.body)
+            yield from top_level_statements(getattr(node, 'orelse', []))
+        elif isinstance(node, ast.Try):
+            yield from top_level_statements(node.body)
+            for handler in node.handlers:
+                yield from top_level_statements(handler.body)
+            yield from top_level_statements(node.orelse)
+            yield from top_level_statements(node.finalbody)
+
+
+def solver_bindings(tree):
+    bindings = []
+    for node in top_level_statements(tree.body):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) and node.name == SOLVER_NAME:
+            bindings.append(node)
+        elif isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            if any(isinstance(n, ast.Name) and n.id == SOLVER_NAME for t in targets for n in ast.walk(t)):
+                bindings.append(node)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                if alias.name == '*' or (alias.asname or alias.name.split('.')[0]) == SOLVER_NAME:
+                    bindings.append(node)
+    return bindings
+
+
+def count_binding_sites(tree):
+    # solver という名前を束縛しうる箇所の数（セイウチ演算子・for・with・except・match なども含め、関数の中も数える）
+    count = 0
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id == SOLVER_NAME and isinstance(node.ctx, (ast.Store, ast.Del)):
+            count += 1
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.ExceptHandler)) \
+                and node.name == SOLVER_NAME:
+            count += 1
+        elif isinstance(node, (ast.MatchAs, ast.MatchStar)) and node.name == SOLVER_NAME:
+            count += 1
+        elif isinstance(node, ast.MatchMapping) and node.rest == SOLVER_NAME:
+            count += 1
+        elif isinstance(node, ast.alias) and (node.name == '*' or (node.asname or node.name.split('.')[0]) == SOLVER_NAME):
+            count += 1
+    return count
+
+
+def uses_dynamic_names(tree):
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id in DYNAMIC_NAMES:
+            return True
+        if isinstance(node, ast.Attribute) and node.attr in DYNAMIC_NAMES:
+            return True
+        if isinstance(node, ast.Global) and SOLVER_NAME in node.names:
+            return True
+    return False
+
+
+def solver_arity(binding):
+    # 単純な def solver(...) か solver = lambda ...: だけを検査する（デコレータ付きなどは実行に任せる）
+    if isinstance(binding, ast.FunctionDef) and not binding.decorator_list:
+        return signature_arity(binding.args)
+    if isinstance(binding, ast.Assign) and len(binding.targets) == 1 \
+            and isinstance(binding.targets[0], ast.Name) and isinstance(binding.value, ast.Lambda):
+        return signature_arity(binding.value.args)
+    return None
+
+
+def analyze_uncached(code):
+    try:
+        tree = ast.parse(code, filename='solver.py')
+    except (SyntaxError, ValueError) as e:
+        return Analysis(error=f'{type(e).__name__}: {e}')
+    except (RecursionError, MemoryError):
+        return unanalyzable(code)
+    try:
+        return analyze_tree(tree)
+    except (RecursionError, MemoryError):
+        return unanalyzable(code)
+
+
+def unanalyzable(code):
+    # 入れ子が深すぎて解析できないコードは、コードそのものの指紋で実行に任せる
+    return Analysis(hashlib.sha256(code.encode('utf-8')).hexdigest(), defined=True, arity=None)
+
+
+def analyze_tree(tree):
+    fingerprint = hashlib.sha256(ast.dump(tree).encode('utf-8')).hexdigest()
+    bindings = solver_bindings(tree)
+    # solver_bindings が扱わない形の束縛があれば、定義されているかどうかと引数の数の判断は実行に任せる
+    unrecognized = count_binding_sites(tree) > len(bindings)
+    if not bindings:
+        return Analysis(fingerprint, defined=unrecognized or uses_dynamic_names(tree))
+    arity = solver_arity(bindings[0]) if len(bindings) == 1 and not unrecognized else None
+    return Analysis(fingerprint, arity=arity)
+
+
+class AnalysisCache:
+    # 同じコードの再提出では解析し直さない（コンテナ内のLRU）
+    def __init__(self, max_entries=ANALYSIS_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def analyze(self, code):
+        key = hashlib.sha256(code.encode('utf-8')).digest()
+        with self._lock:
+            analysis = self._entries.get(key)
+            if analysis is not None:
+                self._entries.move_to_end(key)
+                return analysis
+        analysis = analyze_uncached(code)
+        with self._lock:
+            self._entries[key] = analysis
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return analysis
+
+
+def required_arities(test_cases):
+    # 入力が null のケースは solver()、それ以外は solver(input) で呼ばれる
+    return {0 if test_input is None else 1 for test_input, _ in test_cases}
+
+
+def check_solver(analysis, arities):
+    # 実行前に CE と判定できる理由を返す。問題がなければ None
+    if analysis.error is not None:
+        return analysis.error
+    if not analysis.defined:
+        return f'{SOLVER_NAME} is not defined'
+    if analysis.arity is not None:
+        minimum, maximum = analysis.arity
+        for arity in sorted(arities):
+            if arity < minimum or (maximum is not None and arity > maximum):
+                return f'{SOLVER_NAME} must accept {arity} argument{"" if arity == 1 else "s"}'
+    return None
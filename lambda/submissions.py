@@ -0,0 +1,56 @@
+import json
+import aws_clients
+import os
+from decimal import Decimal
+from judge_jobs import JobStore
+import metrics
+
+job_store = JobStore(aws_clients.table(os.environ['JUDGE_JOBS_TABLE']))
+
+def decimal_default(obj):
+    if isinstance(obj, Decimal):
+        return int(obj)
+    raise TypeError
+
+@metrics.instrument('submissions')
+def handler(event, context):
+    try:
+        job_id = event['pathParameters']['id']
+        job = job_store.get(job_id)
+        
+        if job is None:
+            return {
+                'statusCode': 404,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'error': f'Submission {job_id} not found.'})
+            }
+        
+        body = {
+            'job_id': job['job_id'],
+            'status': job['status'],
+            'username': job['username'],
+            'problem_number': job['problem_number']
+        }
+        if 'result' in job:
+            body['result'] = job['result']
+        if 'error' in job:
+            body['error'] = job['error']
+        
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps(body, default=decimal_default)
+        }
+    
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)})
+        }
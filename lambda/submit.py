@@ -1,172 +1,920 @@
+import hashlib
 import json
-import boto3
 import os
-import uuid
+import secrets
 from datetime import datetime, timezone, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from judge_harness import RESULT_MARKER, INPUT_PATH as HARNESS_INPUT_PATH
+from session_pool import SessionPool
+from judge_cache import JudgeCache, make_cache_key
+from contest_config import get_contest_config, CASE_TIME_LIMIT_SECONDS, OUTPUT_LIMIT_BYTES
+from judge_jobs import JobStore, get_job_queue
+from admission import AdmissionControl, AdmissionRejected
+from agentcore_client import AgentCoreClient, JudgeUnavailable
+from static_check import AnalysisCache, check_solver, required_arities
+from scoring import problem_index, UserState, RULE_ICPC
+from solution_store import SolutionStore
+import metrics
+import aws_clients
 
-dynamodb = boto3.resource('dynamodb')
-bedrock_agentcore = boto3.client('bedrock-agentcore')
-s3 = boto3.client('s3')
-table = dynamodb.Table(os.environ['LEADERBOARD_TABLE'])
-game_state_table = dynamodb.Table(os.environ['GAME_STATE_TABLE'])
+# スロットリングを見て再試行・同時セッション数の調整・回路の開閉を行う（botocore 自体の再試行はしない）
+bedrock_agentcore = AgentCoreClient(
+    aws_clients.client('bedrock-agentcore', max_attempts=1),
+    max_sessions=int(os.environ.get('AGENTCORE_MAX_SESSIONS', '8')),
+    max_retries=int(os.environ.get('AGENTCORE_MAX_RETRIES', '3'))
+)
+LEADERBOARD_TABLE = os.environ['LEADERBOARD_TABLE']
+STANDINGS_TABLE = os.environ['STANDINGS_TABLE']
+table = aws_clients.table(LEADERBOARD_TABLE)
+standings_table = aws_clients.table(STANDINGS_TABLE)
+# まとめて提出された結果の読み書き用（BatchGetItem / TransactWriteItems）
+dynamodb = aws_clients.resource('dynamodb')
+dynamodb_client = aws_clients.client('dynamodb')
 code_interpreter_id = os.environ['CODE_INTERPRETER_ID']
-bucket_name = os.environ['WEBSITE_BUCKET']
+contest_config = get_contest_config()
+session_pool = SessionPool(bedrock_agentcore, code_interpreter_id, max_idle=int(os.environ.get('SESSION_POOL_SIZE', '2')))
+judge_cache = JudgeCache(
+    aws_clients.table(os.environ['JUDGE_CACHE_TABLE']) if os.environ.get('JUDGE_CACHE_TABLE') else None,
+    max_entries=int(os.environ.get('JUDGE_CACHE_SIZE', '1024')),
+    ttl_seconds=int(os.environ.get('JUDGE_CACHE_TTL_SECONDS', '86400'))
+)
+SUBMIT_MODE = os.environ.get('SUBMIT_MODE', 'sync')
+job_store = JobStore(aws_clients.table(os.environ['JUDGE_JOBS_TABLE']) if os.environ.get('JUDGE_JOBS_TABLE') else None)
+job_queue = get_job_queue(lambda job: process_job(job))
+admission = AdmissionControl(
+    aws_clients.table(os.environ['ADMISSION_TABLE']) if os.environ.get('ADMISSION_TABLE') else None,
+    lease_seconds=int(os.environ.get('ADMISSION_LEASE_SECONDS', '60'))
+)
+analysis_cache = AnalysisCache()
+# 再採点用に提出コードを保存する（正解は常に、誤答は STORE_REJECTED_SOLUTIONS=1 のときだけ）
+solution_store = SolutionStore(
+    aws_clients.client('s3') if os.environ.get('SOLUTIONS_BUCKET') else None,
+    os.environ.get('SOLUTIONS_BUCKET'),
+    aws_clients.table(os.environ['SOLUTIONS_TABLE']) if os.environ.get('SOLUTIONS_TABLE') else None
+)
+STORE_REJECTED_SOLUTIONS = os.environ.get('STORE_REJECTED_SOLUTIONS', '0') == '1'
+# 非同期ワーカーは採点枠が空くまでこの秒数だけ待つ（/submit は待たずに429を返す）
+WORKER_SLOT_WAIT_SECONDS = float(os.environ.get('WORKER_SLOT_WAIT_SECONDS', '10'))
+# /submit/batch で一度に提出できる問題数（1つのセッションで順に実行するので、Lambdaのタイムアウトに収まる数にする）
+BATCH_RESOURCE = '/submit/batch'
+BATCH_MAX_SUBMISSIONS = int(os.environ.get('BATCH_MAX_SUBMISSIONS', '5'))
 
-response = s3.get_object(Bucket=bucket_name, Key='problems.json')
-PROBLEMS = {int(k): {'test_cases': [tuple(tc) for tc in v['test_cases']]} for k, v in json.loads(response['Body'].read()).items()}
+HARNESS_PATH = os.path.join(os.path.dirname(__file__), 'judge_harness.py')
+with open(HARNESS_PATH, encoding='utf-8') as f:
+    HARNESS_CODE = f.read()
+HARNESS_EXEC_CODE = "import runpy\nrunpy.run_path('judge_harness.py', run_name='__main__')"
 
-def execute_all_tests(code, test_cases):
-    try:
-        code = code.replace('\\n', '\n').replace('\\t', '\t')
-        session = bedrock_agentcore.start_code_interpreter_session(
+# 最初の失敗ケースで採点を打ち切るかどうか
+FAIL_FAST = os.environ.get('JUDGE_FAIL_FAST', '1') == '1'
+SYNTAX_ERROR_TYPES = ('SyntaxError', 'IndentationError', 'TabError')
+# ICPC形式でペナルティの対象になる判定（構文エラーと採点基盤のエラーは数えない）
+PENALIZED_VERDICTS = ('WA', 'RE', 'TLE', 'OLE')
+# performance_ranking を指定した問題では、全ケースに正解した提出のケースごとのCPU時間とピークメモリを
+# サンドボックス内で測る（1回ごとに新しいプロセスで import して呼び、最大 repeats 回の中央値。計測全体で budget 秒まで）
+PERF_REPEATS = int(os.environ.get('PERF_REPEATS', '5'))
+PERF_BUDGET_SECONDS = float(os.environ.get('PERF_BUDGET_SECONDS', '2'))
+
+def stream_texts(response):
+    for event in response['stream']:
+        if 'result' in event and 'content' in event['result']:
+            for content in event['result']['content']:
+                if content['type'] == 'text':
+                    yield content['text']
+
+def max_record_chars(output_limit_bytes):
+    # ハーネスが出力を上限で切るので、1ケース分の行は (JSONのエスケープを含めて) これを超えない
+    return output_limit_bytes * 6 + 4096
+
+class HarnessOutputReader:
+    # executeCode のストリームを逐次読み、1行1ケースのJSON Linesをテストケース順のレコードに戻す
+    # 出力全体を連結せず、1行と全体の文字数に上限を設ける
+    # fail-fast で打ち切られたケースやハーネスが途中で落ちたケースは None のまま
+    # 結果の行は実行ごとの nonce 付きのマーカーで始まるものだけを読む（提出コードの出力は偽造できない）
+    def __init__(self, case_count, output_limit_bytes, fail_fast=False, measure=False, nonce=''):
+        self.marker = RESULT_MARKER + nonce
+        self.records = [None] * case_count
+        self.fail_fast = fail_fast
+        self.measure = measure
+        self.max_line_chars = max_record_chars(output_limit_bytes)
+        self.max_total_chars = self.max_line_chars * case_count
+        self.total_chars = 0
+        self.received = 0
+        self.done = False
+        self.output_limit_exceeded = False
+        self._pending = []
+        self._pending_chars = 0
+        self._skipping_line = False
+
+    def feed(self, text):
+        # 以降を読む必要がなくなったら True を返す
+        self.total_chars += len(text)
+        if self.total_chars > self.max_total_chars:
+            # ハーネスを迂回して大量に書き出された場合。未判定の最初のケースを出力超過として扱う
+            self._mark_output_limit()
+            return self.done
+        start = 0
+        while not self.done:
+            newline = text.find('\n', start)
+            if newline < 0:
+                self._buffer(text[start:])
+                break
+            self._buffer(text[start:newline])
+            self._end_line()
+            start = newline + 1
+        return self.done
+
+    def finish(self):
+        if not self.done:
+            self._end_line()
+        return self.records
+
+    def _buffer(self, text):
+        if self._skipping_line or not text:
+            return
+        self._pending_chars += len(text)
+        if self._pending_chars > self.max_line_chars:
+            # 上限を超える行は結果のレコードではないので、行末まで読み捨てる
+            self._skipping_line = True
+            self._pending = []
+            return
+        self._pending.append(text)
+
+    def _end_line(self):
+        line = ''.join(self._pending)
+        self._pending = []
+        self._pending_chars = 0
+        self._skipping_line = False
+        if line.startswith(self.marker):
+            self._accept(json.loads(line[len(self.marker):]))
+
+    def _accept(self, record):
+        if record['status'] == 'perf':
+            # 全ケース正解のあとに届く性能の計測結果は、ケースごとのレコードに書き足す
+            for target, performance in zip(self.records, record['cases']):
+                if target is not None and performance is not None:
+                    target.update(performance)
+            self.done = True
+            return
+        if record['status'] == 'import_error':
+            # solver を import できない場合は全ケース同じエラー
+            self.records = [record] * len(self.records)
+            self.done = True
+            return
+        index = record['index']
+        if not (0 <= index < len(self.records)) or self.records[index] is not None:
+            return
+        self.records[index] = record
+        self.received += 1
+        if self.received == len(self.records):
+            # 全ケース正解なら、続く計測結果まで読む
+            self.done = not (self.measure and all(r.get('passed', True) for r in self.records))
+        elif self.fail_fast and not record.get('passed', True):
+            self.done = True
+
+    def _mark_output_limit(self):
+        self.output_limit_exceeded = True
+        self.done = True
+        for index, record in enumerate(self.records):
+            if record is None:
+                self.records[index] = {'index': index, 'status': 'output_limit', 'output': ''}
+                return
+
+def read_harness_output(response, case_count, output_limit_bytes, fail_fast=False, measure=False, nonce=''):
+    reader = HarnessOutputReader(case_count, output_limit_bytes, fail_fast, measure, nonce)
+    stream = response['stream']
+    for text in stream_texts(response):
+        if reader.feed(text):
+            # 必要な結果が揃ったら、残りのストリームは読まない
+            if hasattr(stream, 'close'):
+                stream.close()
+            break
+    return reader.finish(), reader
+
+def expected_digest(expected_output):
+    return hashlib.sha256(str(expected_output).encode('utf-8')).hexdigest()
+
+def measure_config(problem):
+    if not problem.get('performance_ranking'):
+        return None
+    return {'repeats': PERF_REPEATS, 'budget_seconds': PERF_BUDGET_SECONDS}
+
+def new_nonce():
+    return secrets.token_hex(16)
+
+def harness_input(test_cases, expected, fail_fast, time_limit_seconds, output_limit_bytes, measure=None, nonce=''):
+    # 期待出力はハッシュだけをサンドボックスに渡し、fail-fast の判定に使う
+    config = {
+        'nonce': nonce,
+        'inputs': list(test_cases),
+        'fail_fast': fail_fast,
+        'time_limit_seconds': time_limit_seconds,
+        'output_limit_bytes': output_limit_bytes
+    }
+    if measure:
+        config['measure'] = measure
+    if expected is not None:
+        config['expected_digests'] = [expected_digest(e) for e in expected]
+        config['expected_lengths'] = [len(str(e)) for e in expected]
+    return json.dumps(config, ensure_ascii=False)
+
+def write_files(session_id, files):
+    with metrics.timer('write_files'):
+        bedrock_agentcore.invoke_code_interpreter(
             codeInterpreterIdentifier=code_interpreter_id,
-            name='solver-session',
-            sessionTimeoutSeconds=60
+            sessionId=session_id,
+            name='writeFiles',
+            arguments={'content': files}
         )
-        session_id = session['sessionId']
-        
-        try:
-            bedrock_agentcore.invoke_code_interpreter(
-                codeInterpreterIdentifier=code_interpreter_id,
-                sessionId=session_id,
-                name='writeFiles',
-                arguments={'content': [{'path': 'solver.py', 'text': code}]}
-            )
+
+def run_harness(session_id, exec_code, case_count, output_limit_bytes, fail_fast, measure=None, nonce=''):
+    with metrics.timer('execute_code'):
+        response = bedrock_agentcore.invoke_code_interpreter(
+            codeInterpreterIdentifier=code_interpreter_id,
+            sessionId=session_id,
+            name='executeCode',
+            arguments={'language': 'python', 'code': exec_code}
+        )
+    with metrics.timer('drain_stream'):
+        records, reader = read_harness_output(response, case_count, output_limit_bytes, fail_fast, bool(measure), nonce)
+    for record in records:
+        if record is not None and 'elapsed_ms' in record:
+            metrics.put('case', record['elapsed_ms'])
+    return records, reader
+
+def execute_shard(code, test_cases, expected=None, fail_fast=False, time_limit_seconds=CASE_TIME_LIMIT_SECONDS,
+                  output_limit_bytes=OUTPUT_LIMIT_BYTES, measure=None):
+    try:
+        with bedrock_agentcore.session_slot():
+            with metrics.timer('session_acquire'):
+                session = session_pool.acquire()
+            session_id = session.session_id
+            reusable = False
+            nonce = new_nonce()
             
-            results = []
-            for test_input in test_cases:
-                exec_code = f"from solver import solver\nprint(solver({repr(test_input)}))" if test_input is not None else "from solver import solver\nprint(solver())"
+            try:
+                # ソルバー・ハーネス・テスト入力を1回の writeFiles でまとめて送る
+                write_files(session_id, [
+                    {'path': 'solver.py', 'text': code},
+                    {'path': 'judge_harness.py', 'text': HARNESS_CODE},
+                    {'path': HARNESS_INPUT_PATH,
+                     'text': harness_input(test_cases, expected, fail_fast, time_limit_seconds, output_limit_bytes,
+                                           measure, nonce)}
+                ])
                 
-                response = bedrock_agentcore.invoke_code_interpreter(
-                    codeInterpreterIdentifier=code_interpreter_id,
-                    sessionId=session_id,
-                    name='executeCode',
-                    arguments={'language': 'python', 'code': exec_code}
-                )
-                
-                output = ''
-                for event in response['stream']:
-                    if 'result' in event and 'content' in event['result']:
-                        for content in event['result']['content']:
-                            if content['type'] == 'text':
-                                output += content['text']
-                
-                results.append(output.strip())
-            
-            return results, None
-        finally:
-            bedrock_agentcore.stop_code_interpreter_session(
-                codeInterpreterIdentifier=code_interpreter_id,
-                sessionId=session_id
-            )
+                # 全テストケースを1回の executeCode で実行する
+                records, reader = run_harness(session_id, HARNESS_EXEC_CODE, len(test_cases), output_limit_bytes,
+                                              fail_fast, measure, nonce)
+                # ハーネスを迂回して書き出し続けているセッションは使い回さない
+                reusable = not reader.output_limit_exceeded
+                return records, None
+            finally:
+                with metrics.timer('session_release'):
+                    session_pool.release(session, reusable=reusable)
+    except JudgeUnavailable:
+        # スロットリング・障害で採点できなかった。判定(IE)にはせず、再試行を促す応答にする
+        raise
     except Exception as e:
         return None, f"Execution error: {str(e)}"
 
+def batch_exec_code(index, nonce):
+    return (f"import runpy\n"
+            f"runpy.run_path('judge_harness.py')['main']('judge_input_{index}.json', 'solver_{index}', '{nonce}')")
+
+def execute_batch(jobs):
+    # まとめて提出された (問題, コード) を1つのセッションで採点し、問題ごとに (records, error) を返す
+    # すべてのソルバーと入力は1回の writeFiles で送り、executeCode は問題ごとに分ける
+    outputs = []
+    try:
+        with bedrock_agentcore.session_slot():
+            with metrics.timer('session_acquire'):
+                session = session_pool.acquire()
+            session_id = session.session_id
+            reusable = False
+            
+            try:
+                files = [{'path': 'judge_harness.py', 'text': HARNESS_CODE}]
+                nonces = [new_nonce() for _ in jobs]
+                for index, (problem, code) in enumerate(jobs):
+                    files.append({'path': f'solver_{index}.py', 'text': code})
+                    files.append({'path': f'judge_input_{index}.json', 'text': harness_input(
+                        [tc[0] for tc in problem['test_cases']], [tc[1] for tc in problem['test_cases']],
+                        FAIL_FAST, problem['time_limit_seconds'], problem['output_limit_bytes'], measure_config(problem)
+                    )})
+                write_files(session_id, files)
+                
+                flooded = False
+                for index, (problem, _) in enumerate(jobs):
+                    records, reader = run_harness(session_id, batch_exec_code(index, nonces[index]),
+                                                  len(problem['test_cases']), problem['output_limit_bytes'], FAIL_FAST,
+                                                  measure_config(problem), nonces[index])
+                    outputs.append((records, None))
+                    if reader.output_limit_exceeded:
+                        # ハーネスを迂回して書き出し続けているセッションでは、残りの問題を採点しない
+                        flooded = True
+                        break
+                reusable = not flooded
+            finally:
+                with metrics.timer('session_release'):
+                    session_pool.release(session, reusable=reusable)
+        error = 'Execution error: session discarded after output limit was exceeded'
+    except JudgeUnavailable:
+        raise
+    except Exception as e:
+        error = f"Execution error: {str(e)}"
+    # 実行できなかった問題は採点基盤のエラーとして返す
+    return outputs + [(None, error)] * (len(jobs) - len(outputs))
+
+def split_shards(test_cases, shards):
+    # 元の順序を保ったまま、ほぼ均等な連続区間に分割する
+    shards = max(1, min(shards, len(test_cases)))
+    size, remainder = divmod(len(test_cases), shards)
+    chunks = []
+    start = 0
+    for i in range(shards):
+        end = start + size + (1 if i < remainder else 0)
+        chunks.append(test_cases[start:end])
+        start = end
+    return chunks
+
+def execute_all_tests(code, test_cases, expected=None, shards=1, fail_fast=False, time_limit_seconds=CASE_TIME_LIMIT_SECONDS,
+                      output_limit_bytes=OUTPUT_LIMIT_BYTES, measure=None):
+    code = code.replace('\\n', '\n').replace('\\t', '\t')
+    chunks = split_shards(list(test_cases), shards)
+    if len(chunks) <= 1:
+        return execute_shard(code, test_cases, expected, fail_fast, time_limit_seconds, output_limit_bytes, measure)
+    
+    expected_chunks = split_shards(list(expected), shards) if expected is not None else [None] * len(chunks)
+    
+    # 各シャードを別々のセッションで並行実行し、元の順序で結合する
+    with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+        shard_outputs = list(executor.map(
+            metrics.bind(lambda args: execute_shard(code, args[0], args[1], fail_fast, time_limit_seconds,
+                                                    output_limit_bytes, measure)),
+            zip(chunks, expected_chunks)
+        ))
+    
+    records = []
+    for shard_records, error in shard_outputs:
+        if error:
+            return None, error
+        records.extend(shard_records)
+    return records, None
+
+def build_verdict(records, expected):
+    # 最初に失敗したケースの番号と種類 (WA/RE/TLE/OLE/CE) を返す
+    for index, expected_output in enumerate(expected):
+        record = records[index]
+        if record is None:
+            # ハーネスの結果が届かなかった。提出コードの誤りとは限らないので、採点基盤のエラーとして扱う
+            return {'correct': False, 'verdict': 'IE', 'failed_case': None}
+        if record['status'] == 'import_error':
+            if record.get('error_type') == 'TimeLimitExceeded':
+                # モジュール直下のコードが終わらなかった
+                return {'correct': False, 'verdict': 'TLE', 'failed_case': None}
+            verdict = 'CE' if record.get('error_type') in SYNTAX_ERROR_TYPES else 'RE'
+            return {'correct': False, 'verdict': verdict, 'failed_case': None}
+        if record['status'] == 'timeout':
+            return {'correct': False, 'verdict': 'TLE', 'failed_case': index}
+        if record['status'] == 'error':
+            return {'correct': False, 'verdict': 'RE', 'failed_case': index}
+        if record['status'] == 'output_limit':
+            return {'correct': False, 'verdict': 'OLE', 'failed_case': index}
+        if record['status'] == 'mismatch':
+            # 期待値より長い出力になった時点でサンドボックス側で打ち切られている
+            return {'correct': False, 'verdict': 'WA', 'failed_case': index}
+        if record['output'].strip() != expected_output:
+            return {'correct': False, 'verdict': 'WA', 'failed_case': index}
+    verdict = {'correct': True, 'verdict': 'AC', 'failed_case': None}
+    if records and all('cpu_us' in record for record in records):
+        # 提出全体の性能は、ケースごとのCPU時間(中央値)の合計とピークメモリの最大値
+        verdict['performance'] = {
+            'cpu_us': sum(record['cpu_us'] for record in records),
+            'peak_memory_bytes': max(record['peak_memory_bytes'] for record in records)
+        }
+    return verdict
+
+def judge(problem, code):
+    inputs = [tc[0] for tc in problem['test_cases']]
+    expected = [tc[1] for tc in problem['test_cases']]
+    
+    records, error = execute_all_tests(
+        code, inputs, expected,
+        shards=problem['shards'],
+        fail_fast=FAIL_FAST,
+        time_limit_seconds=problem['time_limit_seconds'],
+        output_limit_bytes=problem['output_limit_bytes'],
+        measure=measure_config(problem)
+    )
+    
+    # 実行基盤のエラーは提出コードの問題ではないのでキャッシュしない
+    if error:
+        return {'correct': False, 'verdict': 'IE', 'failed_case': None}, False
+    verdict = build_verdict(records, expected)
+    return verdict, is_cacheable(verdict)
+
+def is_cacheable(verdict):
+    # TLE はサンドボックスの混み具合でも変わりうるので、次の提出では採点し直す
+    return verdict['verdict'] not in ('IE', 'TLE')
+
+def judge_in_slot(problem, code, slot_wait_seconds):
+    # キャッシュに無く、実際にサンドボックスで採点するときだけ全体の採点枠を使う
+    with admission.judge_slot(contest_config.admission_limits(), slot_wait_seconds):
+        return judge(problem, code)
+
+def normalize_code(code):
+    return code.replace('\\n', '\n').replace('\\t', '\t')
+
+def prejudge(problem_number, problem, code):
+    # 実行するまでもなく CE になるコードは、サンドボックスを起動せずにその場で判定を返す
+    # それ以外は採点結果キャッシュのキーを返す
+    with metrics.timer('static_check'):
+        analysis = analysis_cache.analyze(code)
+        reason = check_solver(analysis, required_arities(problem['test_cases']))
+    if reason is not None:
+        return {'correct': False, 'verdict': 'CE', 'failed_case': None, 'detail': reason}, None
+    # 空白やコメントだけが違う再提出も同じ採点結果を使えるよう、ASTの指紋をキーにする
+    return None, make_cache_key(problem_number, problem['test_set_version'], analysis.fingerprint)
+
+def judge_problem(problem_number, code, slot_wait_seconds=0):
+    problems = contest_config.problems()
+    if problem_number not in problems:
+        return {'correct': False, 'verdict': 'WA', 'failed_case': None}
+    
+    problem = problems[problem_number]
+    code = normalize_code(code)
+    verdict, cache_key = prejudge(problem_number, problem, code)
+    if verdict is not None:
+        return verdict
+    return judge_cache.get_or_judge(cache_key, lambda: judge_in_slot(problem, code, slot_wait_seconds))
+
+def judge_batch(entries):
+    # (問題番号, コード) のリストを採点する。キャッシュに無いものは1つのセッションでまとめて実行する
+    problems = contest_config.problems()
+    verdicts = [None] * len(entries)
+    pending = []
+    for index, (problem_number, code) in enumerate(entries):
+        problem = problems[problem_number]
+        code = normalize_code(code)
+        verdict, cache_key = prejudge(problem_number, problem, code)
+        if verdict is None:
+            verdict = judge_cache.lookup(cache_key)
+        if verdict is None:
+            pending.append((index, problem, code, cache_key))
+        verdicts[index] = verdict
+    if not pending:
+        return verdicts
+    
+    with admission.judge_slot(contest_config.admission_limits()):
+        outputs = execute_batch([(problem, code) for _, problem, code, _ in pending])
+    for (index, problem, _, cache_key), (records, error) in zip(pending, outputs):
+        if error:
+            verdicts[index] = {'correct': False, 'verdict': 'IE', 'failed_case': None}
+            continue
+        verdicts[index] = build_verdict(records, [tc[1] for tc in problem['test_cases']])
+        if is_cacheable(verdicts[index]):
+            judge_cache.store(cache_key, verdicts[index])
+    return verdicts
+
 def check_problem(problem_number, code):
-    if problem_number not in PROBLEMS:
+    return judge_problem(problem_number, code)['correct']
+
+def solved_key(epoch, username, problem_number):
+    return f'{epoch}#{username}#{problem_number}'
+
+def ensure_standing(epoch, username, problem_number):
+    # 集計レコードを初期化し、問題番号の位置まで正解時刻・誤答数の配列を伸ばしておく
+    length = max(max(contest_config.problems()), problem_number)
+    zeros = [0] * length
+    response = standings_table.update_item(
+        Key={'epoch': epoch, 'username': username},
+        UpdateExpression='SET solve_times = if_not_exists(solve_times, :zeros), wrong_attempts = if_not_exists(wrong_attempts, :zeros), solved_mask = if_not_exists(solved_mask, :zero), solved_count = if_not_exists(solved_count, :zero), performance = if_not_exists(performance, :empty)',
+        ExpressionAttributeValues={':zeros': zeros, ':zero': 0, ':empty': {}},
+        ReturnValues='ALL_NEW'
+    )
+    current = len(response['Attributes']['solve_times'])
+    if current >= problem_number:
+        return
+    # 途中で問題が追加された場合
+    try:
+        standings_table.update_item(
+            Key={'epoch': epoch, 'username': username},
+            UpdateExpression='SET solve_times = list_append(solve_times, :pad), wrong_attempts = list_append(wrong_attempts, :pad)',
+            ConditionExpression='size(solve_times) = :length',
+            ExpressionAttributeValues={':pad': [0] * (problem_number - current), ':length': current}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+def update_rank_key(epoch, attributes):
+    # 集計レコードの更新後の内容から RankIndex のソートキーを書き込む
+    # 読んだ後に別の更新が入っていたら、その更新の側で書き直されるので何もしない
+    rank_key = contest_config.scoring_rules().rank_key(UserState.from_item(attributes))
+    if attributes.get('rank_key') == rank_key:
+        return
+    with metrics.timer('rank_key'):
+        try:
+            standings_table.update_item(
+                Key={'epoch': epoch, 'username': attributes['username']},
+                UpdateExpression='SET rank_key = :k',
+                ConditionExpression='standing_revision = :r',
+                ExpressionAttributeValues={':k': rank_key, ':r': attributes['standing_revision']}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+def refresh_rank_key(epoch, username):
+    # 更新後の内容を返さない書き込み（TransactWriteItems）の後に使う
+    item = standings_table.get_item(Key={'epoch': epoch, 'username': username}, ConsistentRead=True).get('Item')
+    if item is not None and 'standing_revision' in item:
+        update_rank_key(epoch, item)
+
+def record_standing(epoch, username, problem_number, solved_at_ms, performance=None):
+    # ユーザーごとの集計済みレコードを原子的に更新する（同じ問題の二重加算は条件式で防ぐ）
+    # 条件式で未正解が保証されるので、ビットマスクへの ADD はビットORと同じになる
+    # 性能を測った問題では、正解した提出の性能を問題番号をキーにした performance マップに残す
+    ensure_standing(epoch, username, problem_number)
+    index = problem_index(problem_number)
+    set_actions = f'solve_times[{index}] = :t, last_solve_ms = :t'
+    values = {
+        ':t': solved_at_ms,
+        ':bit': 1 << index,
+        ':problems': {problem_number},
+        ':one': 1,
+        ':p': problem_number
+    }
+    names = {}
+    if performance is not None:
+        set_actions += ', performance.#n = :performance'
+        names['#n'] = str(problem_number)
+        values[':performance'] = performance
+    try:
+        response = standings_table.update_item(
+            Key={'epoch': epoch, 'username': username},
+            UpdateExpression=f'SET {set_actions} ADD solved_mask :bit, solved_problems :problems, solved_count :one, standing_revision :one',
+            ConditionExpression='attribute_not_exists(solved_problems) OR NOT contains(solved_problems, :p)',
+            ExpressionAttributeValues=values,
+            ReturnValues='ALL_NEW',
+            **({'ExpressionAttributeNames': names} if names else {})
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return
+    update_rank_key(epoch, response['Attributes'])
+
+def record_wrong_attempt(epoch, username, problem_number):
+    # ICPC形式のペナルティ用に、未正解の問題への誤答数を数える
+    ensure_standing(epoch, username, problem_number)
+    index = problem_index(problem_number)
+    try:
+        response = standings_table.update_item(
+            Key={'epoch': epoch, 'username': username},
+            UpdateExpression=f'SET wrong_attempts[{index}] = wrong_attempts[{index}] + :one ADD standing_revision :one',
+            ConditionExpression='attribute_not_exists(solved_problems) OR NOT contains(solved_problems, :p)',
+            ExpressionAttributeValues={':one': 1, ':p': problem_number},
+            ReturnValues='ALL_NEW'
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return
+    update_rank_key(epoch, response['Attributes'])
+
+
+def json_response(status_code, body, headers=None):
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            **(headers or {})
+        },
+        'body': json.dumps(body)
+    }
+
+def rejected_response(rejected):
+    message = {
+        'rate_limited': 'Too many submissions. Please wait before submitting again.',
+        'busy': 'The judge is busy. Please try again shortly.',
+        'unavailable': 'The judge is temporarily unavailable. Your submission was not judged; please retry later.'
+    }[rejected.reason]
+    # 採点基盤側の混雑・障害は 503、受付制御での制限は 429
+    return json_response(503 if rejected.reason == 'unavailable' else 429, {
+        'error': message,
+        'reason': rejected.reason,
+        'retry_after': rejected.retry_after_seconds
+    }, headers={
+        'Retry-After': str(rejected.retry_after_seconds),
+        'Access-Control-Expose-Headers': 'Retry-After'
+    })
+
+def submission_time():
+    jst = timezone(timedelta(hours=9))
+    now = datetime.now(jst)
+    return now.strftime('%Y-%m-%d %H:%M:%S JST'), int(now.timestamp() * 1000)
+
+def is_penalized(verdict):
+    return verdict['verdict'] in PENALIZED_VERDICTS and contest_config.scoring_rules().rule == RULE_ICPC
+
+def already_solved_result():
+    # result は以前と同じ 'correct' のまま、正解済みだったことは already_solved で伝える
+    return {
+        'result': 'correct',
+        'already_solved': True,
+        'message': 'Already solved. No update to leaderboard.'
+    }
+
+def incorrect_result(verdict):
+    return {
+        'result': 'incorrect',
+        'verdict': verdict['verdict'],
+        'failed_case': verdict['failed_case'],
+        **({'detail': verdict['detail']} if 'detail' in verdict else {}),
+        'message': 'Code is incorrect. Try again.'
+    }
+
+def correct_result(verdict, submission_id, recorded):
+    if not recorded:
+        return {
+            'result': 'correct',
+            'message': 'Already solved. No update to leaderboard.'
+        }
+    return {
+        'result': 'correct',
+        'verdict': verdict['verdict'],
+        **({'performance': verdict['performance']} if 'performance' in verdict else {}),
+        'message': 'Congratulations! Added to leaderboard.',
+        'submission_id': submission_id
+    }
+
+def submission_item(epoch, username, problem_number, timestamp, solved_at_ms, performance=None):
+    item = {
+        'submission_id': solved_key(epoch, username, problem_number),
+        'epoch': epoch,
+        'username': username,
+        'problem_number': problem_number,
+        'timestamp': timestamp,
+        'solved_at_ms': solved_at_ms
+    }
+    if performance is not None:
+        item['performance'] = performance
+    return item
+
+def record_correct(epoch, username, problem_number, timestamp, solved_at_ms, performance=None):
+    # 同時提出でも最初の1件だけが記録されるよう条件付きで書き込む。記録できたら True
+    try:
+        with metrics.timer('record_submission'):
+            table.put_item(
+                Item=submission_item(epoch, username, problem_number, timestamp, solved_at_ms, performance),
+                ConditionExpression='attribute_not_exists(submission_id)'
+            )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
         return False
     
-    test_cases = PROBLEMS[problem_number]['test_cases']
-    inputs = [tc[0] for tc in test_cases]
-    expected = [tc[1] for tc in test_cases]
+    with metrics.timer('record_standing'):
+        record_standing(epoch, username, problem_number, solved_at_ms, performance)
+    return True
+
+def store_solution(epoch, username, problem_number, code, verdict, submitted_at_ms):
+    # CE と採点基盤のエラー(IE)はテストケースを直しても結果が変わらないので保存しない
+    if not (verdict['correct'] or (STORE_REJECTED_SOLUTIONS and verdict['verdict'] in PENALIZED_VERDICTS)):
+        return
+    # 保存に失敗しても判定と記録は続ける（その提出が再採点の対象から外れるだけ）
+    try:
+        with metrics.timer('store_solution'):
+            solution_store.record(epoch, username, problem_number, code, verdict['verdict'], submitted_at_ms)
+    except Exception as e:
+        print(f"Failed to store solution: {str(e)}")
+        metrics.set_property('store_solution_error', str(e))
+
+def judge_submission(username, problem_number, code, slot_wait_seconds=0):
+    # 採点から記録までの本体。同期の /submit と非同期ワーカーの両方から呼ばれる
+    # (エポック, ユーザー, 問題) ごとに一意なキーで、採点前に正解済みかを確認する
+    epoch = contest_config.current_epoch()
+    submission_id = solved_key(epoch, username, problem_number)
+    with metrics.timer('solved_check'):
+        solved_response = table.get_item(Key={'submission_id': submission_id}, ConsistentRead=True)
     
-    code = code.replace('\\n', '\n').replace('\\t', '\t')
-    results, error = execute_all_tests(code, inputs)
+    if 'Item' in solved_response:
+        return 200, already_solved_result()
+    
+    timestamp, solved_at_ms = submission_time()
+    
+    with metrics.timer('judge'):
+        verdict = judge_problem(problem_number, code, slot_wait_seconds)
+    metrics.set_property('problem_number', problem_number)
+    metrics.set_property('verdict', verdict['verdict'])
+    store_solution(epoch, username, problem_number, code, verdict, solved_at_ms)
     
-    return not error and results == expected
+    if not verdict['correct']:
+        if is_penalized(verdict):
+            with metrics.timer('record_wrong_attempt'):
+                record_wrong_attempt(epoch, username, problem_number)
+        return 200, incorrect_result(verdict)
+    
+    recorded = record_correct(epoch, username, problem_number, timestamp, solved_at_ms, verdict.get('performance'))
+    return 200, correct_result(verdict, submission_id, recorded)
+
+def fetch_solved(submission_ids):
+    # 正解済みの提出IDを BatchGetItem でまとめて調べる（未処理のキーが返ったら読み直す）
+    request = {LEADERBOARD_TABLE: {
+        'Keys': [{'submission_id': submission_id} for submission_id in submission_ids],
+        'ConsistentRead': True,
+        'ProjectionExpression': 'submission_id'
+    }}
+    solved = set()
+    while request:
+        response = dynamodb.batch_get_item(RequestItems=request)
+        for items in response['Responses'].values():
+            solved.update(item['submission_id'] for item in items)
+        request = response.get('UnprocessedKeys') or {}
+    return solved
 
+def typed(values):
+    # TransactWriteItems（クライアントAPI）用に型付きの値へ変換する
+    from boto3.dynamodb.types import TypeSerializer
+    serializer = TypeSerializer()
+    return {k: serializer.serialize(v) for k, v in values.items()}
 
+def record_batch(epoch, username, solved, wrong, timestamp, solved_at_ms, performance=None):
+    # まとめて提出された結果を1回の TransactWriteItems で書き込む
+    # 正解ごとの提出レコードと、ユーザーの集計レコードへの1回の更新（正解と誤答をまとめる）
+    # performance は性能を測った問題の 問題番号→性能
+    # 別の提出と競合して条件を満たさなければ何も書かずに False を返す
+    performance = performance or {}
+    ensure_standing(epoch, username, max(solved + wrong))
+    transact_items = [{'Put': {
+        'TableName': LEADERBOARD_TABLE,
+        'Item': typed(submission_item(epoch, username, problem_number, timestamp, solved_at_ms,
+                                      performance.get(problem_number))),
+        'ConditionExpression': 'attribute_not_exists(submission_id)'
+    }} for problem_number in solved]
+    
+    set_actions = [f'solve_times[{problem_index(n)}] = :t' for n in solved]
+    set_actions += [f'wrong_attempts[{problem_index(n)}] = wrong_attempts[{problem_index(n)}] + :one' for n in wrong]
+    values = {f':p{i}': n for i, n in enumerate(solved + wrong)}
+    names = {}
+    for n in solved:
+        if performance.get(n) is not None:
+            set_actions.append(f'performance.#n{n} = :performance{n}')
+            names[f'#n{n}'] = str(n)
+            values[f':performance{n}'] = performance[n]
+    update_expression = 'SET ' + ', '.join(set_actions)
+    values[':revision'] = 1
+    if solved:
+        update_expression += ', last_solve_ms = :t ADD solved_mask :bits, solved_problems :problems, solved_count :count, standing_revision :revision'
+        values.update({
+            ':t': solved_at_ms,
+            ':bits': sum(1 << problem_index(n) for n in solved),
+            ':problems': set(solved),
+            ':count': len(solved)
+        })
+    else:
+        update_expression += ' ADD standing_revision :revision'
+    if wrong:
+        values[':one'] = 1
+    unsolved = ' AND '.join(f'NOT contains(solved_problems, :p{i})' for i in range(len(solved + wrong)))
+    transact_items.append({'Update': {
+        'TableName': STANDINGS_TABLE,
+        'Key': typed({'epoch': epoch, 'username': username}),
+        'UpdateExpression': update_expression,
+        'ConditionExpression': f'attribute_not_exists(solved_problems) OR ({unsolved})',
+        'ExpressionAttributeValues': typed(values),
+        **({'ExpressionAttributeNames': names} if names else {})
+    }})
+    try:
+        dynamodb_client.transact_write_items(TransactItems=transact_items)
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'TransactionCanceledException':
+            raise
+        return False
+    refresh_rank_key(epoch, username)
+    return True
+
+def judge_batch_submission(username, entries):
+    # 複数の (問題番号, コード) をまとめて採点し、問題ごとの結果を提出順に返す
+    epoch = contest_config.current_epoch()
+    submission_ids = {n: solved_key(epoch, username, n) for n, _ in entries}
+    with metrics.timer('solved_check'):
+        solved_before = fetch_solved(list(submission_ids.values()))
+    
+    results = {n: already_solved_result() for n, _ in entries if submission_ids[n] in solved_before}
+    to_judge = [(n, code) for n, code in entries if n not in results]
+    timestamp, solved_at_ms = submission_time()
+    
+    with metrics.timer('judge'):
+        verdicts = dict(zip((n for n, _ in to_judge), judge_batch(to_judge)))
+    for n, code in to_judge:
+        store_solution(epoch, username, n, code, verdicts[n], solved_at_ms)
+    
+    solved = [n for n, verdict in verdicts.items() if verdict['correct']]
+    wrong = [n for n, verdict in verdicts.items() if not verdict['correct'] and is_penalized(verdict)]
+    recorded = set()
+    if solved or wrong:
+        with metrics.timer('record_batch'):
+            batch_recorded = record_batch(epoch, username, solved, wrong, timestamp, solved_at_ms,
+                                          {n: verdicts[n].get('performance') for n in solved})
+        if batch_recorded:
+            recorded = set(solved)
+        else:
+            # 同じ問題を別の提出で同時に解いた場合などは、1問ずつ条件付きで記録し直す
+            for n in wrong:
+                record_wrong_attempt(epoch, username, n)
+            recorded = {n for n in solved
+                        if record_correct(epoch, username, n, timestamp, solved_at_ms, verdicts[n].get('performance'))}
+    
+    for n, verdict in verdicts.items():
+        if verdict['correct']:
+            results[n] = correct_result(verdict, submission_ids[n], n in recorded)
+        else:
+            results[n] = incorrect_result(verdict)
+    return 200, {'results': [{'problem_number': n, **results[n]} for n, _ in entries]}
+
+def submit_batch(body):
+    username = body['username']
+    entries = [(submission['problem_number'], submission['code']) for submission in body['submissions']]
+    problem_numbers = [n for n, _ in entries]
+    
+    if not entries or len(entries) > BATCH_MAX_SUBMISSIONS:
+        return json_response(400, {'error': f'Submit between 1 and {BATCH_MAX_SUBMISSIONS} solutions at once.'})
+    if len(set(problem_numbers)) != len(problem_numbers):
+        return json_response(400, {'error': 'Each problem can only be submitted once per batch.'})
+    problems = contest_config.problems()
+    missing = [n for n in problem_numbers if n not in problems]
+    if missing:
+        return json_response(400, {'error': f'Problem {missing[0]} does not exist.'})
+    
+    # まとめて提出しても、受付制御では問題数ぶんの提出として数える
+    limits = contest_config.admission_limits()
+    if 0 < limits['burst'] < len(entries):
+        return json_response(400, {'error': f"Submit at most {limits['burst']} solutions at once."})
+    with metrics.timer('admission'):
+        admission.take_token(username, limits, cost=len(entries))
+    
+    metrics.set_property('batch_size', len(entries))
+    status_code, result = judge_batch_submission(username, entries)
+    return json_response(status_code, result)
+
+def process_job(job):
+    # キューから取り出したジョブを採点し、結果をジョブレコードに書き戻す
+    job_store.mark_running(job['job_id'])
+    try:
+        status_code, result = judge_submission(job['username'], job['problem_number'], job['code'],
+                                               slot_wait_seconds=WORKER_SLOT_WAIT_SECONDS)
+    except AdmissionRejected:
+        # 採点枠が空かなかった。ジョブは待ち状態に戻し、メッセージの再配信で採点し直す
+        job_store.mark_queued(job['job_id'])
+        raise
+    except Exception as e:
+        job_store.fail(job['job_id'], str(e))
+        raise
+    job_store.complete(job['job_id'], status_code, result)
+    return result
+
+
+@metrics.instrument('submit')
 def handler(event, context):
     try:
-        game_state_response = game_state_table.get_item(Key={'state_key': 'game_active'})
-        is_active = game_state_response.get('Item', {}).get('value', False)
-        
-        if not is_active:
-            return {
-                'statusCode': 403,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'Game is not active. Submissions are currently disabled.'})
-            }
+        # ゲーム状態はTTL付きのスナップショットから読む（毎リクエストのget_itemはしない）
+        if not contest_config.is_game_active():
+            return json_response(403, {'error': 'Game is not active. Submissions are currently disabled.'})
         
         body = json.loads(event['body'])
+        if event.get('resource') == BATCH_RESOURCE:
+            return submit_batch(body)
+        
         username = body['username']
         problem_number = body['problem_number']
         code = body['code']
         
-        if problem_number not in PROBLEMS:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': f'Problem {problem_number} does not exist.'})
-            }
+        if problem_number not in contest_config.problems():
+            return json_response(400, {'error': f'Problem {problem_number} does not exist.'})
         
-        jst = timezone(timedelta(hours=9))
-        timestamp = datetime.now(jst).strftime('%Y-%m-%d %H:%M:%S JST')
+        # 同じユーザーの連続提出を抑える（キャッシュで採点しない提出も1回と数える）
+        with metrics.timer('admission'):
+            admission.take_token(username, contest_config.admission_limits())
         
-        is_correct = check_problem(problem_number, code)
+        if SUBMIT_MODE == 'async' or body.get('async'):
+            # 非同期モード: ジョブを登録して即座に 202 を返し、採点はワーカーに任せる
+            job = job_store.create(username, problem_number)
+            job_queue.enqueue({**job, 'code': code})
+            return json_response(202, {
+                'job_id': job['job_id'],
+                'status': job['status'],
+                'status_url': f"submissions/{job['job_id']}"
+            })
         
-        if is_correct:
-            # 既存の記録を確認
-            response = table.scan(
-                FilterExpression='username = :u AND problem_number = :p',
-                ExpressionAttributeValues={':u': username, ':p': problem_number}
-            )
-            
-            if response['Items']:
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({
-                        'result': 'correct',
-                        'message': 'Already solved. No update to leaderboard.'
-                    })
-                }
-            
-            submission_id = str(uuid.uuid4())
-            
-            table.put_item(
-                Item={
-                    'submission_id': submission_id,
-                    'username': username,
-                    'problem_number': problem_number,
-                    'timestamp': timestamp
-                }
-            )
-            
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({
-                    'result': 'correct',
-                    'message': 'Congratulations! Added to leaderboard.',
-                    'submission_id': submission_id
-                })
-            }
-        else:
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({
-                    'result': 'incorrect',
-                    'message': 'Code is incorrect. Try again.'
-                })
-            }
-            
+        status_code, result = judge_submission(username, problem_number, code)
+        return json_response(status_code, result)
+    
+    except AdmissionRejected as e:
+        metrics.set_property('rejected', e.reason)
+        return rejected_response(e)
     except Exception as e:
         return {
             'statusCode': 500,
@@ -0,0 +1,21 @@
+# WebSocket API の $connect / $disconnect / $default ルート
+# 接続IDを ConnectionsTable に出し入れするだけで、送信は live_updates.notify を呼ぶ側が行う
+import aws_clients
+import os
+from live_updates import ConnectionStore
+import metrics
+
+connections = ConnectionStore(aws_clients.table(os.environ['CONNECTIONS_TABLE']))
+
+
+@metrics.instrument('websocket')
+def handler(event, context):
+    request_context = event['requestContext']
+    route = request_context['routeKey']
+    connection_id = request_context['connectionId']
+    if route == '$connect':
+        connections.add(connection_id)
+    elif route == '$disconnect':
+        connections.remove(connection_id)
+    # $default はブラウザからのキープアライブ（アイドル10分で切れないように送られる）なので何もしない
+    return {'statusCode': 200}
@@ -1,28 +1,111 @@
 import base64
+import hashlib
+import hmac
+import time
 import boto3
 
 ssm = boto3.client('ssm', region_name='us-east-1')
 
+USERNAME_PARAMETER = '/coding-contest/admin-username'
+PASSWORD_PARAMETER = '/coding-contest/admin-password'
+
+# Lambda@Edge has no environment variables, so the tunables live here
+CREDENTIALS_TTL_SECONDS = 300
+SESSION_TTL_SECONDS = 900
+SESSION_COOKIE = 'admin_session'
+# Added to the redirect so a browser that refuses the cookie falls back to plain Basic auth
+REDIRECT_MARKER = '_session=1'
+
+# Cached per edge container: (username, password, signing_key, loaded_at)
+_credentials = None
+
+
+def load_credentials():
+    global _credentials
+    now = time.monotonic()
+    if _credentials is not None and now - _credentials[3] < CREDENTIALS_TTL_SECONDS:
+        return _credentials
+    # One batched call instead of one get_parameter per value
+    response = ssm.get_parameters(Names=[USERNAME_PARAMETER, PASSWORD_PARAMETER], WithDecryption=True)
+    values = {p['Name']: p['Value'] for p in response['Parameters']}
+    username = values[USERNAME_PARAMETER]
+    password = values[PASSWORD_PARAMETER]
+    # Deriving the cookie key from the credentials means a password change also revokes sessions
+    signing_key = hashlib.sha256(f'admin-session:{username}:{password}'.encode()).digest()
+    _credentials = (username, password, signing_key, now)
+    return _credentials
+
+
+def sign(signing_key, expires_at):
+    return hmac.new(signing_key, str(expires_at).encode(), hashlib.sha256).hexdigest()
+
+
+def session_cookie_value(signing_key, now=None):
+    expires_at = int(now if now is not None else time.time()) + SESSION_TTL_SECONDS
+    return f'{expires_at}.{sign(signing_key, expires_at)}'
+
+
+def verify_session(signing_key, value, now=None):
+    expires_at, _, signature = value.partition('.')
+    if not expires_at.isdigit() or int(expires_at) < (now if now is not None else time.time()):
+        return False
+    return hmac.compare_digest(signature, sign(signing_key, int(expires_at)))
+
+
+def read_cookie(headers, name):
+    for header in headers.get('cookie', []):
+        for pair in header['value'].split(';'):
+            key, _, value = pair.strip().partition('=')
+            if key == name:
+                return value
+    return None
+
+
+def check_basic_auth(headers, username, password):
+    if 'authorization' not in headers:
+        return False
+    expected = 'Basic ' + base64.b64encode(f'{username}:{password}'.encode()).decode()
+    # Constant-time comparison so the response time does not leak how much of the header matched
+    return hmac.compare_digest(headers['authorization'][0]['value'].encode(), expected.encode())
+
+
 def handler(event, context):
     request = event['Records'][0]['cf']['request']
     headers = request['headers']
     uri = request['uri']
-    
+
     # Only require auth for admin.html
     if uri != '/admin.html' and not uri.endswith('/admin.html'):
         return request
-    
-    username = ssm.get_parameter(Name='/coding-contest/admin-username')['Parameter']['Value']
-    password = ssm.get_parameter(Name='/coding-contest/admin-password')['Parameter']['Value']
-    
-    auth_string = f'{username}:{password}'
-    encoded_auth = base64.b64encode(auth_string.encode()).decode()
-    required_auth = f'Basic {encoded_auth}'
-    
-    if 'authorization' in headers:
-        if headers['authorization'][0]['value'] == required_auth:
+
+    # A valid signed cookie is verified locally; a stale cached key is fine since the cookie itself expires
+    cookie = read_cookie(headers, SESSION_COOKIE)
+    if cookie is not None:
+        signing_key = (_credentials or load_credentials())[2]
+        if verify_session(signing_key, cookie):
+            return request
+
+    username, password, signing_key, _ = load_credentials()
+    if check_basic_auth(headers, username, password):
+        querystring = request.get('querystring', '')
+        if REDIRECT_MARKER in querystring.split('&'):
             return request
-    
+        # Redirect back to the same URL so the browser stores the session cookie
+        location = f"{uri}?{querystring + '&' if querystring else ''}{REDIRECT_MARKER}"
+        return {
+            'status': '302',
+            'statusDescription': 'Found',
+            'headers': {
+                'location': [{'key': 'Location', 'value': location}],
+                'set-cookie': [{
+                    'key': 'Set-Cookie',
+                    'value': f'{SESSION_COOKIE}={session_cookie_value(signing_key)}; Max-Age={SESSION_TTL_SECONDS}; '
+                             'Path=/; Secure; HttpOnly; SameSite=Strict'
+                }],
+                'cache-control': [{'key': 'Cache-Control', 'value': 'no-store'}]
+            }
+        }
+
     return {
         'status': '401',
         'statusDescription': 'Unauthorized',
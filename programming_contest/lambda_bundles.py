@@ -0,0 +1,41 @@
+"""Per-function Lambda bundles.
+
+Every function used to ship the whole ``lambda`` directory. These helpers
+follow the imports of a handler module and exclude everything it does
+not need, so each asset only carries its own dependency closure.
+"""
+import ast
+import os
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lambda")
+
+
+def _imported_names(path):
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=path)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                yield alias.name.split(".")[0]
+        elif isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+            yield node.module.split(".")[0]
+
+
+def handler_modules(entry, lambda_dir=LAMBDA_DIR):
+    """Return the local modules (file names) reachable from ``entry``."""
+    local = {name[:-3] for name in os.listdir(lambda_dir) if name.endswith(".py")}
+    seen = set()
+    pending = [entry]
+    while pending:
+        module = pending.pop()
+        if module in seen or module not in local:
+            continue
+        seen.add(module)
+        pending.extend(_imported_names(os.path.join(lambda_dir, f"{module}.py")))
+    return sorted(f"{module}.py" for module in seen)
+
+
+def asset_excludes(entry, lambda_dir=LAMBDA_DIR):
+    """Exclude patterns for ``Code.from_asset`` that keep only ``entry``'s modules."""
+    keep = set(handler_modules(entry, lambda_dir))
+    return sorted(name for name in os.listdir(lambda_dir) if name not in keep)
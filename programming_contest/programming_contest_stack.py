@@ -2,6 +2,8 @@ from aws_cdk import (
     Stack,
     aws_lambda as _lambda,
     aws_apigateway as apigw,
+    aws_apigatewayv2 as apigwv2,
+    aws_apigatewayv2_integrations as apigwv2_integrations,
     aws_dynamodb as dynamodb,
     aws_s3 as s3,
     aws_s3_deployment as s3deploy,
@@ -10,6 +12,8 @@ from aws_cdk import (
     aws_iam as iam,
     aws_bedrockagentcore as agentcore,
     aws_ssm as ssm,
+    aws_sqs as sqs,
+    aws_lambda_event_sources as lambda_event_sources,
     Duration,
     CfnOutput,
     CfnParameter,
@@ -18,6 +22,14 @@ from aws_cdk import (
 )
 from constructs import Construct
 
+from .lambda_bundles import asset_excludes
+
+
+def lambda_code(handler_module):
+    # Ship only the modules this handler imports (smaller package, faster cold start)
+    return _lambda.Code.from_asset("lambda", exclude=asset_excludes(handler_module))
+
+
 class ProgrammingContestStack(Stack):
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
@@ -48,6 +60,22 @@ class ProgrammingContestStack(Stack):
             billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST
         )
 
+        # DynamoDB table for per-user standings (maintained by submit)
+        standings_table = dynamodb.Table(
+            self, "StandingsTable",
+            partition_key=dynamodb.Attribute(name="epoch", type=dynamodb.AttributeType.NUMBER),
+            sort_key=dynamodb.Attribute(name="username", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            stream=dynamodb.StreamViewType.NEW_IMAGE
+        )
+        # Users in ranking order per epoch, for the paginated /leaderboard and /leaderboard/me
+        standings_table.add_global_secondary_index(
+            index_name="RankIndex",
+            partition_key=dynamodb.Attribute(name="epoch", type=dynamodb.AttributeType.NUMBER),
+            sort_key=dynamodb.Attribute(name="rank_key", type=dynamodb.AttributeType.STRING),
+            projection_type=dynamodb.ProjectionType.ALL
+        )
+
         # DynamoDB table for game state
         game_state_table = dynamodb.Table(
             self, "GameStateTable",
@@ -55,6 +83,36 @@ class ProgrammingContestStack(Stack):
             billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST
         )
 
+        # DynamoDB table for judge result cache (shared across Lambda containers)
+        judge_cache_table = dynamodb.Table(
+            self, "JudgeCacheTable",
+            partition_key=dynamodb.Attribute(name="cache_key", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at"
+        )
+
+        # DynamoDB table for submission admission control (per-user token buckets and judge slot leases)
+        admission_table = dynamodb.Table(
+            self, "AdmissionTable",
+            partition_key=dynamodb.Attribute(name="admission_key", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at"
+        )
+
+        # Submitted code kept for rejudging: gzip objects keyed by content hash, indexed per problem
+        solutions_bucket = s3.Bucket(
+            self, "SolutionsBucket",
+            block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+            encryption=s3.BucketEncryption.S3_MANAGED,
+            enforce_ssl=True
+        )
+        solutions_table = dynamodb.Table(
+            self, "SolutionsTable",
+            partition_key=dynamodb.Attribute(name="problem_key", type=dynamodb.AttributeType.STRING),
+            sort_key=dynamodb.Attribute(name="attempt_key", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST
+        )
+
         # Initialize game state to false
         init_lambda = _lambda.SingletonFunction(
             self, "InitGameState",
@@ -97,52 +155,232 @@ def handler(event, context):
             block_public_access=s3.BlockPublicAccess.BLOCK_ALL
         )
 
+        # DynamoDB table for asynchronous judge jobs
+        judge_jobs_table = dynamodb.Table(
+            self, "JudgeJobsTable",
+            partition_key=dynamodb.Attribute(name="job_id", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at"
+        )
+
+        # SQS queue for asynchronous judging
+        judge_dead_letter_queue = sqs.Queue(
+            self, "JudgeDeadLetterQueue",
+            enforce_ssl=True,
+            retention_period=Duration.days(4)
+        )
+        judge_queue = sqs.Queue(
+            self, "JudgeQueue",
+            enforce_ssl=True,
+            visibility_timeout=Duration.seconds(180),
+            dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=3, queue=judge_dead_letter_queue)
+        )
+
+        # SQS queue for rejudge jobs (a job re-enqueues itself before the worker times out)
+        rejudge_dead_letter_queue = sqs.Queue(
+            self, "RejudgeDeadLetterQueue",
+            enforce_ssl=True,
+            retention_period=Duration.days(4)
+        )
+        rejudge_queue = sqs.Queue(
+            self, "RejudgeQueue",
+            enforce_ssl=True,
+            visibility_timeout=Duration.minutes(16),
+            dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=3, queue=rejudge_dead_letter_queue)
+        )
+
+        # Shared by every function that ranks the standings ("count", "icpc" or "points")
+        scoring_environment = {
+            "SCORING_RULE": "count",
+            "ICPC_PENALTY_MINUTES": "20"
+        }
+
+        judge_environment = {
+            "LEADERBOARD_TABLE": leaderboard_table.table_name,
+            "STANDINGS_TABLE": standings_table.table_name,
+            "GAME_STATE_TABLE": game_state_table.table_name,
+            "CODE_INTERPRETER_ID": code_interpreter.attr_code_interpreter_id,
+            "WEBSITE_BUCKET": website_bucket.bucket_name,
+            "SESSION_POOL_SIZE": "2",
+            "JUDGE_CACHE_TABLE": judge_cache_table.table_name,
+            "JUDGE_JOBS_TABLE": judge_jobs_table.table_name,
+            "JUDGE_QUEUE_URL": judge_queue.queue_url,
+            "ADMISSION_TABLE": admission_table.table_name,
+            # Defaults; per-contest limits are set through the game state table
+            "SUBMIT_BURST": "5",
+            "SUBMIT_REFILL_PER_MINUTE": "6",
+            "MAX_IN_FLIGHT_JUDGES": "20",
+            # Per container; halved when the Code Interpreter throttles, regrown as judges finish
+            "AGENTCORE_MAX_SESSIONS": "8",
+            "AGENTCORE_MAX_RETRIES": "3",
+            "SOLUTIONS_BUCKET": solutions_bucket.bucket_name,
+            "SOLUTIONS_TABLE": solutions_table.table_name,
+            # "1" also keeps rejected (WA/RE/TLE/OLE) code so a rejudge can turn it into a solve
+            "STORE_REJECTED_SOLUTIONS": "0",
+            # "async" にすると /submit は採点ジョブを登録して 202 を返す
+            "SUBMIT_MODE": "sync",
+            **scoring_environment
+        }
+
         # Lambda function for code submission
         submit_lambda = _lambda.Function(
             self, "SubmitFunction",
             runtime=_lambda.Runtime.PYTHON_3_11,
             handler="submit.handler",
-            code=_lambda.Code.from_asset("lambda"),
+            code=lambda_code("submit"),
             timeout=Duration.seconds(30),
+            environment=judge_environment
+        )
+
+        # Lambda function for queued judge jobs (concurrency bounded to protect the Code Interpreter)
+        judge_worker_lambda = _lambda.Function(
+            self, "JudgeWorkerFunction",
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            handler="judge_worker.handler",
+            code=lambda_code("judge_worker"),
+            timeout=Duration.seconds(30),
+            environment=judge_environment
+        )
+        judge_worker_lambda.add_event_source(lambda_event_sources.SqsEventSource(
+            judge_queue,
+            batch_size=1,
+            max_concurrency=10,
+            report_batch_item_failures=True
+        ))
+
+        # Lambda functions for rejudging a problem after its test cases were fixed
+        rejudge_environment = {
+            **judge_environment,
+            "REJUDGE_QUEUE_URL": rejudge_queue.queue_url,
+            "REJUDGE_CONCURRENCY": "4"
+        }
+        rejudge_lambda = _lambda.Function(
+            self, "RejudgeFunction",
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            handler="rejudge.handler",
+            code=lambda_code("rejudge"),
+            timeout=Duration.seconds(30),
+            environment=rejudge_environment
+        )
+        rejudge_worker_lambda = _lambda.Function(
+            self, "RejudgeWorkerFunction",
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            handler="rejudge_worker.handler",
+            code=lambda_code("rejudge_worker"),
+            timeout=Duration.minutes(15),
+            environment=rejudge_environment
+        )
+        rejudge_worker_lambda.add_event_source(lambda_event_sources.SqsEventSource(
+            rejudge_queue,
+            batch_size=1,
+            max_concurrency=2,
+            report_batch_item_failures=True
+        ))
+
+        # Lambda function for submission status
+        submissions_lambda = _lambda.Function(
+            self, "SubmissionsFunction",
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            handler="submissions.handler",
+            code=lambda_code("submissions"),
+            timeout=Duration.seconds(10),
             environment={
-                "LEADERBOARD_TABLE": leaderboard_table.table_name,
-                "GAME_STATE_TABLE": game_state_table.table_name,
-                "CODE_INTERPRETER_ID": code_interpreter.attr_code_interpreter_id,
-                "WEBSITE_BUCKET": website_bucket.bucket_name
+                "JUDGE_JOBS_TABLE": judge_jobs_table.table_name
             }
         )
         
         # Grant Code Interpreter permissions to Lambda
-        submit_lambda.add_to_role_policy(iam.PolicyStatement(
-            actions=[
-                "bedrock-agentcore:StartCodeInterpreterSession",
-                "bedrock-agentcore:InvokeCodeInterpreter",
-                "bedrock-agentcore:StopCodeInterpreterSession"
-            ],
-            resources=[code_interpreter.attr_code_interpreter_arn]
-        ))
+        for judge_lambda in (submit_lambda, judge_worker_lambda, rejudge_worker_lambda):
+            judge_lambda.add_to_role_policy(iam.PolicyStatement(
+                actions=[
+                    "bedrock-agentcore:StartCodeInterpreterSession",
+                    "bedrock-agentcore:InvokeCodeInterpreter",
+                    "bedrock-agentcore:StopCodeInterpreterSession"
+                ],
+                resources=[code_interpreter.attr_code_interpreter_arn]
+            ))
 
         # Lambda function for leaderboard
         leaderboard_lambda = _lambda.Function(
             self, "LeaderboardFunction",
             runtime=_lambda.Runtime.PYTHON_3_11,
             handler="leaderboard.handler",
-            code=_lambda.Code.from_asset("lambda"),
+            code=lambda_code("leaderboard"),
+            timeout=Duration.seconds(10),
+            environment={
+                "STANDINGS_TABLE": standings_table.table_name,
+                "GAME_STATE_TABLE": game_state_table.table_name,
+                "WEBSITE_BUCKET": website_bucket.bucket_name,
+                **scoring_environment
+            }
+        )
+
+        # Lambda function that deletes records of past epochs in the background
+        epoch_gc_lambda = _lambda.Function(
+            self, "EpochGcFunction",
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            handler="epoch_gc.handler",
+            code=lambda_code("epoch_gc"),
+            timeout=Duration.minutes(15),
+            environment={
+                "LEADERBOARD_TABLE": leaderboard_table.table_name,
+                "STANDINGS_TABLE": standings_table.table_name
+            }
+        )
+
+        # WebSocket API that pushes leaderboard deltas and game state changes to browsers
+        # (polling stays as the fallback while a browser is disconnected)
+        connections_table = dynamodb.Table(
+            self, "ConnectionsTable",
+            partition_key=dynamodb.Attribute(name="connection_id", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at"
+        )
+        websocket_lambda = _lambda.Function(
+            self, "WebSocketFunction",
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            handler="websocket.handler",
+            code=lambda_code("websocket"),
             timeout=Duration.seconds(10),
             environment={
-                "LEADERBOARD_TABLE": leaderboard_table.table_name
+                "CONNECTIONS_TABLE": connections_table.table_name
             }
         )
+        connections_table.grant_read_write_data(websocket_lambda)
+        websocket_integration = apigwv2_integrations.WebSocketLambdaIntegration(
+            "WebSocketIntegration", websocket_lambda
+        )
+        websocket_api = apigwv2.WebSocketApi(
+            self, "LiveUpdatesApi",
+            connect_route_options=apigwv2.WebSocketRouteOptions(integration=websocket_integration),
+            disconnect_route_options=apigwv2.WebSocketRouteOptions(integration=websocket_integration),
+            default_route_options=apigwv2.WebSocketRouteOptions(integration=websocket_integration)
+        )
+        websocket_stage = apigwv2.WebSocketStage(
+            self, "LiveUpdatesStage",
+            web_socket_api=websocket_api,
+            stage_name="live",
+            auto_deploy=True
+        )
+        # Functions that fan out changes with post_to_connection
+        live_updates_environment = {
+            "CONNECTIONS_TABLE": connections_table.table_name,
+            "WEBSOCKET_ENDPOINT": websocket_stage.callback_url,
+            "FANOUT_CONCURRENCY": "16"
+        }
 
-        # Lambda function for reset
+        # Lambda function for reset (bumps the epoch)
         reset_lambda = _lambda.Function(
             self, "ResetFunction",
             runtime=_lambda.Runtime.PYTHON_3_11,
             handler="reset.handler",
-            code=_lambda.Code.from_asset("lambda"),
+            code=lambda_code("reset"),
             timeout=Duration.seconds(30),
             environment={
-                "LEADERBOARD_TABLE": leaderboard_table.table_name
+                "GAME_STATE_TABLE": game_state_table.table_name,
+                "WEBSITE_BUCKET": website_bucket.bucket_name,
+                "EPOCH_GC_FUNCTION": epoch_gc_lambda.function_name,
+                **live_updates_environment
             }
         )
 
@@ -151,20 +389,73 @@ def handler(event, context):
             self, "GameStateFunction",
             runtime=_lambda.Runtime.PYTHON_3_11,
             handler="game_state.handler",
-            code=_lambda.Code.from_asset("lambda"),
-            timeout=Duration.seconds(10),
+            code=lambda_code("game_state"),
+            # A toggle is pushed to every connected browser before the response
+            timeout=Duration.seconds(30),
             environment={
-                "GAME_STATE_TABLE": game_state_table.table_name
+                "GAME_STATE_TABLE": game_state_table.table_name,
+                **live_updates_environment
             }
         )
 
+        # Lambda function that publishes leaderboard.json from the standings stream
+        leaderboard_publisher_lambda = _lambda.Function(
+            self, "LeaderboardPublisherFunction",
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            handler="leaderboard_publisher.handler",
+            code=lambda_code("leaderboard_publisher"),
+            timeout=Duration.seconds(30),
+            environment={
+                "WEBSITE_BUCKET": website_bucket.bucket_name,
+                "STANDINGS_TABLE": standings_table.table_name,
+                "GAME_STATE_TABLE": game_state_table.table_name,
+                **live_updates_environment,
+                **scoring_environment
+            }
+        )
+        leaderboard_publisher_lambda.add_event_source(lambda_event_sources.DynamoEventSource(
+            standings_table,
+            starting_position=_lambda.StartingPosition.LATEST,
+            batch_size=100,
+            max_batching_window=Duration.seconds(1),
+            parallelization_factor=1,
+            retry_attempts=3
+        ))
+
         # Grant permissions
-        leaderboard_table.grant_read_write_data(submit_lambda)
-        leaderboard_table.grant_read_data(leaderboard_lambda)
-        leaderboard_table.grant_read_write_data(reset_lambda)
-        game_state_table.grant_read_data(submit_lambda)
+        for judge_lambda in (submit_lambda, judge_worker_lambda, rejudge_worker_lambda):
+            leaderboard_table.grant_read_write_data(judge_lambda)
+            standings_table.grant_read_write_data(judge_lambda)
+            game_state_table.grant_read_data(judge_lambda)
+            judge_cache_table.grant_read_write_data(judge_lambda)
+            judge_jobs_table.grant_read_write_data(judge_lambda)
+            admission_table.grant_read_write_data(judge_lambda)
+            website_bucket.grant_read(judge_lambda)
+            solutions_bucket.grant_read_write(judge_lambda)
+            solutions_table.grant_read_write_data(judge_lambda)
+        judge_queue.grant_send_messages(submit_lambda)
+        judge_jobs_table.grant_read_write_data(rejudge_lambda)
+        game_state_table.grant_read_data(rejudge_lambda)
+        website_bucket.grant_read(rejudge_lambda)
+        for rejudge_function in (rejudge_lambda, rejudge_worker_lambda):
+            rejudge_queue.grant_send_messages(rejudge_function)
+        judge_jobs_table.grant_read_data(submissions_lambda)
+        standings_table.grant_read_data(leaderboard_lambda)
+        game_state_table.grant_read_data(leaderboard_lambda)
+        website_bucket.grant_read(leaderboard_lambda, "problems.json")
+        game_state_table.grant_read_write_data(reset_lambda)
+        website_bucket.grant_put(reset_lambda, "data/*")
+        epoch_gc_lambda.grant_invoke(reset_lambda)
+        leaderboard_table.grant_read_write_data(epoch_gc_lambda)
+        standings_table.grant_read_write_data(epoch_gc_lambda)
         game_state_table.grant_read_write_data(game_state_lambda)
-        website_bucket.grant_read(submit_lambda)
+        website_bucket.grant_read_write(leaderboard_publisher_lambda, "data/*")
+        game_state_table.grant_read_data(leaderboard_publisher_lambda)
+        standings_table.grant_read_data(leaderboard_publisher_lambda)
+        website_bucket.grant_read(leaderboard_publisher_lambda, "problems.json")
+        for live_lambda in (reset_lambda, game_state_lambda, leaderboard_publisher_lambda):
+            connections_table.grant_read_write_data(live_lambda)
+            websocket_api.grant_manage_connections(live_lambda)
 
         # API Gateway
         api = apigw.RestApi(
@@ -180,10 +471,21 @@ def handler(event, context):
         leaderboard_integration = apigw.LambdaIntegration(leaderboard_lambda)
         reset_integration = apigw.LambdaIntegration(reset_lambda)
         game_state_integration = apigw.LambdaIntegration(game_state_lambda)
+        submissions_integration = apigw.LambdaIntegration(submissions_lambda)
+        rejudge_integration = apigw.LambdaIntegration(rejudge_lambda)
         
-        api.root.add_resource("submit").add_method("POST", submit_integration)
-        api.root.add_resource("leaderboard").add_method("GET", leaderboard_integration)
+        submit_resource = api.root.add_resource("submit")
+        submit_resource.add_method("POST", submit_integration)
+        # Several problems judged in one Code Interpreter session
+        submit_resource.add_resource("batch").add_method("POST", submit_integration)
+        api.root.add_resource("submissions").add_resource("{id}").add_method("GET", submissions_integration)
+        leaderboard_resource = api.root.add_resource("leaderboard")
+        leaderboard_resource.add_method("GET", leaderboard_integration)
+        leaderboard_resource.add_resource("me").add_method("GET", leaderboard_integration)
         api.root.add_resource("reset").add_method("POST", reset_integration)
+        rejudge_resource = api.root.add_resource("rejudge")
+        rejudge_resource.add_method("GET", rejudge_integration)
+        rejudge_resource.add_method("POST", rejudge_integration)
         
         game_state_resource = api.root.add_resource("game-state")
         game_state_resource.add_method("GET", game_state_integration)
@@ -219,10 +521,22 @@ def handler(event, context):
         basic_auth_version = basic_auth_lambda.current_version
 
         # CloudFront distribution
+        website_origin = origins.S3Origin(website_bucket)
+
+        # leaderboard.json is republished on every solve, so cache it only briefly
+        leaderboard_cache_policy = cloudfront.CachePolicy(
+            self, "LeaderboardCachePolicy",
+            default_ttl=Duration.seconds(2),
+            min_ttl=Duration.seconds(0),
+            max_ttl=Duration.seconds(5),
+            enable_accept_encoding_gzip=True,
+            enable_accept_encoding_brotli=True
+        )
+
         distribution = cloudfront.Distribution(
             self, "WebsiteDistribution",
             default_behavior=cloudfront.BehaviorOptions(
-                origin=origins.S3Origin(website_bucket),
+                origin=website_origin,
                 viewer_protocol_policy=cloudfront.ViewerProtocolPolicy.REDIRECT_TO_HTTPS,
                 edge_lambdas=[
                     cloudfront.EdgeLambda(
@@ -231,11 +545,18 @@ def handler(event, context):
                     )
                 ]
             ),
+            additional_behaviors={
+                "data/*": cloudfront.BehaviorOptions(
+                    origin=website_origin,
+                    viewer_protocol_policy=cloudfront.ViewerProtocolPolicy.REDIRECT_TO_HTTPS,
+                    cache_policy=leaderboard_cache_policy
+                )
+            },
             default_root_object="index.html"
         )
 
         # Deploy website files with API config
-        config_js = f"window.API_CONFIG = {{ url: '{api.url}' }};"
+        config_js = f"window.API_CONFIG = {{ url: '{api.url}', ws: '{websocket_stage.url}' }};"
         
         s3deploy.BucketDeployment(
             self, "DeployWebsite",
@@ -245,10 +566,13 @@ def handler(event, context):
                 s3deploy.Source.data("config.js", config_js)
             ],
             destination_bucket=website_bucket,
+            # Published by LeaderboardPublisherFunction; keep it across deployments
+            exclude=["data/*"],
             distribution=distribution,
             distribution_paths=["/*"]
         )
 
         # Outputs
         CfnOutput(self, "ApiUrl", value=api.url)
+        CfnOutput(self, "WebSocketUrl", value=websocket_stage.url)
         CfnOutput(self, "WebsiteUrl", value=f"https://{distribution.distribution_domain_name}")
@@ -0,0 +1,34 @@
+# lambda/ のハンドラを bench/fakes.py の代替AWSに向けて動かす（bench/loadtest.py と同じ構成）
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, 'lambda'))
+sys.path.insert(0, os.path.join(REPO_DIR, 'bench'))
+
+import loadtest
+
+
+@pytest.fixture(scope='session')
+def aws():
+    # aws_clients はクライアントをプロセス内で使い回すので、代替AWSはテスト全体で1つだけ作る
+    aws = loadtest.setup(SimpleNamespace(
+        mode='sync', metrics_sample_rate=0.0, submit_burst=0, max_in_flight=0,
+        dynamodb_latency_ms=0, s3_latency_ms=0, agentcore_latency_ms=0, agentcore_jitter_ms=0, session_start_ms=0,
+        page_size=None, agentcore_throttle_rate=0.0, agentcore_error_rate=0.0, agentcore_session_limit=None,
+        websocket_connections=0
+    ))
+    import metrics
+    metrics.set_sink(metrics.NullSink())
+    yield aws
+    aws.code_interpreter.close()
+    aws.uninstall()
+
+
+@pytest.fixture(scope='session')
+def submit(aws):
+    import submit
+    return submit
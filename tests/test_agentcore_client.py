@@ -0,0 +1,229 @@
+import json
+import random
+
+import pytest
+from botocore.exceptions import ClientError
+
+from agentcore_client import (AgentCoreClient, AdaptiveLimit, CircuitBreaker, JudgeUnavailable,
+                              CLOSED, OPEN, HALF_OPEN, classify, THROTTLED, TRANSIENT, FAILED)
+from fakes import client_error
+from session_pool import SessionPool
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class ScriptedClient:
+    # 呼び出しごとに outcomes の先頭を使う（例外なら投げ、それ以外は応答として返す）。尽きたら成功
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    def _next(self, method, kwargs):
+        self.calls.append(method)
+        outcome = self.outcomes.pop(0) if self.outcomes else {'stream': []}
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def start_code_interpreter_session(self, **kwargs):
+        return self._next('start_code_interpreter_session', kwargs)
+
+    def invoke_code_interpreter(self, **kwargs):
+        return self._next('invoke_code_interpreter', kwargs)
+
+    def stop_code_interpreter_session(self, **kwargs):
+        return self._next('stop_code_interpreter_session', kwargs)
+
+
+def throttled():
+    return client_error('ThrottlingException', 'InvokeCodeInterpreter', 'Rate exceeded')
+
+
+def make_client(*outcomes, clock=None, **kwargs):
+    sleeps = []
+    breaker = CircuitBreaker(failure_threshold=kwargs.pop('failure_threshold', 5), cooldown_seconds=10,
+                             max_cooldown_seconds=40, clock=clock or Clock())
+    client = AgentCoreClient(ScriptedClient(*outcomes), breaker=breaker, rng=random.Random(0), sleep=sleeps.append,
+                             **kwargs)
+    return client, sleeps
+
+
+def test_classify():
+    assert classify(throttled()) == THROTTLED
+    assert classify(client_error('ServiceQuotaExceededException', 'StartCodeInterpreterSession')) == THROTTLED
+    assert classify(ClientError({'Error': {'Code': 'Whatever'}, 'ResponseMetadata': {'HTTPStatusCode': 429}},
+                                'InvokeCodeInterpreter')) == THROTTLED
+    assert classify(client_error('InternalServerException', 'InvokeCodeInterpreter')) == TRANSIENT
+    assert classify(client_error('ValidationException', 'InvokeCodeInterpreter')) == FAILED
+    assert classify(ValueError()) == FAILED
+
+
+def test_throttling_is_retried_with_growing_jittered_backoff():
+    client, sleeps = make_client(throttled(), throttled(), client_error('InternalServerException', 'x'),
+                                 max_retries=3, backoff_base_seconds=0.2, backoff_cap_seconds=0.5)
+    client.start_code_interpreter_session(codeInterpreterIdentifier='ci')
+    assert client.client.calls == ['start_code_interpreter_session'] * 4
+    assert len(sleeps) == 3
+    for attempt, seconds in enumerate(sleeps):
+        assert 0 <= seconds <= min(0.5, 0.2 * 2 ** attempt)
+    assert client.stats['retries'] == 3
+    assert client.stats['throttled'] == 2 and client.stats['transient'] == 1
+
+
+def test_exhausted_retries_become_judge_unavailable():
+    client, sleeps = make_client(*[throttled()] * 3, max_retries=2)
+    with pytest.raises(JudgeUnavailable) as raised:
+        client.invoke_code_interpreter(codeInterpreterIdentifier='ci', sessionId='s', name='executeCode',
+                                       arguments={})
+    assert raised.value.reason == 'unavailable'
+    assert raised.value.retry_after_seconds >= 1
+    assert len(client.client.calls) == 3 and len(sleeps) == 2
+
+
+def test_other_errors_are_not_retried():
+    client, sleeps = make_client(client_error('ValidationException', 'InvokeCodeInterpreter'))
+    with pytest.raises(ClientError):
+        client.start_code_interpreter_session(codeInterpreterIdentifier='ci')
+    assert len(client.client.calls) == 1 and sleeps == []
+    assert client.breaker.failures == 0
+
+
+def test_throttling_in_the_stream_is_judge_unavailable():
+    client, _ = make_client({'stream': [{'throttlingException': {'message': 'Rate exceeded'}}]})
+    response = client.invoke_code_interpreter(codeInterpreterIdentifier='ci', sessionId='s', name='executeCode',
+                                              arguments={})
+    with pytest.raises(JudgeUnavailable):
+        list(response['stream'])
+    assert client.stats['throttled'] == 1
+
+
+def test_adaptive_limit_halves_once_per_burst_and_grows_additively():
+    clock = Clock()
+    limit = AdaptiveLimit(8, min_limit=1, decrease_interval_seconds=1.0, clock=clock)
+    limit.on_throttle()
+    limit.on_throttle()
+    assert limit.limit == 4
+    clock.advance(1.5)
+    limit.on_throttle()
+    assert limit.limit == 2
+    for _ in range(5):
+        clock.advance(2)
+        limit.on_throttle()
+    assert limit.limit == 1
+    # 1回の成功で 1/上限 ずつ増える（上限の数だけ成功するとおよそ 1 増える）
+    limit.on_success()
+    assert limit.limit == 2
+    limit.on_success()
+    limit.on_success()
+    assert limit.limit == pytest.approx(2 + 1 / 2 + 1 / 2.5)
+    for _ in range(100):
+        limit.on_success()
+    assert limit.limit == 8
+
+
+def test_adaptive_limit_bounds_concurrent_slots():
+    limit = AdaptiveLimit(2)
+    assert limit.acquire(0) and limit.acquire(0)
+    assert not limit.acquire(0.01)
+    limit.release()
+    assert limit.acquire(0)
+
+
+def test_session_slot_throttling_lowers_the_limit_and_success_raises_it():
+    client, _ = make_client(throttled(), max_sessions=8)
+    with client.session_slot():
+        client.start_code_interpreter_session(codeInterpreterIdentifier='ci')
+    assert client.limit.limit == pytest.approx(4 + 1 / 4)
+    assert client.limit.in_use == 0
+
+
+def test_breaker_opens_after_consecutive_failures_and_rejects_without_calling():
+    clock = Clock()
+    client, _ = make_client(*[throttled()] * 3, clock=clock, failure_threshold=3, max_retries=5)
+    with pytest.raises(JudgeUnavailable) as raised:
+        client.start_code_interpreter_session(codeInterpreterIdentifier='ci')
+    assert client.breaker.state == OPEN
+    assert client.stats['circuit_opened'] == 1
+    # 3回目の失敗で回路が開き、4回目は呼ばずに拒否する
+    assert len(client.client.calls) == 3
+    assert raised.value.retry_after_seconds == 10
+    with pytest.raises(JudgeUnavailable):
+        with client.session_slot():
+            pass
+    assert len(client.client.calls) == 3
+
+
+def test_breaker_half_open_probe_closes_or_reopens_with_longer_cooldown():
+    clock = Clock()
+    breaker = CircuitBreaker(failure_threshold=2, cooldown_seconds=10, max_cooldown_seconds=15, clock=clock)
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    assert breaker.record_failure()
+    assert breaker.state == OPEN
+
+    clock.advance(10)
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+    # 試しの呼び出しが終わるまで、他の呼び出しは通さない
+    with pytest.raises(JudgeUnavailable):
+        breaker.before_call()
+    assert breaker.record_failure()
+    assert breaker.state == OPEN and breaker.cooldown_seconds == 15
+    with pytest.raises(JudgeUnavailable):
+        breaker.before_call()
+
+    clock.advance(15)
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.cooldown_seconds == 10 and breaker.failures == 0
+    breaker.before_call()
+    breaker.before_call()
+
+
+def test_breaker_probe_with_an_unrelated_error_lets_the_next_probe_through():
+    clock = Clock()
+    breaker = CircuitBreaker(failure_threshold=1, cooldown_seconds=5, clock=clock)
+    breaker.record_failure()
+    clock.advance(5)
+    breaker.before_call()
+    breaker.record_other()
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+
+
+def test_submit_returns_503_with_retry_after_when_the_judge_is_unavailable(aws, submit, monkeypatch):
+    import contest_config
+    contest_config.bump_version(aws.tables['GameStateTable'], True)
+    submit.contest_config.invalidate()
+    client, _ = make_client(*[throttled()] * 10, max_retries=1)
+    monkeypatch.setattr(submit, 'bedrock_agentcore', client)
+    monkeypatch.setattr(submit.session_pool, 'client', client)
+    monkeypatch.setattr(submit.session_pool, '_idle', [])
+    response = submit.handler({'body': json.dumps({
+        'username': 'unavailable-user', 'problem_number': 1,
+        'code': "def solver(s):\n    return 'judge is down'\n"
+    })}, None)
+    assert response['statusCode'] == 503
+    body = json.loads(response['body'])
+    assert body['reason'] == 'unavailable'
+    assert response['headers']['Retry-After'] == str(body['retry_after'])
+    assert int(response['headers']['Retry-After']) >= 1
+    assert 'Retry-After' in response['headers']['Access-Control-Expose-Headers']
+
+
+def test_session_that_fails_its_first_health_check_is_stopped():
+    client = ScriptedClient({'sessionId': 's-1'}, {'stream': []})
+    pool = SessionPool(client, 'interpreter')
+    with pytest.raises(RuntimeError):
+        pool.acquire()
+    assert client.calls == ['start_code_interpreter_session', 'invoke_code_interpreter',
+                            'stop_code_interpreter_session']
@@ -0,0 +1,50 @@
+import json
+
+import contest_config
+
+
+def parse(**settings):
+    return contest_config.parse_problems(json.dumps({'1': {'test_cases': [['()', '1']], **settings}}))[1]
+
+
+def test_test_set_version_follows_the_test_cases():
+    assert parse()['test_set_version'] == parse()['test_set_version']
+    assert parse()['test_set_version'] != contest_config.parse_problems(
+        json.dumps({'1': {'test_cases': [['()', '2']]}}))[1]['test_set_version']
+
+
+def test_test_set_version_follows_the_time_limit():
+    assert parse(time_limit_seconds=1)['test_set_version'] != parse(time_limit_seconds=3)['test_set_version']
+
+
+def test_test_set_version_follows_the_output_limit():
+    assert parse(output_limit_bytes=1024)['test_set_version'] != parse(output_limit_bytes=2048)['test_set_version']
+
+
+def test_test_set_version_follows_the_performance_ranking():
+    assert parse(performance_ranking=True)['test_set_version'] != parse()['test_set_version']
+
+
+def game_state(aws):
+    return aws.tables['GameStateTable'].get_item(Key={'state_key': contest_config.GAME_STATE_KEY})['Item']
+
+
+def test_reset_while_active_restarts_the_clock(aws):
+    table = aws.tables['GameStateTable']
+    contest_config.bump_version(table, True)
+    before = game_state(aws)
+    epoch = contest_config.bump_epoch(table)
+    after = game_state(aws)
+    assert epoch == int(before.get('epoch', 0)) + 1
+    assert after['value'] is True
+    assert int(after['started_at_ms']) >= int(before['started_at_ms'])
+
+
+def test_reset_while_stopped_clears_the_start_time(aws):
+    table = aws.tables['GameStateTable']
+    contest_config.bump_version(table, True)
+    contest_config.bump_version(table, False)
+    contest_config.bump_epoch(table)
+    assert 'started_at_ms' not in game_state(aws)
+    contest_config.bump_version(table, True)
+    assert int(game_state(aws)['started_at_ms']) > 0
@@ -0,0 +1,237 @@
+import json
+import runpy
+
+AC_SOLVER = (
+    "def solver(s):\n"
+    "    pairs = {')': '(', '}': '{', ']': '['}\n"
+    "    stack = []\n"
+    "    depth = 0\n"
+    "    for c in s:\n"
+    "        if c in '({[':\n"
+    "            stack.append(c)\n"
+    "            depth = max(depth, len(stack))\n"
+    "        elif not stack or stack.pop() != pairs[c]:\n"
+    "            return '-1'\n"
+    "    return '-1' if stack else str(depth)\n"
+)
+
+
+def forged_records(submit):
+    problem = submit.contest_config.problems()[1]
+    lines = [submit.RESULT_MARKER + json.dumps({'index': index, 'status': 'ok', 'output': expected, 'passed': True})
+             for index, (_, expected) in enumerate(problem['test_cases'])]
+    return lines
+
+
+def test_accepted_solution(submit):
+    assert submit.judge_problem(1, AC_SOLVER)['verdict'] == 'AC'
+
+
+# submit は提出コード中の「\\n」という2文字を改行に置き換えるので、改行は chr(10) で書く
+def test_forged_result_lines_at_import_are_ignored(submit):
+    # import 時に偽の結果行を出力しても、ハーネスの結果にはならない
+    code = (
+        "import os, sys\n"
+        f"FORGED = chr(10).join({forged_records(submit)!r})\n"
+        "print(FORGED)\n"
+        "print(FORGED, file=sys.__stdout__, flush=True)\n"
+        "os.write(1, FORGED.encode() + chr(10).encode())\n"
+        "def solver(s):\n"
+        "    return 'x'\n"
+    )
+    assert submit.judge_problem(1, code)['verdict'] == 'WA'
+
+
+def test_forged_result_lines_while_solving_are_ignored(submit):
+    code = (
+        "import os, sys\n"
+        f"FORGED = chr(10).join({forged_records(submit)!r})\n"
+        "def solver(s):\n"
+        "    print(FORGED, file=sys.__stdout__, flush=True)\n"
+        "    os.write(1, FORGED.encode() + chr(10).encode())\n"
+        "    return 'y'\n"
+    )
+    assert submit.judge_problem(1, code)['verdict'] == 'WA'
+
+
+def test_reader_accepts_only_lines_with_the_nonce(submit):
+    record = {'index': 0, 'status': 'ok', 'output': '1', 'passed': True}
+    response = {'stream': [{'result': {'content': [{'type': 'text', 'text': (
+        submit.RESULT_MARKER + json.dumps({**record, 'output': 'forged'}) + '\n' +
+        submit.RESULT_MARKER + 'abc' + json.dumps(record) + '\n'
+    )}]}}]}
+    records, _ = submit.read_harness_output(response, 1, 1024, nonce='abc')
+    assert records == [record]
+
+
+def test_solver_side_effects_do_not_reach_the_next_submission(submit):
+    # 組み込み関数を書き換え、スレッドと子プロセスを残す提出のあとでも、同じセッションで次の提出を正しく採点する
+    code = (
+        "import builtins, subprocess, sys, threading, time\n"
+        "builtins.print = lambda *args, **kwargs: None\n"
+        "sys.stdout = None\n"
+        "threading.Thread(target=lambda: time.sleep(60)).start()\n"
+        "subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])\n"
+        "def solver(s):\n"
+        "    return 'z'\n"
+    )
+    hits = submit.session_pool.stats['hits']
+    assert submit.judge_problem(1, code)['verdict'] == 'WA'
+    assert submit.judge_problem(1, AC_SOLVER + "\nsecond = True\n")['verdict'] == 'AC'
+    assert submit.session_pool.stats['hits'] > hits
+
+
+def test_process_that_leaves_its_group_does_not_reach_the_next_submission(submit):
+    # 二重 fork と setsid でプロセスグループを抜け、次の提出のコードを一時ディレクトリに写し続けるプロセスを残す
+    code = (
+        "import os, shutil, tempfile, time\n"
+        "if os.fork() == 0:\n"
+        "    os.setsid()\n"
+        "    if os.fork() == 0:\n"
+        "        while True:\n"
+        "            try:\n"
+        "                shutil.copy('solver.py', os.path.join(tempfile.gettempdir(), 'stolen.py'))\n"
+        "            except OSError:\n"
+        "                pass\n"
+        "            time.sleep(0.01)\n"
+        "    os._exit(0)\n"
+        "def solver(s):\n"
+        "    return 'z'\n"
+    )
+    probe = (
+        "import os, tempfile, time\n"
+        "time.sleep(0.2)\n"
+        "if os.path.exists(os.path.join(tempfile.gettempdir(), 'stolen.py')):\n"
+        "    solver = lambda s: 'stolen'\n"
+    )
+    hits = submit.session_pool.stats['hits']
+    assert submit.judge_problem(1, code)['verdict'] == 'WA'
+    assert submit.judge_problem(1, AC_SOLVER + probe)['verdict'] == 'AC'
+    assert submit.session_pool.stats['hits'] > hits
+
+
+def test_missing_harness_output_is_an_internal_error(submit):
+    verdict = submit.build_verdict([None], ['1'])
+    assert verdict['verdict'] == 'IE'
+    assert not submit.is_cacheable(verdict)
+    assert not submit.is_penalized(verdict)
+
+
+SWALLOW_TIME_LIMIT = (
+    "def solver(s):\n"
+    "    while True:\n"
+    "        try:\n"
+    "            while True:\n"
+    "                pass\n"
+    "        except BaseException:\n"
+    "            pass\n"
+)
+
+
+def quick_problem(submit, **overrides):
+    return {**submit.contest_config.problems()[1], 'time_limit_seconds': 0.3, **overrides}
+
+
+def test_solver_that_swallows_the_time_limit_is_stopped(submit):
+    verdict, cacheable = submit.judge(quick_problem(submit), SWALLOW_TIME_LIMIT)
+    assert verdict['verdict'] == 'TLE'
+    assert not cacheable
+
+
+def test_answer_returned_after_the_time_limit_is_tle(submit):
+    code = (
+        "import time\n"
+        + AC_SOLVER.replace("def solver(s):\n", "def solved(s):\n") +
+        "def solver(s):\n"
+        "    deadline = time.perf_counter() + 0.5\n"
+        "    while time.perf_counter() < deadline:\n"
+        "        try:\n"
+        "            time.sleep(0.01)\n"
+        "        except BaseException:\n"
+        "            pass\n"
+        "    return solved(s)\n"
+    )
+    verdict, _ = submit.judge(quick_problem(submit), code)
+    assert verdict['verdict'] == 'TLE'
+
+
+def test_import_that_never_finishes_is_tle(submit, monkeypatch):
+    import judge_harness
+    monkeypatch.setattr(submit, 'HARNESS_CODE', submit.HARNESS_CODE.replace(
+        f'IMPORT_TIME_LIMIT_SECONDS = {judge_harness.IMPORT_TIME_LIMIT_SECONDS}', 'IMPORT_TIME_LIMIT_SECONDS = 0.5'))
+    code = "while True:\n    pass\ndef solver(s):\n    return s\n"
+    verdict, cacheable = submit.judge(quick_problem(submit), code)
+    assert verdict['verdict'] == 'TLE'
+    assert not cacheable
+
+
+def test_cases_after_a_timeout_run_in_a_new_process(submit, tmp_path, monkeypatch, capsys):
+    # fail-fast でなければ、制限時間を超えて止めたケースのあとも残りのケースを採点する
+    (tmp_path / 'judge_harness.py').write_text(submit.HARNESS_CODE, encoding='utf-8')
+    (tmp_path / 'solver.py').write_text(
+        "def solver(s):\n"
+        "    while s == 'slow':\n"
+        "        try:\n"
+        "            while True:\n"
+        "                pass\n"
+        "        except BaseException:\n"
+        "            pass\n"
+        "    return s.upper()\n", encoding='utf-8')
+    (tmp_path / 'judge_input.json').write_text(submit.harness_input(
+        ['a', 'slow', 'b'], ['A', 'SLOW', 'B'], False, 0.3, 1024, nonce='n'), encoding='utf-8')
+    monkeypatch.chdir(tmp_path)
+    runpy.run_path('judge_harness.py')['main']()
+    records = [json.loads(line[len(submit.RESULT_MARKER + 'n'):]) for line in capsys.readouterr().out.splitlines()]
+    assert [(r['status'], r['passed']) for r in records] == [('ok', True), ('timeout', False), ('ok', True)]
+
+
+# 1回の呼び出しで CPU を約 30ms 使い、8MB を確保する AC の提出
+HEAVY_SOLVER = (
+    "import time\n"
+    + AC_SOLVER.replace("def solver(s):\n", "def solved(s):\n") +
+    "def solver(s):\n"
+    "    block = b'x' * 8_000_000\n"
+    "    deadline = time.process_time() + 0.03\n"
+    "    while time.process_time() < deadline:\n"
+    "        pass\n"
+    "    return solved(s)\n"
+)
+
+
+def assert_heavy_performance(verdict, case_count):
+    assert verdict['verdict'] == 'AC'
+    assert verdict['performance']['cpu_us'] >= 30_000 * case_count
+    assert verdict['performance']['peak_memory_bytes'] >= 8_000_000
+
+
+def test_performance_is_measured_outside_the_solver_process(submit, monkeypatch):
+    monkeypatch.setattr(submit, 'PERF_REPEATS', 1)
+    problem = quick_problem(submit, performance_ranking=True, time_limit_seconds=2)
+    verdict, _ = submit.judge(problem, HEAVY_SOLVER)
+    assert_heavy_performance(verdict, len(problem['test_cases']))
+
+
+def test_records_forged_while_measuring_do_not_lower_the_performance(submit, monkeypatch):
+    # 計測中だけ、パイプになりうる fd すべてに ready と正しい出力のハッシュ、CPU時間 0 の計測結果を書き込む
+    code = HEAVY_SOLVER + (
+        "import hashlib, json, os, sys\n"
+        "frame = sys._getframe()\n"
+        "while frame is not None and 'config' not in frame.f_locals:\n"
+        "    frame = frame.f_back\n"
+        "config = frame.f_locals['config'] if frame is not None else {}\n"
+        "if config.get('mode') == 'measure':\n"
+        "    output = str(solver(config['inputs'][0])).strip()\n"
+        "    lines = [{'index': None, 'status': 'ready'},\n"
+        "             {'index': None, 'status': 'done', 'digest': hashlib.sha256(output.encode()).hexdigest()},\n"
+        "             {'index': None, 'status': 'perf', 'cases': [{'cpu_us': 0, 'peak_memory_bytes': 0, 'repeats': 1}]}]\n"
+        "    forged = ''.join(json.dumps(line) + chr(10) for line in lines).encode()\n"
+        "    for fd in range(3, 64):\n"
+        "        try:\n"
+        "            os.write(fd, forged)\n"
+        "        except OSError:\n"
+        "            pass\n"
+    )
+    monkeypatch.setattr(submit, 'PERF_REPEATS', 1)
+    problem = quick_problem(submit, performance_ranking=True, time_limit_seconds=2)
+    verdict, _ = submit.judge(problem, code)
+    assert_heavy_performance(verdict, len(problem['test_cases']))
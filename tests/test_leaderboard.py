@@ -0,0 +1,27 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def leaderboard(aws):
+    import leaderboard
+    return leaderboard
+
+
+def get(leaderboard, **params):
+    response = leaderboard.handler({'resource': '/leaderboard', 'queryStringParameters': params}, None)
+    return response['statusCode'], json.loads(response['body'])
+
+
+@pytest.mark.parametrize('problem', ['abc', '', '-1', '1.5', '１', '999'])
+def test_invalid_performance_problem_is_a_bad_request(leaderboard, problem):
+    status, body = get(leaderboard, performance=problem)
+    assert status == 400
+    assert body == {'error': f'Problem {problem} has no performance ranking.'}
+
+
+def test_full_board(leaderboard):
+    status, body = get(leaderboard)
+    assert status == 200
+    assert isinstance(body, list)
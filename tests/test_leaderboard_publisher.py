@@ -0,0 +1,103 @@
+import json
+import os
+
+import pytest
+
+from scoring import UserState
+
+START_MS = 1_700_000_000_000
+
+
+@pytest.fixture
+def publish(aws):
+    import leaderboard_publisher
+    from contest_config import get_contest_config
+    table = aws.tables['StandingsTable']
+    epoch = get_contest_config().current_epoch()
+    rules = get_contest_config().scoring_rules()
+    for item in table.query(KeyConditionExpression='#e = :e', ExpressionAttributeNames={'#e': 'epoch'},
+                            ExpressionAttributeValues={':e': epoch})['Items']:
+        table.delete_item(Key={'epoch': epoch, 'username': item['username']})
+    table.drain_stream()
+    leaderboard_publisher.publisher = None
+
+    def put(username, solved=(), wrong=()):
+        state = UserState(username)
+        for number, minutes in solved:
+            state.solve(number, START_MS + minutes * 60 * 1000)
+        for number in wrong:
+            state.add_wrong_attempt(number)
+        table.put_item(Item={'epoch': epoch, 'username': username, 'solved_mask': state.solved_mask,
+                             'solve_times': state.solve_times, 'wrong_attempts': state.wrong_attempts,
+                             'rank_key': rules.rank_key(state)})
+
+    def remove(username):
+        table.delete_item(Key={'epoch': epoch, 'username': username})
+
+    def flush():
+        # DynamoDB Streams の代わりに、StandingsTable に溜まった変更のレコードを渡す
+        records = table.drain_stream()
+        result = leaderboard_publisher.handler({'Records': records}, None)
+        stored = aws.s3.objects[(os.environ['WEBSITE_BUCKET'], leaderboard_publisher.LEADERBOARD_KEY)]
+        assert stored['ContentType'] == 'application/json'
+        assert stored['CacheControl'] == leaderboard_publisher.CACHE_CONTROL
+        assert stored['metadata'] == {'epoch': str(epoch)}
+        rows = json.loads(stored['body'])
+        assert result == {'published': len(rows)}
+        return rows
+
+    yield put, remove, flush
+
+
+def test_publishes_the_ranked_board(publish):
+    put, _, flush = publish
+    put('alice', solved=[(1, 10), (2, 30)])
+    put('bob', solved=[(1, 5)])
+    put('carol')
+    rows = flush()
+    assert [(row['rank'], row['username'], row['solved_count']) for row in rows] == [
+        (1, 'alice', 2), (2, 'bob', 1), (3, 'carol', 0)]
+    assert rows[0]['problem1_time'] is not None and rows[0]['problem3_time'] is None
+    assert rows[2]['latest_time'] is None
+
+
+def test_applies_later_changes_to_the_kept_board(publish):
+    put, remove, flush = publish
+    put('alice', solved=[(1, 10)])
+    put('bob')
+    flush()
+    put('bob', solved=[(1, 5), (2, 6)])
+    remove('alice')
+    put('dave', solved=[(3, 1)])
+    rows = flush()
+    assert [(row['rank'], row['username']) for row in rows] == [(1, 'bob'), (2, 'dave')]
+
+
+def test_ignores_records_of_other_epochs(publish, aws):
+    put, _, flush = publish
+    put('alice', solved=[(1, 10)])
+    flush()
+    from contest_config import get_contest_config
+    aws.tables['StandingsTable'].put_item(Item={
+        'epoch': get_contest_config().current_epoch() - 1, 'username': 'mallory', 'solved_mask': 7,
+        'solve_times': [START_MS] * 3, 'wrong_attempts': []})
+    assert [row['username'] for row in flush()] == ['alice']
+
+
+def test_container_that_missed_batches_does_not_publish_a_stale_board(publish):
+    # ウォームなコンテナが2つあり、バッチを交互に処理する
+    import leaderboard_publisher
+    put, _, flush = publish
+    put('alice', solved=[(1, 10)])
+    flush()
+    first, leaderboard_publisher.publisher = leaderboard_publisher.publisher, None
+    put('bob', solved=[(1, 5), (2, 6)])
+    flush()
+    second, leaderboard_publisher.publisher = leaderboard_publisher.publisher, first
+    put('carol')
+    assert [row['username'] for row in flush()] == ['bob', 'alice', 'carol']
+    leaderboard_publisher.publisher = second
+    put('alice', solved=[(1, 10), (2, 20), (3, 30)])
+    assert [row['username'] for row in flush()] == ['alice', 'bob', 'carol']
+    put('dave')
+    assert [row['username'] for row in flush()] == ['alice', 'bob', 'carol', 'dave']
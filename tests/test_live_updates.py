@@ -0,0 +1,193 @@
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+
+import pytest
+from botocore.exceptions import ClientError
+
+import live_updates
+from fakes import client_error
+from leaderboard_publisher import LeaderboardPublisher
+from live_updates import Broadcaster, ConnectionManager, ConnectionStore
+from scoring import UserState, ScoringRules, RankedBoard, RULE_ICPC
+from standings import build_rows
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+START_MS = 1_700_000_000_000
+
+
+class StubManagementApi:
+    # apigatewaymanagementapi の post_to_connection。gone の接続は GoneException、failing の接続はそれ以外のエラー
+    def __init__(self, gone=(), failing=()):
+        self.gone = set(gone)
+        self.failing = set(failing)
+        self.posted = {}
+
+    def post_to_connection(self, ConnectionId, Data):
+        if ConnectionId in self.gone:
+            raise client_error('GoneException', 'PostToConnection')
+        if ConnectionId in self.failing:
+            raise client_error('InternalServerException', 'PostToConnection')
+        self.posted.setdefault(ConnectionId, []).append(json.loads(Data))
+        return {}
+
+
+@pytest.fixture
+def connections(aws):
+    table = aws.tables['ConnectionsTable']
+    for item in table.scan()['Items']:
+        table.delete_item(Key={'connection_id': item['connection_id']})
+    return ConnectionStore(table)
+
+
+def connected(store):
+    return sorted(connection_id for page in store.pages() for connection_id in page)
+
+
+def test_broadcast_prunes_gone_connections_and_keeps_failed_ones(connections):
+    for i in range(6):
+        connections.add(f'conn-{i}')
+    api = StubManagementApi(gone={'conn-1', 'conn-4'}, failing={'conn-2'})
+    message = live_updates.game_state_message(True)
+    counts = Broadcaster(connections, ConnectionManager(api), concurrency=3).broadcast(message)
+    assert counts == {'sent': 3, 'gone': 2, 'failed': 1}
+    assert connected(connections) == ['conn-0', 'conn-2', 'conn-3', 'conn-5']
+    assert api.posted == {f'conn-{i}': [message] for i in (0, 3, 5)}
+
+
+def test_connections_are_scanned_page_by_page(connections, monkeypatch):
+    monkeypatch.setattr(live_updates, 'SCAN_PAGE_SIZE', 3)
+    for i in range(7):
+        connections.add(f'conn-{i}')
+    pages = list(connections.pages())
+    assert [len(page) for page in pages] == [3, 3, 1]
+    api = StubManagementApi()
+    assert Broadcaster(connections, ConnectionManager(api)).broadcast({'type': 'ping'})['sent'] == 7
+
+
+def test_connection_items_expire():
+    items = []
+
+    class Table:
+        def put_item(self, Item):
+            items.append(Item)
+
+    ConnectionStore(Table()).add('conn-0')
+    assert items[0]['expires_at'] - items[0]['connected_at'] == live_updates.CONNECTION_TTL_SECONDS
+
+
+def test_errors_other_than_gone_are_raised_by_the_manager():
+    manager = ConnectionManager(StubManagementApi(failing={'conn-0'}))
+    with pytest.raises(ClientError):
+        manager.post('conn-0', b'{}')
+    assert not ConnectionManager(StubManagementApi(gone={'conn-0'})).post('conn-0', b'{}')
+
+
+def test_oversized_leaderboard_delta_becomes_a_refresh(connections):
+    connections.add('conn-0')
+    api = StubManagementApi()
+    rows = [{'rank': i, 'username': 'x' * 1000} for i in range(1, 200)]
+    Broadcaster(connections, ConnectionManager(api)).broadcast(
+        {'type': 'leaderboard', 'epoch': 3, 'rows': rows, 'removed': [], 'total': 199})
+    assert api.posted['conn-0'] == [{'type': 'leaderboard', 'epoch': 3, 'refresh': True}]
+
+
+def test_websocket_routes_add_and_remove_connections(connections):
+    import websocket
+    assert websocket.handler({'requestContext': {'routeKey': '$connect', 'connectionId': 'ws-1'}}, None) == \
+        {'statusCode': 200}
+    assert connected(connections) == ['ws-1']
+    websocket.handler({'requestContext': {'routeKey': '$default', 'connectionId': 'ws-1'}}, None)
+    assert connected(connections) == ['ws-1']
+    websocket.handler({'requestContext': {'routeKey': '$disconnect', 'connectionId': 'ws-1'}}, None)
+    assert connected(connections) == []
+
+
+def publisher_with(rules, states, epoch=7):
+    publisher = LeaderboardPublisher(None, None)
+    publisher.board = RankedBoard(rules)
+    publisher.epoch = epoch
+    for state in states:
+        publisher.board.upsert(state)
+    return publisher
+
+
+def user(username, solved=(), wrong=()):
+    state = UserState(username)
+    for number in wrong:
+        state.add_wrong_attempt(number)
+    for number, minutes in solved:
+        state.solve(number, START_MS + minutes * 60 * 1000)
+    return state
+
+
+def test_delta_payload_has_changed_rows_removed_users_and_total():
+    rules = ScoringRules([1, 2], RULE_ICPC, started_at_ms=START_MS)
+    publisher = publisher_with(rules, [user('alice', solved=[(1, 5)]), user('bob'), user('carol', solved=[(1, 9)])])
+    publisher.board.upsert(user('bob', solved=[(1, 1), (2, 2)]))
+    publisher.board.remove('carol')
+    delta = publisher.delta({'bob', 'carol'})
+    assert delta['type'] == 'leaderboard' and delta['epoch'] == 7
+    assert [(row['rank'], row['username'], row['solved_count']) for row in delta['rows']] == [(1, 'bob', 2)]
+    assert delta['removed'] == ['carol']
+    assert delta['total'] == 2
+    assert publisher.delta(None) == {'type': 'leaderboard', 'epoch': 7, 'refresh': True}
+
+
+def test_epoch_or_rule_change_is_a_refresh(aws):
+    rules = ScoringRules([1, 2], RULE_ICPC, started_at_ms=START_MS)
+    publisher = publisher_with(rules, [user('alice')])
+    publisher.standings_table = aws.tables['StandingsTable']
+    assert publisher.apply_records([], 8, rules) is None
+    assert publisher.apply_records([], 8, ScoringRules([1, 2], RULE_ICPC, started_at_ms=START_MS)) is None
+    assert publisher.apply_records([], 8, publisher.board.rules) == set()
+
+
+def js_function(name):
+    with open(os.path.join(REPO_DIR, 'website', 'components.js'), encoding='utf-8') as f:
+        source = f.read()
+    match = re.search(rf'^function {name}\(.*?^}}$', source, re.S | re.M)
+    assert match is not None
+    return match.group(0)
+
+
+def test_browser_applies_deltas_to_the_same_board_the_server_publishes():
+    # components.js の applyLeaderboardDelta を node で動かし、差分を当てはめた表が公開される全体の表と一致するか
+    if shutil.which('node') is None:
+        pytest.skip('node is not installed')
+    rules = ScoringRules([1, 2, 3], RULE_ICPC, started_at_ms=START_MS)
+    rng = random.Random(0)
+    states = {f'user{i:02d}': user(f'user{i:02d}') for i in range(20)}
+    publisher = publisher_with(rules, states.values())
+    steps = []
+    for _ in range(200):
+        before = build_rows(publisher.board.states(), rules)
+        changed = set()
+        for _ in range(rng.randint(1, 4)):
+            username = f'user{rng.randint(0, 29):02d}'
+            changed.add(username)
+            if rng.random() < 0.1:
+                publisher.board.remove(username)
+                continue
+            state = publisher.board.get(username) or UserState(username)
+            state = UserState(username, state.solved_mask, state.solve_times, state.wrong_attempts)
+            number = rng.randint(1, 3)
+            if rng.random() < 0.5:
+                state.solve(number, START_MS + rng.randint(0, 300) * 60 * 1000)
+            else:
+                state.add_wrong_attempt(number)
+            publisher.board.upsert(state)
+        steps.append({'current': before, 'message': publisher.delta(changed),
+                      'expected': build_rows(publisher.board.states(), rules)})
+    script = js_function('applyLeaderboardDelta') + """
+const steps = JSON.parse(require('fs').readFileSync(0, 'utf-8'));
+process.stdout.write(JSON.stringify(steps.map(step => applyLeaderboardDelta(step.current, step.message))));
+"""
+    result = subprocess.run(['node', '-e', script], input=json.dumps(steps), capture_output=True, text=True,
+                            check=True)
+    applied = json.loads(result.stdout)
+    for step, rows in zip(steps, applied):
+        assert rows == step['expected']
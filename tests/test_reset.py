@@ -0,0 +1,23 @@
+import json
+from types import SimpleNamespace
+
+from fakes import client_error
+
+
+def test_reset_succeeds_even_if_epoch_gc_cannot_be_scheduled(aws, monkeypatch):
+    import reset
+
+    def fail(**kwargs):
+        raise client_error('TooManyRequestsException', 'Invoke', 'Rate exceeded')
+
+    epoch = reset.contest_config.current_epoch()
+    monkeypatch.setattr(reset, 'lambda_client', SimpleNamespace(invoke=fail))
+    response = reset.handler({}, None)
+    assert response['statusCode'] == 200
+    body = json.loads(response['body'])
+    assert body['epoch'] > epoch
+    assert body['gc_scheduled'] is False
+
+    monkeypatch.undo()
+    body = json.loads(reset.handler({}, None)['body'])
+    assert body['gc_scheduled'] is True
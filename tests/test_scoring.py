@@ -0,0 +1,149 @@
+import random
+
+import pytest
+
+from scoring import UserState, ScoringRules, RankedBoard, RULE_COUNT, RULE_ICPC, RULE_POINTS
+
+START_MS = 1_700_000_000_000
+MINUTE_MS = 60 * 1000
+
+
+def user(username, solved=(), wrong=()):
+    # solved は (問題番号, 開始からの分) の組
+    state = UserState(username)
+    for number in wrong:
+        state.add_wrong_attempt(number)
+    for number, minutes in solved:
+        state.solve(number, START_MS + minutes * MINUTE_MS)
+    return state
+
+
+def ranked(rules, states):
+    return [state.username for state in sorted(states, key=rules.rank_key)]
+
+
+def test_solved_problems_are_a_bitmask_and_an_array_of_times():
+    state = user('alice', solved=[(3, 2), (1, 5)])
+    assert state.solved_mask == 0b101
+    assert state.solve_times == [START_MS + 5 * MINUTE_MS, 0, START_MS + 2 * MINUTE_MS]
+    assert state.is_solved(1) and not state.is_solved(2) and state.is_solved(3)
+    assert state.solve_time(2) is None
+    assert state.solve_time(3) == START_MS + 2 * MINUTE_MS
+
+
+def test_solving_again_or_failing_after_a_solve_changes_nothing():
+    state = user('alice', solved=[(2, 1)])
+    assert not state.solve(2, START_MS + 9 * MINUTE_MS)
+    assert not state.add_wrong_attempt(2)
+    assert state.solve_time(2) == START_MS + MINUTE_MS
+    assert state.wrong_attempts == []
+
+
+def test_state_round_trips_through_a_standings_item():
+    state = user('alice', solved=[(2, 1)], wrong=[1, 1, 3])
+    item = {'username': 'alice', 'solved_mask': state.solved_mask, 'solve_times': state.solve_times,
+            'wrong_attempts': state.wrong_attempts}
+    restored = UserState.from_item(item)
+    assert (restored.solved_mask, restored.solve_times, restored.wrong_attempts) == (0b10, state.solve_times, [2, 0, 1])
+
+
+def test_count_rule_orders_by_solved_count_then_last_solve_then_name():
+    rules = ScoringRules([1, 2, 3], RULE_COUNT, started_at_ms=START_MS)
+    states = [
+        user('dave'),
+        user('carol', solved=[(1, 3)]),
+        user('bob', solved=[(1, 50), (2, 60)]),
+        user('alice', solved=[(1, 10), (2, 60)]),
+        user('erin', solved=[(3, 1), (1, 2), (2, 40)]),
+        user('aaron'),
+    ]
+    # bob と alice は最終正解時刻まで同じなのでユーザー名順、未正解のユーザーは最後
+    assert ranked(rules, states) == ['erin', 'alice', 'bob', 'carol', 'aaron', 'dave']
+
+
+def test_icpc_penalty_counts_wrong_attempts_only_on_solved_problems():
+    rules = ScoringRules([1, 2, 3], RULE_ICPC, penalty_minutes=20, started_at_ms=START_MS)
+    state = user('alice', solved=[(1, 10), (2, 30)], wrong=[1, 1, 3, 3, 3])
+    score = rules.score(state)
+    assert score['solved_count'] == 2
+    # 10分 + 30分 + 問題1の誤答2回 × 20分（未正解の問題3の誤答は数えない）
+    assert score['penalty_ms'] == (10 + 30 + 2 * 20) * MINUTE_MS
+
+
+def test_icpc_rule_orders_by_solved_count_then_penalty():
+    rules = ScoringRules([1, 2], RULE_ICPC, penalty_minutes=20, started_at_ms=START_MS)
+    states = [
+        user('fast_but_wrong', solved=[(1, 5)], wrong=[1, 1]),    # 5 + 40 = 45分
+        user('slow', solved=[(1, 30)]),                            # 30分
+        user('two', solved=[(1, 50), (2, 90)], wrong=[2] * 5),     # 2問
+        user('tie_b', solved=[(1, 10)], wrong=[1]),                # 30分、最終正解 10分
+        user('tie_a', solved=[(1, 30)]),                           # 30分、最終正解 30分
+    ]
+    assert ranked(rules, states) == ['two', 'tie_b', 'slow', 'tie_a', 'fast_but_wrong']
+
+
+def test_points_rule_uses_problem_points():
+    rules = ScoringRules([1, 2], RULE_POINTS, points={1: 1, 2: 5}, started_at_ms=START_MS)
+    states = [user('many', solved=[(1, 1)]), user('hard', solved=[(2, 30)])]
+    assert ranked(rules, states) == ['hard', 'many']
+    assert rules.score(states[1])['points'] == 5
+
+
+def test_problems_outside_the_catalog_are_ignored():
+    rules = ScoringRules([1, 2], RULE_COUNT, started_at_ms=START_MS)
+    assert rules.score(user('alice', solved=[(3, 1)]))['solved_count'] == 0
+
+
+def test_rank_key_sorts_as_text_in_the_same_order_as_sort_key():
+    rules = ScoringRules([1, 2, 3], RULE_ICPC, started_at_ms=START_MS)
+    rng = random.Random(0)
+    states = []
+    for i in range(200):
+        solved = [(n, rng.randint(-5, 300)) for n in (1, 2, 3) if rng.random() < 0.5]
+        states.append(user(f'user{i:03d}', solved=solved, wrong=[rng.randint(1, 3) for _ in range(rng.randint(0, 4))]))
+    assert sorted(states, key=rules.rank_key) == sorted(states, key=rules.sort_key)
+
+
+def test_unknown_rule_is_rejected():
+    with pytest.raises(ValueError):
+        ScoringRules([1], 'golf')
+
+
+def test_ranked_board_reinserts_a_user_on_update():
+    rules = ScoringRules([1, 2], RULE_COUNT, started_at_ms=START_MS)
+    board = RankedBoard(rules)
+    assert board.upsert(user('alice', solved=[(1, 10)])) == 1
+    assert board.upsert(user('bob')) == 2
+    assert board.upsert(user('carol', solved=[(1, 5)])) == 1
+    assert [s.username for s in board.states()] == ['carol', 'alice', 'bob']
+
+    assert board.upsert(user('bob', solved=[(1, 20), (2, 21)])) == 1
+    assert [s.username for s in board.states()] == ['bob', 'carol', 'alice']
+    assert board.rank_of('alice') == 3
+    assert len(board) == 3
+
+    board.remove('carol')
+    board.remove('nobody')
+    assert [s.username for s in board.states()] == ['bob', 'alice']
+    assert board.rank_of('carol') is None and board.get('carol') is None
+    assert board.rank_of('alice') == 2
+
+
+def test_ranked_board_matches_a_full_sort():
+    rules = ScoringRules([1, 2, 3], RULE_ICPC, started_at_ms=START_MS)
+    board = RankedBoard(rules)
+    rng = random.Random(1)
+    latest = {}
+    for _ in range(500):
+        username = f'user{rng.randint(0, 40)}'
+        if rng.random() < 0.1:
+            board.remove(username)
+            latest.pop(username, None)
+            continue
+        state = user(username, solved=[(n, rng.randint(0, 100)) for n in (1, 2, 3) if rng.random() < 0.4],
+                     wrong=[rng.randint(1, 3) for _ in range(rng.randint(0, 3))])
+        board.upsert(state)
+        latest[username] = state
+    expected = sorted(latest.values(), key=rules.sort_key)
+    assert [s.username for s in board.states()] == [s.username for s in expected]
+    assert [board.rank_of(s.username) for s in expected] == list(range(1, len(expected) + 1))
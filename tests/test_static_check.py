@@ -0,0 +1,64 @@
+import pytest
+
+from static_check import analyze_uncached, check_solver
+
+ONE_ARGUMENT = {1}
+
+
+def check(code, arities=ONE_ARGUMENT):
+    return check_solver(analyze_uncached(code), arities)
+
+
+@pytest.mark.parametrize('code', [
+    "def solver(s):\n    return s\n",
+    "solver = lambda s: s\n",
+    "if True:\n    def solver(s):\n        return s\n",
+    "from functools import reduce as solver\n",
+    "exec('def solver(s): return s')\n",
+])
+def test_recognized_definitions_pass(code):
+    assert check(code) is None
+
+
+@pytest.mark.parametrize('code', [
+    "(solver := lambda s: s)\n",
+    "for solver in [lambda s: s]:\n    pass\n",
+    "import contextlib\nwith contextlib.nullcontext(lambda s: s) as solver:\n    pass\n",
+    "try:\n    raise ValueError\nexcept ValueError as solver:\n    pass\n",
+    "def make():\n    global solver\n    solver = lambda s: s\nmake()\n",
+    "match [lambda s: s]:\n    case [solver]:\n        pass\n",
+    "[solver := f for f in [len]]\n",
+])
+def test_other_binding_forms_are_left_to_the_sandbox(code):
+    # 静的に追えない束縛は、未定義の CE にしない
+    assert check(code) is None
+
+
+def test_rebinding_in_another_form_skips_the_arity_check():
+    code = "def solver():\n    return 1\nfor solver in [lambda s: s]:\n    pass\n"
+    assert check(code) is None
+
+
+def test_missing_solver_is_ce():
+    assert check("def solve(s):\n    return s\n") == 'solver is not defined'
+
+
+def test_wrong_arity_is_ce():
+    assert check("def solver():\n    return 1\n") == 'solver must accept 1 argument'
+    assert check("solver = lambda a, b: a\n", {0}) == 'solver must accept 0 arguments'
+
+
+def test_syntax_error_is_ce():
+    assert check("def solver(s)\n    return s\n").startswith('SyntaxError')
+
+
+@pytest.mark.parametrize('code', [
+    "solver = lambda s: " + "-" * 200_000 + "1\n",
+    "def solver(s):\n    return s\nx = " + "+".join(["1"] * 100_000) + "\n",
+])
+def test_too_deeply_nested_code_is_left_to_the_sandbox(code):
+    # ast.parse / ast.dump が RecursionError や MemoryError になるコードも、500 にせず実行に任せる
+    analysis = analyze_uncached(code)
+    assert analysis.error is None and analysis.defined and analysis.arity is None
+    assert analysis.fingerprint == analyze_uncached(code).fingerprint
+    assert check(code) is None
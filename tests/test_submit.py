@@ -0,0 +1,27 @@
+import json
+
+from test_judge_harness import AC_SOLVER
+
+
+def post(submit, body, resource='/submit'):
+    response = submit.handler({'resource': resource, 'body': json.dumps(body)}, None)
+    assert response['statusCode'] == 200
+    return json.loads(response['body'])
+
+
+def test_resubmitting_a_solved_problem_keeps_the_correct_result(aws, submit):
+    # 正解済みの問題への再提出も result は 'correct'。正解済みだったことは already_solved で分かる
+    import contest_config
+    contest_config.bump_version(aws.tables['GameStateTable'], True)
+    submit.contest_config.invalidate()
+    first = post(submit, {'username': 'resubmitter', 'problem_number': 1, 'code': AC_SOLVER})
+    assert first['result'] == 'correct' and 'already_solved' not in first
+
+    again = post(submit, {'username': 'resubmitter', 'problem_number': 1, 'code': AC_SOLVER})
+    assert again == {'result': 'correct', 'already_solved': True,
+                     'message': 'Already solved. No update to leaderboard.'}
+
+    batch = post(submit, {'username': 'resubmitter', 'submissions': [{'problem_number': 1, 'code': AC_SOLVER}]},
+                 resource='/submit/batch')
+    assert batch['results'][0]['result'] == 'correct'
+    assert batch['results'][0]['already_solved'] is True
@@ -25,4 +25,81 @@ class AppNav extends HTMLElement {
 }
 
 customElements.define('app-header', AppHeader);
-customElements.define('app-nav', AppNav);
\ No newline at end of file
+customElements.define('app-nav', AppNav);
+
+// WebSocket で届くリーダーボードとゲーム状態の変更を受け取る
+// handlers は { open, leaderboard, game_state } で、メッセージの type ごとに呼ばれる（open は接続・再接続のたび）
+// 接続が切れたら指数バックオフで繋ぎ直し、その間は poll() のポーリングが従来どおりの間隔に戻る
+class LiveUpdates {
+    constructor(handlers) {
+        this.handlers = handlers;
+        this.connected = false;
+        this.retryMs = 1000;
+        this.connect();
+    }
+
+    connect() {
+        const url = window.API_CONFIG?.ws;
+        if (!url || !window.WebSocket) return;
+        const socket = new WebSocket(url);
+        let keepAlive = null;
+        socket.addEventListener('open', () => {
+            this.connected = true;
+            this.retryMs = 1000;
+            // API Gateway はアイドル10分で切断するので、その前に空のメッセージを送る
+            keepAlive = setInterval(() => socket.send('{}'), 5 * 60 * 1000);
+            // 切れていた間の変更は届かないので、繋がったら全体を取り直す
+            this.handlers.open?.();
+        });
+        socket.addEventListener('message', (event) => {
+            let message;
+            try {
+                message = JSON.parse(event.data);
+            } catch (error) {
+                return;
+            }
+            this.handlers[message.type]?.(message);
+        });
+        socket.addEventListener('close', () => {
+            this.connected = false;
+            clearInterval(keepAlive);
+            setTimeout(() => this.connect(), this.retryMs);
+            this.retryMs = Math.min(this.retryMs * 2, 60000);
+        });
+    }
+
+    // 接続中は connectedIntervalMs ごと、切れている間は intervalMs ごとに callback を呼ぶ
+    // enabled を渡すと、それが false を返す間は呼ばない
+    poll(callback, intervalMs, connectedIntervalMs, enabled = () => true) {
+        let last = Date.now();
+        setInterval(() => {
+            const wait = this.connected ? connectedIntervalMs : intervalMs;
+            if (Date.now() - last < wait || !enabled()) return;
+            last = Date.now();
+            callback();
+        }, intervalMs);
+    }
+}
+
+// リーダーボードの差分を今の行に当てはめる
+// 変わったユーザーは新しい順位の位置に置き、残りのユーザーは今の並びのまま空いた位置を埋める
+// 差分で表せない変更（refresh）や、当てはめた結果が total 人にならない場合は null（呼び出し側で取り直す）
+function applyLeaderboardDelta(current, message) {
+    if (message.refresh) return null;
+    const changed = new Set(message.rows.map(row => row.username));
+    const removed = new Set(message.removed);
+    const rest = current.filter(row => !changed.has(row.username) && !removed.has(row.username));
+    const result = [];
+    let next = 0;
+    for (const row of message.rows) {
+        while (result.length < row.rank - 1 && next < rest.length) {
+            result.push(rest[next++]);
+        }
+        result.push(row);
+    }
+    while (next < rest.length) {
+        result.push(rest[next++]);
+    }
+    if (result.length !== message.total) return null;
+    return result.map((row, index) => ({ ...row, rank: index + 1 }));
+}
@@ -20,12 +20,22 @@ class ProblemPage {
         this.bindEvents();
         this.loadGameState();
         this.loadLeaderboard();
-        setInterval(() => {
-            if (this.autoRefresh) {
-                this.loadGameState();
-                this.loadLeaderboard();
-            }
-        }, 5000);
+        // 変更は WebSocket で受け取り、繋がっている間はポーリングを30秒ごとに間引く（切れている間は5秒ごと）
+        this.live = new LiveUpdates({
+            open: () => this.refresh(),
+            leaderboard: () => {
+                if (this.autoRefresh) this.loadLeaderboard();
+            },
+            game_state: (message) => this.showGameState(message.is_active)
+        });
+        this.live.poll(() => this.refresh(), 5000, 30000, () => this.autoRefresh);
+    }
+
+    refresh() {
+        if (this.autoRefresh) {
+            this.loadGameState();
+            this.loadLeaderboard();
+        }
     }
 
     bindEvents() {
@@ -85,22 +95,39 @@ class ProblemPage {
         try {
             const response = await fetch(`${API_URL}/game-state`);
             const data = await response.json();
-            if (data.is_active) {
-                this.gameStatus.textContent = '🟢 ゲーム進行中';
-                this.gameStatus.style.color = '#007600';
-            } else {
-                this.gameStatus.textContent = '🔴 ゲーム停止中';
-                this.gameStatus.style.color = '#d13212';
-            }
+            this.showGameState(data.is_active);
         } catch (error) {
             console.error('Failed to load game state:', error);
         }
     }
 
+    showGameState(isActive) {
+        if (isActive) {
+            this.gameStatus.textContent = '🟢 ゲーム進行中';
+            this.gameStatus.style.color = '#007600';
+        } else {
+            this.gameStatus.textContent = '🔴 ゲーム停止中';
+            this.gameStatus.style.color = '#d13212';
+        }
+    }
+
+    async fetchLeaderboard() {
+        // CloudFrontから配信される静的スナップショットを優先し、取得できない場合はAPIにフォールバック
+        try {
+            const response = await fetch('data/leaderboard.json', { cache: 'no-cache' });
+            if (response.ok) {
+                return await response.json();
+            }
+        } catch (error) {
+            console.error('Failed to load leaderboard snapshot:', error);
+        }
+        const response = await fetch(`${API_URL}/leaderboard`);
+        return await response.json();
+    }
+
     async loadLeaderboard() {
         try {
-            const response = await fetch(`${API_URL}/leaderboard`);
-            const data = await response.json();
+            const data = await this.fetchLeaderboard();
             const tbody = document.getElementById('leaderboard');
             tbody.textContent = '';
             